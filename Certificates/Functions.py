@@ -1,5 +1,7 @@
 from firebase_admin import firestore
 from datetime import datetime, timezone
+from Courses.Stats import record_enrollment_change
+from Helpers.Activity import record_activity
 
 
 def AddCertificate(request):
@@ -39,16 +41,14 @@ def AddCertificate(request):
 
         if user_doc.exists:
             user_data = user_doc.to_dict()
-            enrolled_courses = user_data.get("enrolledCourses", [])
-
-            # Update the course with finishedAt
-            for course in enrolled_courses:
-                if course.get("courseId") == courseId:
-                    course["finishedAt"] = finished_at
-                    break
-
-            # Save the updated enrolledCourses back to Firestore
-            user_ref.update({"enrolledCourses": enrolled_courses})
+            course_info = user_data.get("enrolledCourses", {}).get(courseId)
+
+            # Mark the enrollment finished, a re-issued certificate keeps the first date
+            if course_info and not course_info.get("finishedAt"):
+                user_ref.update({f"enrolledCourses.{courseId}.finishedAt": finished_at})
+                record_enrollment_change(db, courseId, course_info, dict(course_info, finishedAt=finished_at))
+            record_activity(db, idUser, "Earned Certificate", prepared_data["courseName"] or "Unknown Course",
+                            courseId=courseId, certificateId=idCertif)
 
         # Return success response
         return {"data": idCertif}, 200
@@ -4,6 +4,8 @@ import os
 from datetime import datetime, timezone
 import threading
 from Quizzes.Functions import create_and_save_quiz
+from Chapters.Index import invalidate_course_index
+from Helpers.Pagination import Page
 
 def SaveChapter(request):
     try:
@@ -46,6 +48,7 @@ def SaveChapter(request):
                 course_ref.update({"duration": new_duration})
 
         date, response = db.collection("chapters").add(data)
+        invalidate_course_index(course_id)
         resp = {"data": response.id}, 200
         # Handle quiz creation in background
         def async_quiz():
@@ -59,17 +62,12 @@ def SaveChapter(request):
         print(f"An error occurred: {e}")
         return {"error": str(e)}, 500
 
-def GetChapters():
+def GetChapters(limit=None, cursor=None, fields=None, stream=False):
     try:
         db = firestore.client()
-        chapters_ref = db.collection("chapters")
-        docs = chapters_ref.stream()
-        chapters = []
-        for doc in docs:
-            chapter_data = doc.to_dict()
-            chapter_data['id'] = doc.id
-            chapters.append(chapter_data)
-        return chapters
+        # Paged by document id and projected to `fields`, see Helpers.Pagination
+        page = Page(db.collection("chapters"), limit, cursor, fields)
+        return (page if stream else page.payload()), 200
     except Exception as e:
         print(f"An error occurred: {e}")
         return {"error": str(e)}, 500
@@ -156,6 +154,8 @@ def UpdateChapter(id, request):
                 course_ref.update({"duration": updated_course_duration})
 
         doc_ref.update(data)
+        # The chapter may have moved to another course
+        invalidate_course_index(course_id, chapter_data.get("courseId"))
         # Call create_and_save_quiz after updating a chapter
         course_id = data.get("courseId") or chapter_data.get("courseId")
         title = data.get("title") or chapter_data.get("title", "")
@@ -211,6 +211,7 @@ def DeleteChapter(id):
 
         # Delete the document from Firestore
         db.collection("chapters").document(id).delete()
+        invalidate_course_index(course_id)
         # Call create_and_save_quiz after deleting a chapter
         chapter_data = doc.to_dict()
         course_id = chapter_data.get("courseId")
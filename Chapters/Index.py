@@ -0,0 +1,97 @@
+from Helpers.TTLCache import TTLCache
+from Helpers.BatchRead import chunked
+import os
+
+# Chapters only change through Chapters.Functions, which invalidates the
+# course on every write. The TTL bounds staleness across app instances.
+CHAPTER_INDEX_TTL = int(os.getenv("CHAPTER_INDEX_TTL", 3600))
+CHAPTER_INDEX_SIZE = int(os.getenv("CHAPTER_INDEX_SIZE", 2000))
+# Firestore caps 'in' filters at 30 values
+CHAPTER_INDEX_QUERY_SIZE = 30
+
+
+def chapter_duration(value):
+    # Durations are stored as strings from the chapter form, in minutes
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return 0
+
+
+class CourseIndex:
+    # Ordered chapter ids of one course with their titles and durations, so
+    # progress is set arithmetic on ids instead of a chapters query
+    def __init__(self, chapters):
+        self.ids = [chapter_id for chapter_id, _ in chapters]
+        self.positions = {chapter_id: position for position, chapter_id in enumerate(self.ids)}
+        self.titles = {chapter_id: data.get("title") for chapter_id, data in chapters}
+        self.durations = {chapter_id: chapter_duration(data.get("duration", 0)) for chapter_id, data in chapters}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def completed(self, completed_chapters):
+        return self.positions.keys() & set(completed_chapters)
+
+    def progress(self, completed_chapters):
+        # Percentage of this course's chapters found in completed_chapters
+        return len(self.completed(completed_chapters)) / len(self.ids) * 100 if self.ids else 0
+
+    def current_chapter(self, completed_chapters):
+        # Chapter after the last completed one, the last chapter once it is
+        # completed, and the first one when nothing known has been completed
+        if not self.ids:
+            return None
+        if not completed_chapters or completed_chapters[-1] not in self.positions:
+            return self.ids[0]
+        position = self.positions[completed_chapters[-1]]
+        return self.ids[min(position + 1, len(self.ids) - 1)]
+
+    def next_chapter(self, completed_chapters):
+        # First chapter in course order that is not completed
+        completed = set(completed_chapters)
+        return next((chapter_id for chapter_id in self.ids if chapter_id not in completed), None)
+
+    def completed_duration(self, completed_chapters):
+        return sum(self.durations[chapter_id] for chapter_id in self.completed(completed_chapters))
+
+
+chapter_index = TTLCache(maxsize=CHAPTER_INDEX_SIZE, ttl=CHAPTER_INDEX_TTL)
+
+
+def load_course_indexes(db, course_ids):
+    # One query per 30 courses, ordered like GetChapterByCourse
+    chapters = {course_id: [] for course_id in course_ids}
+    for chunk in chunked(course_ids, CHAPTER_INDEX_QUERY_SIZE):
+        query = db.collection("chapters").where("courseId", "in", chunk).order_by("order")
+        for doc in query.stream():
+            data = doc.to_dict() or {}
+            chapters[data.get("courseId")].append((doc.id, data))
+    return {course_id: CourseIndex(course_chapters) for course_id, course_chapters in chapters.items()}
+
+
+def get_course_indexes(db, course_ids):
+    # {course_id: CourseIndex}, only courses missing from the cache are queried
+    indexes = {}
+    missing = []
+    for course_id in dict.fromkeys(course_ids):
+        cached = chapter_index.get(course_id) if course_id else CourseIndex([])
+        if cached is not None:
+            indexes[course_id] = cached
+        else:
+            missing.append(course_id)
+    if missing:
+        for course_id, index in load_course_indexes(db, missing).items():
+            chapter_index.set(course_id, index)
+            indexes[course_id] = index
+    return indexes
+
+
+def get_course_index(db, course_id):
+    return get_course_indexes(db, [course_id]).get(course_id) or CourseIndex([])
+
+
+def invalidate_course_index(*course_ids):
+    for course_id in course_ids:
+        if course_id:
+            chapter_index.invalidate(course_id)
@@ -1,4 +1,5 @@
 from flask import Blueprint, request, jsonify
+from Helpers.Pagination import page_params, page_response
 from Chapters.Functions import SaveChapter, GetChapters, UpdateChapter, GetChapterByCourse, DeleteChapter,GetChapter
 
 ChaptersRoutes = Blueprint('ChaptersRoutes', __name__)
@@ -12,14 +13,13 @@ def courses():
         response, status = SaveChapter(request)
         return jsonify(response), status
     if request.method == 'GET':
+        # ?limit=N&cursor=<last id>&fields=a,b&stream=1, see Helpers.Pagination
         try:
-            response = GetChapters()
-            if response is None:
-                return jsonify({"message": "No courses found"}), 404
-
-            return jsonify({"data": response}), 200
-        except Exception as e:
-            return jsonify({"error": str(e)}), 500
+            params = page_params(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        response, status = GetChapters(*params)
+        return page_response(response, status)
 
 
 @ChaptersRoutes.route(baseurl+"/<id>", methods=['POST', 'GET', "DELETE"])
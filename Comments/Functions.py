@@ -1,5 +1,7 @@
 from firebase_admin import firestore
 from datetime import datetime, timezone
+from Helpers.Activity import record_activity
+from Helpers.Pagination import Page
 
 
 def AddComment(request):
@@ -18,6 +20,16 @@ def AddComment(request):
         db = firestore.client()
         comment_ref = db.collection("comments").add(data)
 
+        # The author is the userId, like logs and activity. Comments without
+        # one are still saved, they just have no activity event.
+        author = data.get("userId")
+        course_id = data.get("courseId")
+        if author:
+            course_doc = db.collection("courses").document(course_id).get() if course_id else None
+            course_name = course_doc.to_dict().get("title") if course_doc is not None and course_doc.exists else None
+            record_activity(db, author, "Commented", course_name or "Unknown Course",
+                            courseId=course_id, commentId=comment_ref[1].id)
+
         return {"data": comment_ref[1].id}, 200
     except Exception as e:
         print(f"An error occurred: {e}")
@@ -75,23 +87,12 @@ def UpdateComment(id, request):
         return {"error": str(e)}, 500
 
 
-def GetAllComments():
+def GetAllComments(limit=None, cursor=None, fields=None, stream=False):
     try:
-        # Connect to Firestore
         db = firestore.client()
-
-        # Query all comments
-        comments_ref = db.collection("comments")
-        docs = comments_ref.stream()
-
-        # Collect all comments
-        comments = []
-        for doc in docs:
-            comment_data = doc.to_dict()
-            comment_data["id"] = doc.id
-            comments.append(comment_data)
-
-        return comments
+        # Paged by document id and projected to `fields`, see Helpers.Pagination
+        page = Page(db.collection("comments"), limit, cursor, fields)
+        return (page if stream else page.payload()), 200
     except Exception as e:
         print(f"An error occurred: {e}")
         return {"error": str(e)}, 500
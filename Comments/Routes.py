@@ -1,4 +1,5 @@
 from flask import Blueprint, request, jsonify
+from Helpers.Pagination import page_params, page_response
 from Comments.Functions import AddComment,GetComments,UpdateComment,GetAllComments
 
 CommentsRoutes = Blueprint('CommentsRoutes', __name__)
@@ -12,14 +13,13 @@ def Comments():
         response, status = AddComment(request)
         return jsonify(response), status
     if request.method == 'GET':
+        # ?limit=N&cursor=<last id>&fields=a,b&stream=1, see Helpers.Pagination
         try:
-            response = GetAllComments()
-            if response is None:
-                return jsonify({"message": "No courses found"}), 404
-
-            return jsonify({"data": response}), 200
-        except Exception as e:
-            return jsonify({"error": str(e)}), 500
+            params = page_params(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        response, status = GetAllComments(*params)
+        return page_response(response, status)
 
 
 @CommentsRoutes.route(baseurl + "/<courseId>", methods=['GET', 'POST'])
@@ -1,8 +1,11 @@
 from firebase_admin import firestore
 from werkzeug.utils import secure_filename
 import os
-from datetime import datetime, timezone, timedelta
-from Users.Functions import GetProgress,GetSingleProgress
+from datetime import datetime, timezone
+from Chapters.Index import get_course_index
+from Helpers.BatchRead import get_snapshots
+from Helpers.Pagination import Page
+from Courses.Stats import load_course_stats, course_statistics, reconcile_course_stats
 import json
 
 
@@ -41,21 +44,17 @@ def SaveCourse(request):
         print(f"An error occurred: {e}")
         return {"error": str(e)}, 500
     
-def GetCourses():
+def GetCourses(limit=None, cursor=None, fields=None, stream=False):
     try:
         db = firestore.client()
-        courses_ref = db.collection("courses")
-        docs = courses_ref.stream()
-        courses = []
-        for doc in docs:
-            course_data = doc.to_dict()
-            course_data['id'] = doc.id
-            courses.append(course_data)
-        return courses
+        # Paged by document id and projected to `fields`, see Helpers.Pagination
+        page = Page(db.collection("courses"), limit, cursor, fields)
+        return (page if stream else page.payload()), 200
     except Exception as e:
         print(f"An error occurred: {e}")
-        return {"error": str(e)}, 500    
-    
+        return {"error": str(e)}, 500
+
+
 def GetCourse(id):
     try:
         db = firestore.client()
@@ -139,78 +138,15 @@ def GetCourseStatistics(course_id):
         if not course_doc.exists:
             return {"error": "Course not found"}, 404
 
-        course_data = course_doc.to_dict()
-        enrolled_students = course_data.get("enrolledStudents", [])
-        total_enrolled = len(enrolled_students)
-
-        # Calculate overall completion rate
-        total_completion = 0
-        for user_id in enrolled_students:
-            user_progress = GetProgress(user_id)
-            if user_progress:
-                course_progress = next((item for item in user_progress if item.get("courseId") == course_id), None)
-                if course_progress:
-                    total_completion += course_progress.get("progress", 0)
-        completion_rate = (total_completion / total_enrolled) if total_enrolled > 0 else 0
-
-        # Calculate enrollment rate this month, average completion time, and dropout rate
-        users_ref = db.collection("users")
-        users_docs = users_ref.stream()
-        enrolled_this_month = 0
-        completion_times = []
-        dropout_count = 0
-        now = datetime.now(timezone.utc)
-        two_months_ago = now - timedelta(days=60)
-        for user_doc in users_docs:
-            user_data = user_doc.to_dict()
-            enrolled_courses = user_data.get("enrolledCourses", {})
-            course_info = enrolled_courses.get(course_id)
-            if course_info:
-                enrolled_at = course_info.get("enrolledAt")
-                finished_at = course_info.get("finishedAt")
-                progress = course_info.get("progress", 0)
-                # Enrolled this month
-                if enrolled_at:
-                    try:
-                        enrolled_at_dt = datetime.fromisoformat(enrolled_at)
-                        if enrolled_at_dt.year == now.year and enrolled_at_dt.month == now.month:
-                            enrolled_this_month += 1
-                    except Exception:
-                        pass
-                # Average completion time for those who finished
-                if enrolled_at and finished_at and progress == 100:
-                    try:
-                        enrolled_at_dt = datetime.fromisoformat(enrolled_at)
-                        finished_at_dt = datetime.fromisoformat(finished_at)
-                        completion_time = (finished_at_dt - enrolled_at_dt).total_seconds() / 3600  # in hours
-                        completion_times.append(completion_time)
-                    except Exception:
-                        pass
-                # Dropout: not finished and enrolledAt > 2 months ago
-                if enrolled_at and (progress < 100 or not finished_at):
-                    try:
-                        enrolled_at_dt = datetime.fromisoformat(enrolled_at)
-                        if enrolled_at_dt < two_months_ago:
-                            dropout_count += 1
-                    except Exception:
-                        pass
-
-        avg_completion_time = (sum(completion_times) / len(completion_times)) if completion_times else 0
-        dropout_rate = (dropout_count / total_enrolled) * 100 if total_enrolled > 0 else 0
-
-        return {
-            "totalEnrolled": total_enrolled,
-            "completionRate": completion_rate,
-            "enrolledThisMonth": enrolled_this_month,
-            "averageCompletionTimeHours": avg_completion_time,
-            "dropoutRate": dropout_rate
-        }, 200
+        # Counters maintained incrementally, see Courses.Stats
+        counters = load_course_stats(db, course_id)
+        return course_statistics(counters), 200
     except Exception as e:
         print(f"An error occurred: {e}")
         return {"error": str(e)}, 500
 
 
-def GetEnrolledStudents(course_id):
+def GetEnrolledStudents(course_id, limit=None, cursor=None):
     try:
         db = firestore.client()
         course_ref = db.collection("courses").document(course_id)
@@ -222,24 +158,50 @@ def GetEnrolledStudents(course_id):
         course_data = course_doc.to_dict()
         enrolled_students = course_data.get("enrolledStudents", [])
 
+        # Pages follow the enrolledStudents order, the cursor is the last user id of the previous page
+        start = 0
+        if cursor:
+            if cursor not in enrolled_students:
+                return {"error": "Invalid cursor"}, 400
+            start = enrolled_students.index(cursor) + 1
+        end = len(enrolled_students) if limit is None else min(start + limit, len(enrolled_students))
+        page = enrolled_students[start:end]
+
+        # One batched read for the users, progress from the cached chapter index
+        user_docs = get_snapshots(db, "users", page)
+        index = get_course_index(db, course_id)
         students_data = []
-        for user_id in enrolled_students:
-            # Retrieve the full user object
-            user_ref = db.collection("users").document(user_id)
-            user_doc = user_ref.get()
-            if not user_doc.exists:
+        for user_id in page:
+            user_doc = user_docs.get(user_id)
+            if user_doc is None or not user_doc.exists:
                 continue
 
             user_data = user_doc.to_dict()
             user_data["id"] = user_id  # Include the user ID
 
-            # Retrieve the progress for the course
-            progress = GetSingleProgress(user_id, course_id)
-            user_data["progress"] = progress if progress else {}
+            course_info = user_data.get("enrolledCourses", {}).get(course_id)
+            completed_chapters = course_info.get("completedChapters", []) if course_info else []
+            user_data["progress"] = {
+                "courseId": course_id,
+                "progress": index.progress(completed_chapters),
+                "currentChapter": index.current_chapter(completed_chapters)
+            } if course_info else {}
 
             students_data.append(user_data)
 
-        return {"students": students_data}, 200
+        return {
+            "students": students_data,
+            "total": len(enrolled_students),
+            "nextCursor": page[-1] if page and end < len(enrolled_students) else None
+        }, 200
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        return {"error": str(e)}, 500
+
+
+def ReconcileCourseStatistics():
+    try:
+        return reconcile_course_stats(), 200
     except Exception as e:
         print(f"An error occurred: {e}")
-        return {"error": str(e)}, 500
\ No newline at end of file
+        return {"error": str(e)}, 500
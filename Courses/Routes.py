@@ -1,5 +1,6 @@
 from flask import Blueprint, request, jsonify
-from Courses.Functions import SaveCourse,GetCourses,GetCourse,UpdateCourse,DeleteCourse,GetCourseStatistics,GetEnrolledStudents
+from Helpers.Pagination import page_params, page_response
+from Courses.Functions import SaveCourse,GetCourses,GetCourse,UpdateCourse,DeleteCourse,GetCourseStatistics,GetEnrolledStudents,ReconcileCourseStatistics
 
 CoursesRoutes = Blueprint('CoursesRoutes', __name__)
 
@@ -11,14 +12,13 @@ def courses():
         response, status = SaveCourse(request)
         return jsonify(response), status
     if request.method == 'GET':
+        # ?limit=N&cursor=<last id>&fields=a,b&stream=1, see Helpers.Pagination
         try:
-            response = GetCourses()
-            if response is None:
-                return jsonify({"message": "No courses found"}), 404
-            
-            return jsonify({"data": response}), 200
-        except Exception as e:
-            return jsonify({"error": str(e)}), 500
+            params = page_params(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        response, status = GetCourses(*params)
+        return page_response(response, status)
     
 
 @CoursesRoutes.route(baseurl+"/<id>", methods=['GET',"POST", 'DELETE'])
@@ -46,19 +46,32 @@ def course(id):
 @CoursesRoutes.route(baseurl + "/stats/<id>", methods=['GET'])
 def CourseStatistics(id):
     if request.method == 'GET':
-        response = GetCourseStatistics(id)
-        if response is None:
-            return jsonify({"message": "No course found"}), 404
+        response, status = GetCourseStatistics(id)
+        if status != 200:
+            return jsonify(response), status
 
         return jsonify({"data": response}), 200
 
 
+@CoursesRoutes.route(baseurl + "/stats/reconcile", methods=['POST'])
+def ReconcileStatistics():
+    response, status = ReconcileCourseStatistics()
+    return jsonify(response), status
+
+
 @CoursesRoutes.route(baseurl + "/enrolled/<id>", methods=['GET'])
 def GetEnrolledStudent(id):
     if request.method == 'GET':
-        response = GetEnrolledStudents(id)
-        if response is None:
-            return jsonify({"message": "No course found"}), 404
-
-        return jsonify(response), 200
+        # ?limit=N&cursor=<last user id> pages through large classes
+        limit = request.args.get('limit', type=int)
+        if limit is not None and limit <= 0:
+            return jsonify({"error": "limit must be a positive integer"}), 400
+        cursor = request.args.get('cursor')
+        response, status = GetEnrolledStudents(id, limit, cursor)
+        if limit is None and cursor is None:
+            # Unpaged requests keep the original body, a JSON array [{"students": [...]}, status]
+            if status == 200:
+                response = {"students": response["students"]}
+            return jsonify([response, status]), 200
+        return jsonify(response), status
 
@@ -0,0 +1,161 @@
+from firebase_admin import firestore
+from datetime import datetime, timezone, timedelta
+from Helpers.BatchRead import get_snapshots
+import sys
+
+# course_stats/{course} counters, kept up to date by Enroll, UpdateProgress and
+# AddCertificate through record_enrollment_change and rebuilt by the reconcile job:
+#   {'enrolled', 'enrolledByMonth': {'YYYY-MM': n}, 'progressSum',
+#    'completed', 'completionHoursSum', 'completionHours': {bucket: n},
+#    'unfinishedByDay': {'YYYY-MM-DD': n}, 'reconciledAt'}
+# Counter updates are not transactional with the user write, the periodic
+# reconcile job corrects any drift.
+
+# Upper bounds (hours) of the completion time histogram buckets
+COMPLETION_BUCKETS = [1, 6, 24, 72, 168, 336, 720]
+# Enrolled students who have not finished after this many days count as dropouts
+DROPOUT_DAYS = 60
+
+
+def parse_time(value):
+    if not value:
+        return None
+    try:
+        value = datetime.fromisoformat(value) if isinstance(value, str) else value
+    except ValueError:
+        return None
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+def completion_bucket(hours):
+    return next((str(bound) for bound in COMPLETION_BUCKETS if hours <= bound), 'inf')
+
+
+def enrollment_counters(course_info):
+    # Contribution of one enrolledCourses.<course> entry to the counters, as
+    # {field: value} with map keys as (field, key) tuples
+    if not course_info:
+        return {}
+    enrolled_at = parse_time(course_info.get("enrolledAt"))
+    finished_at = parse_time(course_info.get("finishedAt"))
+    progress = float(course_info.get("progress", 0) or 0)
+    counters = {'enrolled': 1, 'progressSum': progress}
+    if enrolled_at:
+        counters[('enrolledByMonth', enrolled_at.strftime('%Y-%m'))] = 1
+    if enrolled_at and finished_at and progress == 100:
+        hours = (finished_at - enrolled_at).total_seconds() / 3600
+        counters['completed'] = 1
+        counters['completionHoursSum'] = hours
+        counters[('completionHours', completion_bucket(hours))] = 1
+    elif enrolled_at:
+        counters[('unfinishedByDay', enrolled_at.strftime('%Y-%m-%d'))] = 1
+    return counters
+
+
+def nest(counters, wrap=lambda value: value):
+    document = {}
+    for field, value in counters.items():
+        if isinstance(field, tuple):
+            document.setdefault(field[0], {})[field[1]] = wrap(value)
+        else:
+            document[field] = wrap(value)
+    return document
+
+
+def record_enrollment_change(db, course_id, old_info, new_info):
+    # Applies the difference between two states of a user's enrollment in a
+    # course as Increments. A failure must never fail the user's own write.
+    try:
+        old, new = enrollment_counters(old_info), enrollment_counters(new_info)
+        delta = {field: new.get(field, 0) - old.get(field, 0) for field in old.keys() | new.keys()}
+        delta = {field: value for field, value in delta.items() if value}
+        if delta:
+            db.collection("course_stats").document(course_id).set(nest(delta, firestore.Increment), merge=True)
+    except Exception as e:
+        print(f"Error updating course stats for {course_id}: {e}")
+
+
+def course_counters(course_id, user_docs):
+    totals = {}
+    for user_doc in user_docs:
+        course_info = (user_doc.to_dict() or {}).get("enrolledCourses", {}).get(course_id)
+        for field, value in enrollment_counters(course_info).items():
+            totals[field] = totals.get(field, 0) + value
+    counters = {'enrolled': 0, 'progressSum': 0, 'completed': 0, 'completionHoursSum': 0,
+                'enrolledByMonth': {}, 'completionHours': {}, 'unfinishedByDay': {}}
+    counters.update(nest(totals))
+    return counters
+
+
+def reconcile_course_stats(db=None, course_ids=None):
+    # Rebuilds the counters from the users enrolled in each course, every
+    # distinct user is read once. Writes are conditioned on the stats document
+    # being unchanged since it was read, so counters incremented meanwhile are
+    # left for the next run.
+    db = db or firestore.client()
+    started = datetime.now(timezone.utc)
+    if course_ids:
+        course_docs = [doc for doc in get_snapshots(db, "courses", course_ids).values() if doc.exists]
+    else:
+        course_docs = list(db.collection("courses").select(["enrolledStudents"]).stream())
+    enrolled = {doc.id: (doc.to_dict() or {}).get("enrolledStudents", []) for doc in course_docs}
+    stats_docs = get_snapshots(db, "course_stats", enrolled.keys())
+    user_docs = get_snapshots(db, "users", [user_id for students in enrolled.values() for user_id in students])
+
+    report = {'courses': len(enrolled), 'reconciled': 0, 'skipped': 0}
+
+    def on_error(failure, writer):
+        report['skipped'] += 1
+        return False
+
+    writer = db.bulk_writer()
+    writer.on_write_error(on_error)
+    for course_id, students in enrolled.items():
+        counters = course_counters(course_id, [user_docs[user_id] for user_id in students
+                                               if user_id in user_docs and user_docs[user_id].exists])
+        counters['reconciledAt'] = started
+        stats_doc = stats_docs.get(course_id)
+        if stats_doc is not None and stats_doc.exists:
+            writer.update(stats_doc.reference, counters, option=db.write_option(last_update_time=stats_doc.update_time))
+        else:
+            writer.create(db.collection("course_stats").document(course_id), counters)
+    writer.close()
+
+    report['reconciled'] = len(enrolled) - report['skipped']
+    report['seconds'] = round((datetime.now(timezone.utc) - started).total_seconds(), 2)
+    return report
+
+
+def load_course_stats(db, course_id):
+    # Counters of one course, reconciled on first use
+    stats_doc = db.collection("course_stats").document(course_id).get()
+    if not stats_doc.exists or not (stats_doc.to_dict() or {}).get("reconciledAt"):
+        reconcile_course_stats(db, [course_id])
+        stats_doc = db.collection("course_stats").document(course_id).get()
+    return (stats_doc.to_dict() or {}) if stats_doc.exists else {}
+
+
+def course_statistics(counters, now=None):
+    now = now or datetime.now(timezone.utc)
+    total_enrolled = counters.get("enrolled", 0)
+    completed = counters.get("completed", 0)
+    dropout_before = (now - timedelta(days=DROPOUT_DAYS)).strftime('%Y-%m-%d')
+    dropout_count = sum(count for day, count in counters.get("unfinishedByDay", {}).items() if day < dropout_before)
+    return {
+        "totalEnrolled": total_enrolled,
+        "completionRate": counters.get("progressSum", 0) / total_enrolled if total_enrolled > 0 else 0,
+        "enrolledThisMonth": counters.get("enrolledByMonth", {}).get(now.strftime('%Y-%m'), 0),
+        "averageCompletionTimeHours": counters.get("completionHoursSum", 0) / completed if completed > 0 else 0,
+        "completionTimeHistogram": counters.get("completionHours", {}),
+        "dropoutRate": (dropout_count / total_enrolled) * 100 if total_enrolled > 0 else 0
+    }
+
+
+if __name__ == '__main__':
+    # Scheduled periodically with: python -m Courses.Stats reconcile [courseId ...]
+    from Firebase import setupfirebase
+    if len(sys.argv) < 2 or sys.argv[1] != 'reconcile':
+        print("Usage: python -m Courses.Stats reconcile [courseId ...]")
+        sys.exit(1)
+    setupfirebase()
+    print(reconcile_course_stats(course_ids=sys.argv[2:] or None))
@@ -0,0 +1,49 @@
+from concurrent.futures import ThreadPoolExecutor
+from Helpers.BatchRead import chunked, get_snapshots
+from Helpers.FundLookup import FundResolver
+from Deposit.Holdings import holdings_from_snapshot
+from Deposit.Analytics import PortfolioArrays
+import os
+
+# Upper bound on concurrent Firestore RPCs issued for one dashboard request
+MANAGER_STATS_WORKERS = int(os.getenv("MANAGER_STATS_WORKERS", 8))
+
+ORDER_ACTIONS = ['Buy', 'Sell']
+# Firestore allows at most 30 disjunctions per query: userId in [...] x action in [...]
+ORDERS_COUNT_CHUNK = 30 // len(ORDER_ACTIONS)
+
+
+def count_orders(db, user_ids):
+    query = db.collection('logs') \
+        .where('userId', 'in', user_ids) \
+        .where('action', 'in', ORDER_ACTIONS)
+    result = query.count(alias='orders').get()
+    return int(result[0][0].value)
+
+
+def aggregate_manager_stats(db, managed_users, workers=MANAGER_STATS_WORKERS):
+    user_ids = list(dict.fromkeys(user_id for user_id in managed_users if user_id))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # Order counts are server-side aggregations, start them first
+        orders_futures = [pool.submit(count_orders, db, chunk)
+                          for chunk in chunked(user_ids, ORDERS_COUNT_CHUNK)]
+
+        assets_docs = get_snapshots(db, 'assets', user_ids, pool=pool)
+        users_assets = {
+            user_id: holdings_from_snapshot(snapshot)
+            for user_id, snapshot in assets_docs.items()
+        }
+        funds = FundResolver(db)
+        funds.resolve((asset.get('isin') for assets in users_assets.values() for asset in assets), pool=pool)
+
+        active_orders = sum(future.result() for future in orders_futures)
+
+    portfolio = PortfolioArrays({user_id: users_assets.get(user_id, []) for user_id in user_ids}, funds)
+    total_aum = float(portfolio.value.sum())
+    avg_perf = portfolio.average_performance()
+    return {
+        'total_clients': len(managed_users),
+        'total_aum': round(total_aum, 2),
+        'avg_performance': round(avg_perf, 2),
+        'active_orders': active_orders
+    }
@@ -0,0 +1,332 @@
+from datetime import datetime, timezone, timedelta
+from functools import cached_property
+from Helpers.NavHistory import RETURN_PERIODS
+import numpy as np
+
+
+# Below this many values the builtin round is cheaper than the array passes
+ROUND2_VECTOR_MIN = 64
+
+
+def round2(values):
+    # Same results as Python's round(value, 2). np.round scales by 100 first,
+    # which can tip values sitting on a halfway point, those few are redone
+    # with the builtin.
+    if len(values) < ROUND2_VECTOR_MIN:
+        return [round(value, 2) for value in values.tolist()]
+    scaled = values * 100
+    rounded = np.round(values, 2).tolist()
+    for row in np.flatnonzero(np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6).tolist():
+        rounded[row] = round(float(values[row]), 2)
+    return rounded
+
+
+def parse_purchase_date(value):
+    if not value:
+        return None
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except Exception:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+# Integer value of NaT in a datetime64 array
+NAT = np.iinfo(np.int64).min
+# Within this relative distance the returns job's lastnav is the latest NAV
+SAME_NAV_TOLERANCE = 1e-9
+
+
+class PortfolioArrays:
+    # Holdings of one or many users flattened into aligned NumPy arrays, one
+    # row per holding. `owner` maps each row to its position in user_ids, so
+    # per-user totals are a bincount instead of a Python loop per asset.
+    # Every asset field is read in one pass and fund fields once per distinct
+    # fund, values only some views need are computed on first use.
+    def __init__(self, users_assets, funds):
+        self.user_ids = list(users_assets)
+        self.assets = [asset for assets in users_assets.values() for asset in assets]
+        self.rows = len(self.assets)
+        self.owner = np.repeat(np.arange(len(self.user_ids), dtype=np.int64),
+                               [len(assets) for assets in users_assets.values()])
+        self.isins = [asset.get('isin') for asset in self.assets]
+        # One lookup per distinct fund, holdings of the same ISIN share it and
+        # fund columns are gathered through fund_row
+        by_isin = {isin: funds.get(isin) for isin in dict.fromkeys(self.isins)}
+        self.distinct_funds = list(by_isin.values())
+        positions = {isin: position for position, isin in enumerate(by_isin)}
+        self.fund_row = np.array([positions[isin] for isin in self.isins], dtype=np.int64)
+        self.funds = [by_isin[isin] for isin in self.isins]
+
+        # shares, nav, old_nav per holding, missing old_nav falls back to nav
+        self.shares, self.nav, old_nav = np.array([[asset.get('shares', 0) for asset in self.assets],
+                                                   [asset.get('nav', 0) for asset in self.assets],
+                                                   [asset.get('old_nav') for asset in self.assets]],
+                                                  dtype=float).reshape(3, self.rows)
+        self.old_nav = np.where(np.isnan(old_nav), self.nav, old_nav)
+        # The latest NAV falls back to nav when the fund is unknown
+        self.latest = self.fund_column(lambda fund: fund.latestnav)
+        self.current_nav = np.where(np.isnan(self.latest), self.nav, self.latest)
+
+        self.invested = self.shares * self.old_nav
+        self.value = self.shares * self.current_nav
+        self.gains = self.value - self.invested
+        self.priced = self.old_nav > 0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.performance = np.where(self.priced, (self.current_nav - self.old_nav) / self.old_nav * 100, 0.0)
+            self.gains_percentage = np.where(self.invested > 0, self.gains / self.invested * 100, 0.0)
+
+    def fund_column(self, value):
+        # value(fund) per holding as floats, NaN where it is None
+        return np.array([value(fund) for fund in self.distinct_funds], dtype=float)[self.fund_row]
+
+    @cached_property
+    def prev_nav(self):
+        # Previous published NAV from the daily returns job. prevnav only
+        # precedes the current NAV when the job ran on it (lastnav), after a
+        # newer NAV was ingested the job's 1D return is served instead. Holdings
+        # of funds the job has not covered yet show no daily change.
+        prev_nav = self.fund_column(lambda fund: fund.prevnav)
+        last_nav = self.fund_column(lambda fund: fund.lastnav)
+        day_return = self.fund_column(lambda fund: fund.returns.get('1D'))
+        same_nav = np.abs(last_nav - self.latest) <= SAME_NAV_TOLERANCE * np.abs(self.latest)
+        use_prev = same_nav & ~np.isnan(prev_nav) & (prev_nav > 0)
+        use_return = ~use_prev & ~np.isnan(day_return) & (day_return > -100)
+        with np.errstate(invalid='ignore'):
+            prev_nav = np.where(use_prev, prev_nav, self.current_nav / (1 + day_return / 100))
+        return np.where(use_prev | use_return, prev_nav, self.current_nav)
+
+    @cached_property
+    def today_change(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self.prev_nav != self.current_nav,
+                            (self.current_nav - self.prev_nav) / self.prev_nav * 100, 0.0)
+
+    @cached_property
+    def day_change(self):
+        return self.shares * (self.current_nav - self.prev_nav)
+
+    @cached_property
+    def period_returns(self):
+        # Trailing fund returns per holding, NaN where the job has none
+        return {period: self.fund_column(lambda fund: fund.returns.get(period)) for period in RETURN_PERIODS}
+
+    @cached_property
+    def purchase_date(self):
+        # UTC datetime64 per holding, NaT when missing or unparseable. Only
+        # parsed when a view needs dates, manager stats never do.
+        dates = [parse_purchase_date(asset.get('purchaseDate')) for asset in self.assets]
+        return np.array([(date - EPOCH) // timedelta(microseconds=1) if date else NAT for date in dates],
+                        dtype=np.int64).view('datetime64[us]')
+
+    def per_user(self, weights):
+        return np.bincount(self.owner, weights=weights, minlength=len(self.user_ids))
+
+    def best_rows(self):
+        # Row of the best performing holding of each user, -1 for users without
+        # holdings. Ties keep the first holding, as the old loop did.
+        best = np.full(len(self.user_ids), -1, dtype=np.int64)
+        if self.rows:
+            order = np.lexsort((np.arange(self.rows), -self.performance, self.owner))
+            first = np.ones(self.rows, dtype=bool)
+            first[1:] = self.owner[order][1:] != self.owner[order][:-1]
+            best[self.owner[order][first]] = order[first]
+        return best
+
+    def month_mask(self, now):
+        month = np.datetime64(now.astimezone(timezone.utc).replace(tzinfo=None), 'M')
+        return self.purchase_date.astype('datetime64[M]') == month
+
+    def oldest_purchase(self):
+        # Earliest purchase date per user, None when no holding has one
+        dated = ~np.isnat(self.purchase_date)
+        oldest = np.full(len(self.user_ids), np.iinfo(np.int64).max, dtype=np.int64)
+        np.minimum.at(oldest, self.owner[dated], self.purchase_date[dated].astype(np.int64))
+        found = oldest != np.iinfo(np.int64).max
+        result = [None] * len(self.user_ids)
+        for owner, micros in zip(np.flatnonzero(found).tolist(), oldest[found].tolist()):
+            result[owner] = EPOCH + timedelta(microseconds=micros)
+        return result
+
+    def holdings_rows(self):
+        # Per-holding rows of the assetsInfo view
+        invested = round2(self.invested)
+        current_nav = round2(self.current_nav)
+        total_returns = round2((self.current_nav - self.old_nav) * self.shares)
+        units = round2(self.shares)
+        gains = round2(self.gains)
+        gains_percentage = round2(self.gains_percentage)
+        today_change = round2(self.today_change)
+        return [{
+            'isin': isin,
+            'fund_name': fund.name or '',
+            'fund_category': fund.category,
+            'fund_type': fund.type,
+            'risk': fund.risk,
+            'amount_invested': row_invested,
+            'current_nav': row_nav,
+            'total_returns': row_returns,
+            'total_units': row_units,
+            'gains': row_gains,
+            'gains_percentage': row_percentage,
+            'todayChange': row_change,
+            'returns': {period: fund.returns.get(period) for period in RETURN_PERIODS},
+        } for isin, fund, row_invested, row_nav, row_returns, row_units, row_gains, row_percentage, row_change
+            in zip(self.isins, self.funds, invested, current_nav, total_returns, units, gains, gains_percentage,
+                   today_change)]
+
+    def holdings_by_user(self):
+        per_user = [[] for _ in self.user_ids]
+        for owner, row in zip(self.owner.tolist(), self.holdings_rows()):
+            per_user[owner].append(row)
+        return per_user
+
+    def best_performers(self):
+        labels = []
+        for row in self.best_rows().tolist():
+            if row < 0:
+                labels.append('')
+            else:
+                name = self.funds[row].name or self.isins[row]
+                labels.append(f"{name} (+{round(float(self.performance[row]), 1)}%)")
+        return labels
+
+    def portfolio_returns(self):
+        # Percent return of each user's current holdings over every period,
+        # each holding valued back to the start of the window at its fund's
+        # return. Holdings without a return are left out, None when none has one.
+        per_period = {}
+        for period, returns in self.period_returns.items():
+            known = ~np.isnan(returns) & (returns > -100)
+            with np.errstate(invalid='ignore'):
+                start = self.per_user(np.where(known, self.value / (1 + returns / 100), 0.0))
+            end = self.per_user(np.where(known, self.value, 0.0))
+            per_period[period] = [(end_value - start_value) / start_value * 100 if start_value > 0 else None
+                                  for start_value, end_value in zip(start.tolist(), end.tolist())]
+        return [{period: per_period[period][i] for period in per_period} for i in range(len(self.user_ids))]
+
+    def summaries(self, now=None):
+        # Totals of every user, in user_ids order
+        now = now or datetime.now(timezone.utc)
+        invested = self.per_user(self.invested).tolist()
+        value = self.per_user(self.value).tolist()
+        month_invested = self.per_user(np.where(self.month_mask(now), self.value, 0.0)).tolist()
+        day_change = self.per_user(self.day_change).tolist()
+        num_funds = np.bincount(self.owner, minlength=len(self.user_ids)).tolist()
+        best = self.best_performers()
+        oldest = self.oldest_purchase()
+        returns = self.portfolio_returns()
+        return [{
+            'invested': invested[i],
+            'value': value[i],
+            'numFunds': num_funds[i],
+            'bestPerformer': best[i],
+            'oldestPurchaseDate': oldest[i],
+            'monthInvested': month_invested[i],
+            'dayChange': day_change[i],
+            'returns': returns[i]
+        } for i in range(len(self.user_ids))]
+
+    def average_performance(self):
+        # Mean over users of each user's mean holding performance, users
+        # without a priced holding are left out
+        counts = self.per_user(self.priced.astype(float))
+        totals = self.per_user(np.where(self.priced, self.performance, 0.0))
+        has_perf = counts > 0
+        if not has_perf.any():
+            return 0
+        return float((totals[has_perf] / counts[has_perf]).mean())
+
+
+def as_float(value):
+    # float() as the array constructor does it, None is NaN
+    return np.nan if value is None else float(value)
+
+
+def previous_nav(fund, current_nav):
+    # PortfolioArrays.prev_nav for one holding
+    latest, last, prev, day = fund.latestnav, fund.lastnav, fund.prevnav, fund.returns.get('1D')
+    if (latest is not None and last is not None and abs(last - latest) <= SAME_NAV_TOLERANCE * abs(latest)
+            and prev is not None and prev > 0):
+        return prev
+    if day is not None and day > -100:
+        return current_nav / (1 + day / 100)
+    return current_nav
+
+
+def portfolio_summary(assets, funds, now=None):
+    # PortfolioArrays.summaries() and holdings_rows() of a single portfolio as
+    # a plain loop, same values. This runs inside every order, where the few
+    # holdings of one user cost less in Python than the fixed cost of the
+    # array passes. Deposit.Benchmark checks both give the same results.
+    now = (now or datetime.now(timezone.utc)).astimezone(timezone.utc)
+    invested_total = value_total = month_invested = day_change = 0.0
+    windows = {period: [0.0, 0.0] for period in RETURN_PERIODS}
+    best_performance, best_performer, oldest = None, '', None
+    holdings = []
+    for asset in assets:
+        isin = asset.get('isin')
+        fund = funds.get(isin)
+        shares = as_float(asset.get('shares', 0))
+        nav = as_float(asset.get('nav', 0))
+        old_nav = as_float(asset.get('old_nav'))
+        old_nav = nav if np.isnan(old_nav) else old_nav
+        current_nav = nav if fund.latestnav is None else float(fund.latestnav)
+        invested = shares * old_nav
+        value = shares * current_nav
+        gains = value - invested
+        performance = (current_nav - old_nav) / old_nav * 100 if old_nav > 0 else 0.0
+        prev_nav = previous_nav(fund, current_nav)
+
+        invested_total += invested
+        value_total += value
+        day_change += shares * (current_nav - prev_nav)
+        if best_performance is None or performance > best_performance:
+            best_performance = performance
+            best_performer = f"{fund.name or isin} (+{round(performance, 1)}%)"
+        purchase_date = parse_purchase_date(asset.get('purchaseDate'))
+        if purchase_date is not None:
+            purchase_date = purchase_date.astimezone(timezone.utc)
+            oldest = purchase_date if oldest is None else min(oldest, purchase_date)
+            if (purchase_date.year, purchase_date.month) == (now.year, now.month):
+                month_invested += value
+        for period, window in windows.items():
+            period_return = fund.returns.get(period)
+            if period_return is not None and period_return > -100:
+                window[0] += value / (1 + period_return / 100)
+                window[1] += value
+
+        holdings.append({
+            'isin': isin,
+            'fund_name': fund.name or '',
+            'fund_category': fund.category,
+            'fund_type': fund.type,
+            'risk': fund.risk,
+            'amount_invested': round(invested, 2),
+            'current_nav': round(current_nav, 2),
+            'total_returns': round((current_nav - old_nav) * shares, 2),
+            'total_units': round(shares, 2),
+            'gains': round(gains, 2),
+            'gains_percentage': round(gains / invested * 100 if invested > 0 else 0.0, 2),
+            'todayChange': round((current_nav - prev_nav) / prev_nav * 100 if prev_nav != current_nav else 0.0, 2),
+            'returns': {period: fund.returns.get(period) for period in RETURN_PERIODS},
+        })
+
+    summary = {
+        'invested': invested_total,
+        'value': value_total,
+        'numFunds': len(holdings),
+        'bestPerformer': best_performer,
+        'oldestPurchaseDate': oldest,
+        'monthInvested': month_invested,
+        'dayChange': day_change,
+        'returns': {period: (end - start) / start * 100 if start > 0 else None
+                    for period, (start, end) in windows.items()}
+    }
+    return summary, holdings
@@ -0,0 +1,205 @@
+from Helpers.FundLookup import FundInfo
+from Deposit.Analytics import PortfolioArrays, portfolio_summary, parse_purchase_date
+from datetime import datetime, timezone, timedelta
+import argparse
+import random
+import time
+
+
+class StaticFunds:
+    # FundResolver stand-in serving synthetic funds
+    def __init__(self, funds):
+        self.funds = funds
+
+    def get(self, isin):
+        return self.funds.get(isin) or FundInfo(isin=isin or '')
+
+
+def synthetic_portfolios(users, funds_per_user, fund_count=500, seed=0, now=None):
+    rng = random.Random(seed)
+    now = now or datetime.now(timezone.utc)
+    funds = {}
+    for i in range(fund_count):
+        latest_nav = round(rng.uniform(10, 500), 4)
+        funds[f"FUND{i:05d}"] = FundInfo(isin=f"FUND{i:05d}", exists=True, name=f"Fund {i}", category='Equity',
+                                         type='Growth', risk='Moderate', latestnav=latest_nav, lastnav=latest_nav,
+                                         prevnav=round(latest_nav * rng.uniform(0.98, 1.02), 4))
+    isins = list(funds)
+    users_assets = {}
+    for user in range(users):
+        assets = []
+        for isin in rng.sample(isins, funds_per_user):
+            nav = funds[isin].latestnav * rng.uniform(0.7, 1.3)
+            purchase = now - timedelta(days=rng.randint(0, 1500))
+            assets.append({
+                'isin': isin,
+                'name': funds[isin].name,
+                'nav': nav,
+                'shares': rng.uniform(1, 200),
+                # Orders store datetimes, older holdings were saved as ISO strings
+                'purchaseDate': purchase if rng.random() < 0.5 else purchase.isoformat()
+            })
+        users_assets[f"user{user}"] = assets
+    return users_assets, StaticFunds(funds)
+
+
+def legacy_summary(assets, funds, now):
+    # build_snapshot before the array engine, kept for comparison
+    holdings = []
+    total_value = 0
+    total_invested = 0
+    month_invested = 0
+    best_performer = None
+    best_performance = float('-inf')
+    oldest_date = None
+    for asset in assets:
+        isin = asset.get('isin')
+        shares = float(asset.get('shares', 0))
+        nav = float(asset.get('nav', 0))
+        old_nav = float(asset.get('old_nav', nav))
+        fund_info = funds.get(isin)
+        current_nav = fund_info.nav_or(nav)
+        invested = shares * old_nav
+        value = shares * current_nav
+        total_value += value
+        total_invested += invested
+
+        perf = ((current_nav - old_nav) / old_nav * 100) if old_nav > 0 else 0
+        if perf > best_performance:
+            best_performance = perf
+            best_performer = f"{fund_info.name or isin} (+{round(perf, 1)}%)"
+
+        purchase_date = parse_purchase_date(asset.get('purchaseDate'))
+        if purchase_date:
+            if oldest_date is None or purchase_date < oldest_date:
+                oldest_date = purchase_date
+            if purchase_date.month == now.month and purchase_date.year == now.year:
+                month_invested += value
+
+        gains = value - invested
+        holdings.append({
+            'isin': isin,
+            'fund_name': fund_info.name or '',
+            'fund_category': fund_info.category,
+            'fund_type': fund_info.type,
+            'risk': fund_info.risk,
+            'amount_invested': round(invested, 2),
+            'current_nav': round(current_nav, 2),
+            'total_returns': round((current_nav - old_nav) * shares, 2),
+            'total_units': round(shares, 2),
+            'gains': round(gains, 2),
+            'gains_percentage': round((gains / invested * 100) if invested > 0 else 0, 2),
+            'todayChange': 1.20,  # If this should be dynamic, update accordingly
+        })
+
+    return {
+        'holdings': holdings,
+        'invested': total_invested,
+        'value': total_value,
+        'numFunds': len(assets),
+        'bestPerformer': best_performer or '',
+        'oldestPurchaseDate': oldest_date,
+        'monthInvested': month_invested
+    }
+
+
+def legacy_manager_stats(users_assets, funds):
+    # aggregate_manager_stats loop before the array engine
+    total_aum = 0
+    total_perf = 0
+    perf_count = 0
+    for user_id, assets in users_assets.items():
+        user_aum = 0
+        user_perf = 0
+        user_perf_count = 0
+        for asset in assets:
+            shares = float(asset.get('shares', 0))
+            nav = float(asset.get('nav', 0))
+            old_nav = float(asset.get('old_nav', nav))
+            current_nav = funds.get(asset.get('isin')).nav_or(nav)
+            user_aum += shares * current_nav
+            if old_nav > 0:
+                user_perf += ((current_nav - old_nav) / old_nav * 100)
+                user_perf_count += 1
+        total_aum += user_aum
+        if user_perf_count > 0:
+            total_perf += (user_perf / user_perf_count)
+            perf_count += 1
+    return round(total_aum, 2), round((total_perf / perf_count) if perf_count > 0 else 0, 2)
+
+
+def array_summaries(users_assets, funds, now):
+    portfolio = PortfolioArrays(users_assets, funds)
+    return [dict(summary, holdings=holdings) for summary, holdings in
+            zip(portfolio.summaries(now), portfolio.holdings_by_user())]
+
+
+def loop_summaries(users_assets, funds, now):
+    return [dict(summary, holdings=holdings) for summary, holdings in
+            (portfolio_summary(assets, funds, now) for assets in users_assets.values())]
+
+
+def array_manager_stats(users_assets, funds):
+    portfolio = PortfolioArrays(users_assets, funds)
+    return round(float(portfolio.value.sum()), 2), round(portfolio.average_performance(), 2)
+
+
+def best_of(function, repeats):
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - started)
+    return result, round(min(timings) * 1000, 3)
+
+
+def same_summary(left, right):
+    for key in ['invested', 'value', 'monthInvested']:
+        if abs(left[key] - right[key]) > 1e-6 * max(1, abs(left[key])):
+            return False
+    # The legacy loop hardcoded todayChange and had no returns, the engine
+    # derives both from the returns job
+    holdings = [[{key: value for key, value in row.items() if key not in ('todayChange', 'returns')}
+                 for row in side['holdings']] for side in (left, right)]
+    return (left['numFunds'] == right['numFunds'] and left['bestPerformer'] == right['bestPerformer']
+            and holdings[0] == holdings[1] and left['oldestPurchaseDate'] == right['oldestPurchaseDate'])
+
+
+def benchmark_portfolios(users=500, funds_per_user=10, repeats=5):
+    # Snapshot build for one user and per-user summaries plus manager stats
+    # for many users: the loops the engine replaced, the array engine and,
+    # for snapshots, the plain loop build_snapshot runs on the order path
+    now = datetime.now(timezone.utc)
+    users_assets, funds = synthetic_portfolios(users, funds_per_user, now=now)
+    first = {'user0': users_assets['user0']}
+
+    legacy_one, legacy_one_ms = best_of(lambda: legacy_summary(first['user0'], funds, now), repeats)
+    array_one, array_one_ms = best_of(lambda: array_summaries(first, funds, now)[0], repeats)
+    order_one, order_one_ms = best_of(lambda: loop_summaries(first, funds, now)[0], repeats)
+    legacy_many, legacy_many_ms = best_of(
+        lambda: [legacy_summary(assets, funds, now) for assets in users_assets.values()], repeats)
+    array_many, array_many_ms = best_of(lambda: array_summaries(users_assets, funds, now), repeats)
+    order_many, order_many_ms = best_of(lambda: loop_summaries(users_assets, funds, now), repeats)
+    legacy_stats, legacy_stats_ms = best_of(lambda: legacy_manager_stats(users_assets, funds), repeats)
+    array_stats, array_stats_ms = best_of(lambda: array_manager_stats(users_assets, funds), repeats)
+    return {
+        'users': users,
+        'funds_per_user': funds_per_user,
+        'single_user_ms': {'loop': legacy_one_ms, 'arrays': array_one_ms, 'orderPath': order_one_ms},
+        'all_users_ms': {'loop': legacy_many_ms, 'arrays': array_many_ms, 'orderPath': order_many_ms},
+        'manager_stats_ms': {'loop': legacy_stats_ms, 'arrays': array_stats_ms},
+        'match': (same_summary(legacy_one, array_one) and legacy_stats == array_stats
+                  and all(same_summary(a, b) for a, b in zip(legacy_many, array_many))
+                  # The order path must give exactly the engine's snapshot
+                  and order_one == array_one and order_many == array_many)
+    }
+
+
+if __name__ == '__main__':
+    # python -m Deposit.Benchmark [--users 500] [--funds-per-user 10]
+    parser = argparse.ArgumentParser(description="Portfolio math, per-asset loops vs the array engine")
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--funds-per-user', type=int, default=10)
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+    print(benchmark_portfolios(args.users, args.funds_per_user, args.repeats))
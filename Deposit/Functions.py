@@ -6,6 +6,14 @@ from Helpers.MRZScane import GetMRZData
 from Helpers.MinerU import extract_markdown
 from fuzzywuzzy import fuzz
 from Helpers.NormalizeDate import normalize_date
+from Helpers.FundLookup import FundResolver, fund_cache
+from Deposit.Aggregation import aggregate_manager_stats
+from Deposit.Snapshots import load_portfolio_snapshot, sync_portfolio_snapshot, stage_available_funds, \
+    portfolio_metrics_from_snapshot, quick_stats_from_snapshot, reprice_portfolio_snapshots
+from Deposit.Holdings import holdings_from_doc, holdings_from_snapshot, find_holding
+from Deposit.Returns import refresh_fund_returns
+from Deposit.History import load_portfolio_history, history_points, to_day
+from Deposit.Orders import execute_order, execute_orders, run_transaction, OrderError, MAX_BULK_ORDERS
 from pydantic import BaseModel
 from typing import Optional, Dict, Any
 from instructor import from_groq, Mode
@@ -13,6 +21,7 @@ from groq import Groq
 import json
 import threading
 import random
+import pandas as pd
 
 class IdentityVerificationResult(BaseModel):
     name_similarity: int
@@ -369,6 +378,7 @@ def SaveDeposit(id, request):
 
         db = firestore.client()
         db.collection("deposits").document(id).set(data)
+        sync_portfolio_snapshot(db, id, available_funds=deposit_amount)
 
         user_ref = db.collection("users").document(id)
         user_doc = user_ref.get()
@@ -459,9 +469,6 @@ def add_funds(user_id, request):
     try:
         db = firestore.client()
         doc_ref = db.collection("deposits").document(user_id)
-        doc = doc_ref.get()
-        if not doc.exists:
-            return {"error": "Deposit record not found"}, 404
 
         if request.is_json:
             try:
@@ -478,25 +485,38 @@ def add_funds(user_id, request):
         if amount <= 0:
             return {"error": "Amount must be positive"}, 400
 
-        data = doc.to_dict()
-        current_funds = float(data.get("availableFunds", 0))
-        new_funds = current_funds + amount
-
-        log_data = {
-            'userId': user_id,
-            'action': 'Deposit',
-            'date': datetime.now(timezone.utc),    
-            'description': "Bank",
-            'amount': amount
-        }
-
-        db.collection('logs').add(log_data)
+        # Same transaction as orders so a concurrent buy/sell cannot lose this deposit
+        def apply(transaction):
+            doc = doc_ref.get(transaction=transaction)
+            if not doc.exists:
+                raise OrderError("Deposit record not found", 404)
+            data = doc.to_dict()
+            current_funds = float(data.get("availableFunds", 0))
+            new_funds = current_funds + amount
+
+            log_data = {
+                'userId': user_id,
+                'action': 'Deposit',
+                'date': datetime.now(timezone.utc),
+                'description': "Bank",
+                'amount': amount
+            }
+
+            transaction.set(db.collection('logs').document(), log_data)
+            now = datetime.now(timezone.utc)
+            transaction.update(doc_ref, {
+                "availableFunds": new_funds,
+                "editedAt": now
+            })
+            # Staged here, a write after the commit could overwrite the
+            # snapshot of an order committed in between with a stale balance
+            stage_available_funds(transaction, db, user_id, new_funds, now)
+            return new_funds
 
-        doc_ref.update({
-            "availableFunds": new_funds,
-            "editedAt": datetime.now(timezone.utc)
-        })
+        new_funds = run_transaction(db, apply)
         return {"availableFunds": new_funds}
+    except OrderError as e:
+        return {"error": e.message}, e.status
     except Exception as e:
         print(f"Error adding funds for {user_id}: {e}")
         return {"error": str(e)}, 500
@@ -505,78 +525,27 @@ def add_funds(user_id, request):
 def buy_asset(user_id, asset_data):
     try:
         db = firestore.client()
-        isin = asset_data.get('isin')
-        amount_invested = float(asset_data.get('amount_invested', 0))
-        nav_price = float(asset_data.get('nav_price', 0))
-        name = asset_data.get('name')
-        purchase_date = datetime.now(timezone.utc)
-        if not isin or nav_price <= 0 or amount_invested <= 0:
-            return {'error': 'Invalid asset data'}, 400
-        # Retrieve and update availableFunds
-        deposit_ref = db.collection('deposits').document(user_id)
-        deposit_doc = deposit_ref.get()
-        if not deposit_doc.exists:
-            return {'error': 'Deposit record not found'}, 404
-        deposit_data = deposit_doc.to_dict()
-        current_funds = float(deposit_data.get('availableFunds', 0))
-        if amount_invested > current_funds:
-            return {'error': 'Insufficient available funds'}, 400
-        new_funds = current_funds - amount_invested
-        deposit_ref.update({
-            'availableFunds': new_funds,
-            'editedAt': datetime.now(timezone.utc)
-        })
-        num_shares = amount_invested / nav_price
-        asset_doc = {
-            'isin': isin,
-            'name': name,
-            'nav': nav_price,
-            'shares': num_shares,
-            'purchaseDate': purchase_date
-        }
-
-        log_data = {
-            'userId': user_id,
-            'action': 'Buy',
-            'date': datetime.now(timezone.utc),
-            'type': 'SIP',    
-            'description': name,
-            'amount': amount_invested
-        }
-
-        db.collection('logs').add(log_data)
-       
+        return execute_order(db, user_id, 'buy', asset_data), 200
+    except OrderError as e:
+        return {'error': e.message}, e.status
+    except Exception as e:
+        print(f"Error saving asset for {user_id}: {e}")
+        return {'error': str(e)}, 500
 
 
-        assets_ref = db.collection('assets').document(user_id)
-        assets_doc = assets_ref.get()
-        merged = False
-        if assets_doc.exists:
-            assets_data = assets_doc.to_dict()
-            assets_list = assets_data.get('assets', [])
-            for i, existing_asset in enumerate(assets_list):
-                if existing_asset.get('isin') == isin:
-                    total_shares = float(existing_asset.get('shares', 0)) + num_shares
-                    assets_list[i] = {
-                        'isin': isin,
-                        'name': name,
-                        'nav': nav_price,
-                        'shares': total_shares,
-                        'purchaseDate': purchase_date
-                    }
-                    merged = True
-                    break
-            if merged:
-                assets_ref.set({'assets': assets_list}, merge=True)
-                return {'message': 'Asset merged successfully', 'asset': assets_list[i], 'availableFunds': new_funds}, 200
-            else:
-                assets_ref.set({'assets': firestore.ArrayUnion([asset_doc])}, merge=True)
-                return {'message': 'Asset saved successfully', 'asset': asset_doc, 'availableFunds': new_funds}, 200
-        else:
-            assets_ref.set({'assets': [asset_doc]}, merge=True)
-            return {'message': 'Asset saved successfully', 'asset': asset_doc, 'availableFunds': new_funds}, 200
+def place_orders(user_id, orders_data):
+    try:
+        orders = orders_data.get('orders') if isinstance(orders_data, dict) else orders_data
+        if not isinstance(orders, list) or not orders:
+            return {'error': 'No orders provided'}, 400
+        if len(orders) > MAX_BULK_ORDERS:
+            return {'error': f'At most {MAX_BULK_ORDERS} orders per request'}, 400
+        all_or_nothing = bool(orders_data.get('allOrNothing', False)) if isinstance(orders_data, dict) else False
+        db = firestore.client()
+        response = execute_orders(db, user_id, orders, all_or_nothing)
+        return response, 200 if response['committed'] else 400
     except Exception as e:
-        print(f"Error saving asset for {user_id}: {e}")
+        print(f"Error placing orders for {user_id}: {e}")
         return {'error': str(e)}, 500
 
 
@@ -587,7 +556,7 @@ def get_assets(user_id):
         assets_doc = assets_ref.get()
         if assets_doc.exists:
             assets_data = assets_doc.to_dict()
-            return {'assets': assets_data.get('assets', [])}, 200
+            return {'assets': holdings_from_doc(assets_data)}, 200
         else:
             return {'assets': []}, 200
     except Exception as e:
@@ -598,74 +567,8 @@ def get_assets(user_id):
 def get_portfolio_metrics(user_id):
     try:
         db = firestore.client()
-        # Get available funds
-        deposit_ref = db.collection('deposits').document(user_id)
-        deposit_doc = deposit_ref.get()
-        available_funds = 0
-        if deposit_doc.exists:
-            deposit_data = deposit_doc.to_dict()
-            available_funds = float(deposit_data.get('availableFunds', 0))
-        # Get assets
-        assets_ref = db.collection('assets').document(user_id)
-        assets_doc = assets_ref.get()
-        assets = []
-        if assets_doc.exists:
-            assets = assets_doc.to_dict().get('assets', [])
-        total_value = 0
-        total_gains = 0
-        total_invested = 0
-
-        # Fetch latest NAVs for all ISINs in user's assets
-        isin_list = [asset.get('isin') for asset in assets if asset.get('isin')]
-        latest_navs = {}
-        if isin_list:
-            funds_ref = db.collection('funds')
-            for isin in isin_list:
-                fund_doc = funds_ref.document(isin).get()
-                if fund_doc.exists:
-                    fund_data = fund_doc.to_dict()
-                    latest_nav = fund_data.get('latestnav')
-                    if latest_nav is not None:
-                        latest_navs[isin] = float(latest_nav)
-
-        for asset in assets:
-            shares = float(asset.get('shares', 0))
-            isin = asset.get('isin')
-            # Use latest NAV from funds table if available, else fallback to asset's nav
-            nav = latest_navs.get(isin, float(asset.get('nav', 0)))
-            old_nav = float(asset.get('old_nav', asset.get('nav', 0)))  # fallback to nav if not present
-            total_value += shares * nav
-            total_invested += shares * old_nav
-            total_gains += (nav - old_nav) * shares
-
-        # This Month: sum of assets purchased this month
-        from datetime import datetime
-        from_zone = timezone.utc
-        now = datetime.now(from_zone)
-        this_month = now.month
-        this_year = now.year
-        month_invested = 0
-        for asset in assets:
-            pd = asset.get('purchaseDate')
-            if pd:
-                if isinstance(pd, str):
-                    try:
-                        pd_dt = datetime.fromisoformat(pd)
-                    except Exception:
-                        continue
-                else:
-                    pd_dt = pd
-                if pd_dt.month == this_month and pd_dt.year == this_year:
-                    isin = asset.get('isin')
-                    nav = latest_navs.get(isin, float(asset.get('nav', 0)))
-                    month_invested += nav * float(asset.get('shares', 0))
-        metrics = {
-            'total_portfolio_value': total_value,
-            'total_gains': total_value - total_invested,
-            'total_gains_percent': ((total_value - total_invested) / total_invested * 100) if total_invested > 0 else 0,
-            'available_funds': available_funds,
-            'this_month': month_invested
-        }
+        snapshot = load_portfolio_snapshot(db, user_id)
+        metrics = portfolio_metrics_from_snapshot(snapshot)
         return metrics, 200
     except Exception as e:
         print(f"Error getting portfolio metrics for {user_id}: {e}")
@@ -674,44 +577,8 @@ def get_portfolio_metrics(user_id):
 def get_assets_with_fund_info(user_id):
     try:
         db = firestore.client()
-        assets_ref = db.collection('assets').document(user_id)
-        assets_doc = assets_ref.get()
-        assets = []
-        if assets_doc.exists:
-            assets = assets_doc.to_dict().get('assets', [])
-        result = []
-        funds_ref = db.collection('funds')
-        for asset in assets:
-            isin = asset.get('isin')
-            shares = float(asset.get('shares', 0))
-            nav = float(asset.get('nav', 0))
-            amount_invested = shares * float(asset.get('old_nav', nav))
-            fund_doc = funds_ref.document(isin).get()
-            fund_info = fund_doc.to_dict() if fund_doc.exists else {}
-            fund_name = fund_info.get('name', '')
-            fund_category = fund_info.get('category', '')
-            fund_type = fund_info.get('type', '')
-            risk = fund_info.get('risk', '')
-            current_nav = float(fund_info.get('latestnav', nav))
-            total_units = shares
-            total_returns = (current_nav - float(asset.get('old_nav', nav))) * shares
-            gains = (current_nav * shares) - amount_invested
-            gains_percentage = (gains / amount_invested * 100) if amount_invested > 0 else 0
-            result.append({
-                'isin': isin,
-                'fund_name': fund_name,
-                'fund_category': fund_category,
-                'fund_type': fund_type,
-                'risk': risk,
-                'amount_invested': round(amount_invested, 2),
-                'current_nav': round(current_nav, 2),
-                'total_returns': round(total_returns, 2),
-                'total_units': round(total_units, 2),
-                'gains': round(gains, 2),
-                'gains_percentage': round(gains_percentage, 2),
-                'todayChange': 1.20,  # If this should be dynamic, update accordingly
-            })
-        return result, 200
+        snapshot = load_portfolio_snapshot(db, user_id)
+        return snapshot.get('holdings', []), 200
     except Exception as e:
         print(f"Error retrieving assets with fund info for {user_id}: {e}")
         return {'error': str(e)}, 500
@@ -720,85 +587,9 @@ def get_assets_with_fund_info(user_id):
 def sell_asset(user_id, sell_data):
     try:
         db = firestore.client()
-        mfid = sell_data.get('isin')
-        amount_to_redeem = float(sell_data.get('shares', 0))
-        if not mfid or amount_to_redeem <= 0:
-            return {'error': 'Invalid sell data'}, 400
-
-        # Get user's assets
-        assets_ref = db.collection('assets').document(user_id)
-        assets_doc = assets_ref.get()
-        if not assets_doc.exists:
-            return {'error': 'No assets found for user'}, 404
-        assets_data = assets_doc.to_dict()
-        assets_list = assets_data.get('assets', [])
-        asset_found = False
-        for i, asset in enumerate(assets_list):
-            if asset.get('isin') == mfid:
-                current_shares = float(asset.get('shares', 0))
-                name = asset.get('name')
-                # Get latest NAV
-                funds_ref = db.collection('funds')
-                fund_doc = funds_ref.document(mfid).get()
-                nav = float(fund_doc.to_dict().get('latestnav', asset.get('nav', 0))) if fund_doc.exists else float(asset.get('nav', 0))
-                if nav <= 0:
-                    return {'error': 'Invalid NAV value'}, 400
-                shares_to_sell = amount_to_redeem / nav
-                if shares_to_sell > current_shares:
-                    return {'error': 'Not enough shares to sell'}, 400
-                value = shares_to_sell * nav  # This should be close to amount_to_redeem
-                # Remove shares
-                remaining_shares = current_shares - shares_to_sell
-                if remaining_shares <= 0.00001:  # Floating point tolerance
-                    assets_list.pop(i)
-                else:
-                    asset['shares'] = remaining_shares
-                    assets_list[i] = asset
-                asset_found = True
-                break
-        if not asset_found:
-            return {'error': 'Asset not found'}, 404
-        # Update assets
-        assets_ref.set({'assets': assets_list}, merge=True)
-        # Add value to deposit
-        deposit_ref = db.collection('deposits').document(user_id)
-        deposit_doc = deposit_ref.get()
-        if not deposit_doc.exists:
-            return {'error': 'Deposit record not found'}, 404
-        deposit_data = deposit_doc.to_dict()
-        available_funds = float(deposit_data.get('availableFunds', 0)) + value
-        deposit_ref.update({'availableFunds': available_funds, 'editedAt': datetime.now(timezone.utc)})
-        # Log transaction
-        log_ref = db.collection('transactions').document()
-        log_ref.set({
-            'user_id': user_id,
-            'mfid': mfid,
-            'shares_sold': shares_to_sell,
-            'nav': nav,
-            'value': value,
-            'timestamp': datetime.now(timezone.utc),
-            'type': 'sell'
-        })
-
-        log_data = {
-            'userId': user_id,
-            'action': 'Sell',
-            'date': datetime.now(timezone.utc),
-            'type': 'Redeam',    
-            'description': name,
-            'amount': amount_to_redeem
-        }
-
-        db.collection('logs').add(log_data)
-
-
-        return {
-            'message': 'Asset sold successfully',
-            'value': value,
-            'shares_sold': shares_to_sell,
-            'shares_remaining': remaining_shares if asset_found else 0,
-            'availableFunds': available_funds
-        }, 200
+        return execute_order(db, user_id, 'sell', sell_data), 200
+    except OrderError as e:
+        return {'error': e.message}, e.status
     except Exception as e:
         print(f"Error selling asset for {user_id}: {e}")
         return {'error': str(e)}, 500
@@ -813,8 +604,7 @@ def get_single_asset_info(user_id, data):
         assets_doc = assets_ref.get()
         if not assets_doc.exists:
             return {'error': 'No assets found for user'}, 404
-        assets_list = assets_doc.to_dict().get('assets', [])
-        asset = next((a for a in assets_list if a.get('isin') == isin), None)
+        asset = find_holding(assets_doc.to_dict(), isin)
         if not asset:
              return {
                 'isin': isin,
@@ -827,13 +617,13 @@ def get_single_asset_info(user_id, data):
                 'total_units': 0
             },200
         # Get fund info
-        funds_ref = db.collection('funds')
-        fund_doc = funds_ref.document(isin).get()
-        fund_info = fund_doc.to_dict() if fund_doc.exists else {}
-        fund_name = fund_info.get('name', '')
-        fund_category = fund_info.get('category', '')
-        fund_type = fund_info.get('type', '')
-        current_nav = float(fund_info.get('latestnav', asset.get('nav', 0)))
+        funds = FundResolver(db)
+        funds.resolve([isin])
+        fund_info = funds.get(isin)
+        fund_name = fund_info.name or ''
+        fund_category = fund_info.category
+        fund_type = fund_info.type
+        current_nav = fund_info.nav_or(asset.get('nav', 0))
         shares = float(asset.get('shares', 0))
         amount_invested = shares * float(asset.get('old_nav', asset.get('nav', 0)))
         total_returns = (current_nav - float(asset.get('old_nav', asset.get('nav', 0)))) * shares
@@ -855,58 +645,8 @@ def get_single_asset_info(user_id, data):
 def get_quick_stats(user_id):
     try:
         db = firestore.client()
-        assets_ref = db.collection('assets').document(user_id)
-        assets_doc = assets_ref.get()
-        assets = []
-        if assets_doc.exists:
-            assets = assets_doc.to_dict().get('assets', [])
-        total_invested = 0
-        best_performer = None
-        best_performance = float('-inf')
-        num_funds = len(assets)
-        now = datetime.now(timezone.utc)
-        oldest_date = now
-        for asset in assets:
-            shares = float(asset.get('shares', 0))
-            old_nav = float(asset.get('old_nav', asset.get('nav', 0)))
-            invested = shares * old_nav
-            total_invested += invested
-            isin = asset.get('isin')
-            # Get fund info
-            funds_ref = db.collection('funds')
-            fund_doc = funds_ref.document(isin).get()
-            fund_info = fund_doc.to_dict() if fund_doc.exists else {}
-            fund_name = fund_info.get('name', isin)
-            current_nav = float(fund_info.get('latestnav', asset.get('nav', 0)))
-            perf = ((current_nav - old_nav) / old_nav * 100) if old_nav > 0 else 0
-            if perf > best_performance:
-                best_performance = perf
-                best_performer = f"{fund_name} (+{round(perf, 1)}%)"
-            # Portfolio age
-            pd = asset.get('purchaseDate')
-            if pd:
-                if isinstance(pd, str):
-                    try:
-                        pd_dt = datetime.fromisoformat(pd)
-                    except Exception:
-                        continue
-                else:
-                    pd_dt = pd
-                if pd_dt < oldest_date:
-                    oldest_date = pd_dt
-        # Portfolio age calculation
-        age_years = now.year - oldest_date.year
-        age_months = now.month - oldest_date.month
-        if age_months < 0:
-            age_years -= 1
-            age_months += 12
-        portfolio_age = f"{age_years} years {age_months} months" if num_funds > 0 else "0 months"
-        stats = {
-            'total_invested': round(total_invested, 2),
-            'num_funds': num_funds,
-            'best_performer': best_performer or '',
-            'portfolio_age': portfolio_age
-        }
+        snapshot = load_portfolio_snapshot(db, user_id)
+        stats = quick_stats_from_snapshot(snapshot)
         return stats, 200
     except Exception as e:
         print(f"Error getting quick stats for {user_id}: {e}")
@@ -934,9 +674,7 @@ def get_managed_users_assets(manager_id):
             # Get assets
             assets_ref = db.collection('assets').document(user_id)
             assets_doc = assets_ref.get()
-            assets = []
-            if assets_doc.exists:
-                assets = assets_doc.to_dict().get('assets', [])
+            assets = holdings_from_snapshot(assets_doc)
             user_assets = []
             for asset in assets:
                 isin = asset.get('isin')
@@ -970,52 +708,41 @@ def get_manager_stats(manager_id):
             return {'error': 'Manager not found'}, 404
         manager_data = manager_doc.to_dict()
         managed_users = manager_data.get('managedUsers', [])
-        total_clients = len(managed_users)
-        total_aum = 0
-        total_perf = 0
-        perf_count = 0
-        active_orders = 0
-        for user_id in managed_users:
-            # Get assets
-            assets_ref = db.collection('assets').document(user_id)
-            assets_doc = assets_ref.get()
-            assets = []
-            if assets_doc.exists:
-                assets = assets_doc.to_dict().get('assets', [])
-            user_aum = 0
-            user_perf = 0
-            user_perf_count = 0
-            for asset in assets:
-                shares = float(asset.get('shares', 0))
-                nav = float(asset.get('nav', 0))
-                old_nav = float(asset.get('old_nav', nav))
-                fund_isin = asset.get('isin')
-                # Get latest NAV
-                funds_ref = db.collection('funds')
-                fund_doc = funds_ref.document(fund_isin).get()
-                current_nav = float(fund_doc.to_dict().get('latestnav', nav)) if fund_doc.exists else nav
-                user_aum += shares * current_nav
-                if old_nav > 0:
-                    user_perf += ((current_nav - old_nav) / old_nav * 100)
-                    user_perf_count += 1
-            total_aum += user_aum
-            if user_perf_count > 0:
-                total_perf += (user_perf / user_perf_count)
-                perf_count += 1
-            # Count active orders (buy/sell logs)
-            logs_ref = db.collection('logs')
-            logs = logs_ref.where('userId', '==', user_id).stream()
-            for log in logs:
-                if log.to_dict().get('action') in ['Buy', 'Sell']:
-                    active_orders += 1
-        avg_perf = (total_perf / perf_count) if perf_count > 0 else 0
-        stats = {
-            'total_clients': total_clients,
-            'total_aum': round(total_aum, 2),
-            'avg_performance': round(avg_perf, 2),
-            'active_orders': active_orders
-        }
+        stats = aggregate_manager_stats(db, managed_users)
         return stats, 200
     except Exception as e:
         print(f"Error getting manager stats for {manager_id}: {e}")
         return {'error': str(e)}, 500
+
+def get_fund_cache_stats():
+    try:
+        return fund_cache.stats(), 200
+    except Exception as e:
+        print(f"Error getting fund cache stats: {e}")
+        return {'error': str(e)}, 500
+
+def reprice_snapshots():
+    try:
+        return reprice_portfolio_snapshots(), 200
+    except Exception as e:
+        print(f"Error repricing portfolio snapshots: {e}")
+        return {'error': str(e)}, 500
+
+def refresh_returns():
+    try:
+        return refresh_fund_returns(), 200
+    except Exception as e:
+        print(f"Error refreshing fund returns: {e}")
+        return {'error': str(e)}, 500
+
+def get_portfolio_history(user_id, refresh=False, start=None, end=None):
+    try:
+        bounds = [to_day(value) if value else None for value in (start, end)]
+        if any(value and pd.isna(bound) for value, bound in zip((start, end), bounds)):
+            return {'error': 'from and to must be dates (YYYY-MM-DD)'}, 400
+        db = firestore.client()
+        series = load_portfolio_history(db, user_id, refresh=refresh)
+        return {'history': history_points(series, *bounds)}, 200
+    except Exception as e:
+        print(f"Error getting portfolio history for {user_id}: {e}")
+        return {'error': str(e)}, 500
@@ -0,0 +1,205 @@
+from datetime import datetime, timezone, timedelta
+from Helpers.FundLookup import FundResolver
+from Helpers.NavHistory import load_nav_history
+from Deposit.Holdings import holdings_from_snapshot
+from Deposit.Orders import MIN_REMAINING_SHARES
+import pandas as pd
+
+# Bump when the cached layout changes, older documents are rebuilt on read
+HISTORY_VERSION = 1
+
+EVENT_COLUMNS = ['day', 'isin', 'shares', 'cash', 'nav']
+
+# portfolio_history/{user} caches the replayed daily series:
+#   {'version', 'start': 'YYYY-MM-DD', 'value': [...], 'cash': [...],
+#    'checkpoint': {'date', 'positions': {isin: shares}, 'cash', 'navs': {isin: nav}}}
+# The checkpoint is the state at the end of the last fully elapsed day. Reads
+# replay only the days after it: orders logged since, and NAVs published since.
+
+
+def to_day(value):
+    # Naive UTC midnight of a datetime or ISO string, NaT when unparseable
+    day = pd.to_datetime(value, utc=True, errors='coerce')
+    return pd.NaT if pd.isna(day) else day.tz_localize(None).normalize()
+
+
+def order_events(logs):
+    # One row per cash or position change from Buy/Sell/Deposit logs. Logs
+    # written before orders recorded isin/shares only move cash.
+    rows = []
+    for log in logs:
+        action = log.get('action')
+        amount = float(log.get('amount') or 0)
+        shares = float(log.get('shares') or 0)
+        nav = float(log['nav']) if log.get('nav') is not None else None
+        isin = log.get('isin') if shares else None
+        if action == 'Buy':
+            rows.append((to_day(log.get('date')), isin, shares, -amount, nav))
+        elif action == 'Sell':
+            proceeds = shares * nav if shares and nav else amount
+            rows.append((to_day(log.get('date')), isin, -shares, proceeds, nav))
+        elif action == 'Deposit':
+            rows.append((to_day(log.get('date')), None, 0.0, amount, None))
+    events = pd.DataFrame(rows, columns=EVENT_COLUMNS)
+    return events[events['day'].notna()]
+
+
+def nav_frame(days, isins, histories, events, seeds, latest):
+    # days x isins NAVs. Sources by priority: published history, the NAV the
+    # order executed at, then the seed (checkpoint or holding NAV) which only
+    # covers days before the first observation. Gaps are forward filled.
+    frame = pd.DataFrame(index=days, columns=isins, dtype=float)
+    for isin in isins:
+        observations = [events.loc[(events['isin'] == isin) & events['nav'].notna()].set_index('day')['nav'],
+                        histories.get(isin, pd.Series(dtype=float, index=pd.DatetimeIndex([])))]
+        if latest.get(isin) is not None:
+            observations.append(pd.Series([latest[isin]], index=[days[-1]]))
+        series = pd.concat([s for s in observations if not s.empty]) if any(not s.empty for s in observations) \
+            else pd.Series(dtype=float, index=pd.DatetimeIndex([]))
+        series = series[series.index <= days[-1]]
+        series = series.groupby(level=0).last()
+        if seeds.get(isin) is not None and (series.empty or series.index[0] > days[0]):
+            series.loc[days[0] - pd.Timedelta(days=1)] = float(seeds[isin])
+            series = series.sort_index()
+        if not series.empty:
+            frame[isin] = series.reindex(series.index.union(days)).ffill().reindex(days)
+    return frame.bfill().fillna(0.0)
+
+
+def replay(start, end, positions, cash, events, histories, seeds, latest):
+    # Daily holdings value and cash from start to end (inclusive) given the
+    # positions and cash held just before start
+    days = pd.date_range(start, end, freq='D')
+    events = events[(events['day'] >= start) & (events['day'] <= end)]
+    position_events = events[events['isin'].notna()]
+    isins = sorted(set(positions) | set(position_events['isin']))
+    deltas = position_events.pivot_table(index='day', columns='isin', values='shares', aggfunc='sum') \
+        .reindex(index=days, columns=isins, fill_value=0.0).fillna(0.0)
+    shares = deltas.cumsum() + pd.Series(positions, dtype=float).reindex(isins, fill_value=0.0)
+    navs = nav_frame(days, isins, histories, events, seeds, latest)
+    return pd.DataFrame({
+        'value': (shares * navs).sum(axis=1),
+        'cash': events.groupby('day')['cash'].sum().reindex(days, fill_value=0.0).cumsum() + cash
+    }, index=days), shares, navs
+
+
+def reconcile_events(events, holdings, start_default, today):
+    # Holdings the logs do not explain (orders placed before logs carried
+    # isin/shares) enter at their purchase date, unexplained exits at today
+    replayed = events[events['isin'].notna()].groupby('isin')['shares'].sum()
+    current = {}
+    for asset in holdings:
+        current[asset.get('isin')] = current.get(asset.get('isin'), 0) + float(asset.get('shares', 0))
+    purchase = {asset.get('isin'): to_day(asset.get('purchaseDate')) for asset in holdings}
+    navs = {asset.get('isin'): float(asset.get('nav', 0)) for asset in holdings}
+    rows = []
+    for isin in set(current) | set(replayed.index):
+        residual = current.get(isin, 0) - float(replayed.get(isin, 0))
+        if abs(residual) <= MIN_REMAINING_SHARES:
+            continue
+        if residual > 0:
+            day = purchase.get(isin)
+            rows.append((start_default if pd.isna(day) else min(day, today), isin, residual, 0.0, navs.get(isin)))
+        else:
+            rows.append((today, isin, residual, 0.0, None))
+    return pd.DataFrame(rows, columns=EVENT_COLUMNS)
+
+
+def fetch_logs(db, user_id, after=None):
+    query = db.collection('logs').where('userId', '==', user_id)
+    if after is not None:
+        # userId + date range, needs the composite index on logs (userId, date)
+        query = query.where('date', '>=', after)
+    return [doc.to_dict() for doc in query.stream()]
+
+
+def latest_navs(db, isins):
+    funds = FundResolver(db)
+    return {isin: fund.latestnav for isin, fund in funds.resolve(isins).items()}
+
+
+def checkpoint_of(day, shares, navs, series):
+    return {
+        'date': day.strftime('%Y-%m-%d'),
+        'positions': {isin: float(value) for isin, value in shares.loc[day].items() if abs(value) > MIN_REMAINING_SHARES},
+        'cash': float(series.loc[day, 'cash']),
+        'navs': {isin: float(value) for isin, value in navs.loc[day].items()}
+    }
+
+
+def build_history(db, user_id, today):
+    # Full replay of every logged order, reconciled with the current holdings and cash
+    events = order_events(fetch_logs(db, user_id))
+    holdings = holdings_from_snapshot(db.collection('assets').document(user_id).get())
+    deposit_doc = db.collection('deposits').document(user_id).get()
+    available_funds = float(deposit_doc.to_dict().get('availableFunds', 0)) if deposit_doc.exists else 0.0
+
+    start = min(events['day'].min(), today) if not events.empty else today
+    events = pd.concat([events, reconcile_events(events, holdings, start, today)], ignore_index=True)
+    start = min(events['day'].min(), start) if not events.empty else start
+    # Cash that no log explains, e.g. the initial deposit, is held from the start
+    opening_cash = available_funds - float(events['cash'].sum())
+
+    isins = sorted(set(events['isin'].dropna()))
+    series, shares, navs = replay(start, today, {}, opening_cash, events, load_nav_history(db, isins),
+                                  {}, latest_navs(db, isins))
+    return series, shares, navs
+
+
+def update_history(db, user_id, cached, today):
+    # Replays only the days after the cached checkpoint
+    checkpoint = cached['checkpoint']
+    checkpoint_day = pd.Timestamp(checkpoint['date'])
+    after = datetime.combine((checkpoint_day + pd.Timedelta(days=1)).date(), datetime.min.time(), tzinfo=timezone.utc)
+    events = order_events(fetch_logs(db, user_id, after=after))
+    isins = sorted(set(checkpoint['positions']) | set(events['isin'].dropna()))
+    histories = {isin: history[history.index > checkpoint_day]
+                 for isin, history in load_nav_history(db, isins).items()}
+    tail, shares, navs = replay(checkpoint_day + pd.Timedelta(days=1), today, checkpoint['positions'],
+                                checkpoint['cash'], events, histories, checkpoint['navs'], latest_navs(db, isins))
+    start = pd.Timestamp(cached['start'])
+    kept = (checkpoint_day - start).days + 1
+    head = pd.DataFrame({'value': cached['value'][:kept], 'cash': cached['cash'][:kept]},
+                        index=pd.date_range(start, periods=kept, freq='D'))
+    return pd.concat([head, tail]), shares, navs
+
+
+def load_portfolio_history(db, user_id, refresh=False, now=None):
+    # Daily portfolio value series, from the cache when its checkpoint is usable
+    now = now or datetime.now(timezone.utc)
+    today = pd.Timestamp(now.astimezone(timezone.utc).date())
+    history_ref = db.collection('portfolio_history').document(user_id)
+    cached_doc = None if refresh else history_ref.get()
+    cached = cached_doc.to_dict() if cached_doc is not None and cached_doc.exists else None
+    usable = (cached is not None and cached.get('version') == HISTORY_VERSION and cached.get('checkpoint')
+              and pd.Timestamp(cached['checkpoint']['date']) < today)
+
+    if usable:
+        series, shares, navs = update_history(db, user_id, cached, today)
+    else:
+        series, shares, navs = build_history(db, user_id, today)
+
+    # Checkpoint at the end of yesterday, today is replayed again on every read
+    yesterday = today - pd.Timedelta(days=1)
+    checkpoint = checkpoint_of(yesterday, shares, navs, series) if yesterday in shares.index else None
+    if not usable or (checkpoint and checkpoint['date'] != cached['checkpoint']['date']):
+        upto = series.loc[:yesterday] if checkpoint else series.iloc[:0]
+        history_ref.set({
+            'version': HISTORY_VERSION,
+            'start': series.index[0].strftime('%Y-%m-%d'),
+            'value': [float(value) for value in upto['value']],
+            'cash': [float(value) for value in upto['cash']],
+            'checkpoint': checkpoint,
+            'updatedAt': now
+        })
+    return series
+
+
+def history_points(series, start=None, end=None):
+    series = series.loc[start:end]
+    return [{
+        'date': day.strftime('%Y-%m-%d'),
+        'value': round(float(row.value), 2),
+        'cash': round(float(row.cash), 2),
+        'total': round(float(row.value + row.cash), 2)
+    } for day, row in zip(series.index, series.itertuples())]
@@ -0,0 +1,106 @@
+from firebase_admin import firestore
+from google.cloud.firestore_v1.field_path import FieldPath
+import os
+import sys
+
+# assets/{user} documents come in two layouts:
+#   list: {'assets': [{'isin': ..., 'shares': ...}, ...]}   (legacy)
+#   map:  {'holdings': {<isin>: {'isin': ..., 'shares': ...}}}
+# Map documents are always written per ISIN with field-path updates. With
+# ASSETS_STORAGE_MODE=map, list documents are converted the next time they
+# are written; `python -m Deposit.Holdings migrate` converts all of them.
+ASSETS_STORAGE_MODE = os.getenv("ASSETS_STORAGE_MODE", "list")
+
+
+def is_map_layout(assets_data):
+    return isinstance((assets_data or {}).get('holdings'), dict)
+
+
+def holdings_from_doc(assets_data):
+    # Holdings as a list regardless of the document layout
+    assets_data = assets_data or {}
+    if is_map_layout(assets_data):
+        return list(assets_data['holdings'].values())
+    return list(assets_data.get('assets', []))
+
+
+def holdings_from_snapshot(assets_doc):
+    return holdings_from_doc(assets_doc.to_dict()) if assets_doc.exists else []
+
+
+def find_holding(assets_data, isin):
+    assets_data = assets_data or {}
+    if is_map_layout(assets_data):
+        return assets_data['holdings'].get(isin)
+    return next((a for a in assets_data.get('assets', []) if a.get('isin') == isin), None)
+
+
+def holding_path(isin):
+    return FieldPath('holdings', isin).to_api_repr()
+
+
+def holdings_map(assets_list):
+    # Legacy lists may hold the same ISIN twice, those rows are merged
+    holdings = {}
+    for asset in assets_list:
+        isin = asset.get('isin')
+        if not isin:
+            continue
+        if isin in holdings:
+            merged_shares = float(holdings[isin].get('shares', 0)) + float(asset.get('shares', 0))
+            holdings[isin] = dict(asset, shares=merged_shares)
+        else:
+            holdings[isin] = dict(asset)
+    return holdings
+
+
+def stage_holdings(writer, assets_ref, map_layout, assets_list, changed_isins):
+    # Stages the holdings write on a transaction or batch
+    if map_layout:
+        by_isin = {asset.get('isin'): asset for asset in assets_list}
+        updates = {holding_path(isin): by_isin.get(isin, firestore.DELETE_FIELD) for isin in changed_isins}
+        if updates:
+            writer.update(assets_ref, updates)
+    elif ASSETS_STORAGE_MODE == 'map':
+        writer.set(assets_ref, {'holdings': holdings_map(assets_list), 'assets': firestore.DELETE_FIELD}, merge=True)
+    else:
+        writer.set(assets_ref, {'assets': assets_list}, merge=True)
+
+
+def migrate_holdings(db=None, dry_run=False):
+    # Converts every list-layout assets document to the map layout. Writes are
+    # conditioned on update_time, a document changed meanwhile is counted as
+    # skipped and picked up by the next run.
+    db = db or firestore.client()
+    report = {'scanned': 0, 'migrated': 0, 'skipped': 0, 'already_migrated': 0}
+
+    def on_error(failure, writer):
+        report['skipped'] += 1
+        return False
+
+    writer = db.bulk_writer()
+    writer.on_write_error(on_error)
+    for doc in db.collection('assets').stream():
+        report['scanned'] += 1
+        data = doc.to_dict() or {}
+        if is_map_layout(data):
+            report['already_migrated'] += 1
+            continue
+        report['migrated'] += 1
+        if not dry_run:
+            writer.update(doc.reference, {
+                'holdings': holdings_map(data.get('assets', [])),
+                'assets': firestore.DELETE_FIELD
+            }, option=db.write_option(last_update_time=doc.update_time))
+    writer.close()
+    report['migrated'] -= report['skipped']
+    return report
+
+
+if __name__ == '__main__':
+    from Firebase import setupfirebase
+    if len(sys.argv) < 2 or sys.argv[1] != 'migrate':
+        print("Usage: python -m Deposit.Holdings migrate [--dry-run]")
+        sys.exit(1)
+    setupfirebase()
+    print(migrate_holdings(dry_run='--dry-run' in sys.argv))
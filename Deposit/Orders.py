@@ -0,0 +1,255 @@
+from firebase_admin import firestore
+from google.api_core.exceptions import Aborted
+from datetime import datetime, timezone
+from Helpers.FundLookup import FundResolver
+from Deposit.Snapshots import build_snapshot
+from Deposit.Holdings import is_map_layout, holdings_from_snapshot, holdings_map, stage_holdings
+import os
+import random
+import time
+
+# Contention policy: a transaction aborted by a concurrent order is retried
+# with exponential backoff and full jitter
+ORDER_MAX_ATTEMPTS = int(os.getenv("ORDER_MAX_ATTEMPTS", 5))
+ORDER_BACKOFF_BASE = float(os.getenv("ORDER_BACKOFF_BASE", 0.05))
+ORDER_BACKOFF_MAX = float(os.getenv("ORDER_BACKOFF_MAX", 2.0))
+
+# Floating point tolerance below which a position is considered fully sold
+MIN_REMAINING_SHARES = 0.00001
+
+ORDER_SIDES = ['buy', 'sell']
+# Each order stages up to two rows, this keeps a batch well under the 500 writes per commit
+MAX_BULK_ORDERS = 200
+
+
+class OrderError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def is_contention(error):
+    # The transactional wrapper reports exhausted attempts as a ValueError caused by Aborted
+    return isinstance(error, Aborted) or isinstance(error.__cause__, Aborted)
+
+
+def run_transaction(db, to_wrap, *args, max_attempts=ORDER_MAX_ATTEMPTS):
+    for attempt in range(1, max_attempts + 1):
+        try:
+            transaction = db.transaction(max_attempts=1)
+            return firestore.transactional(to_wrap)(transaction, *args)
+        except Exception as e:
+            if not is_contention(e) or attempt == max_attempts:
+                raise
+            delay = min(ORDER_BACKOFF_MAX, ORDER_BACKOFF_BASE * (2 ** (attempt - 1)))
+            time.sleep(random.uniform(0, delay))
+
+
+class PortfolioState:
+    # In-memory copy of a user's deposit and holdings, read once inside a
+    # transaction. Orders are applied to it and every resulting write is
+    # staged on the same transaction, so they commit together.
+    def __init__(self, db, user_id, deposit_doc, assets_doc):
+        self.db = db
+        self.user_id = user_id
+        self.deposit_exists = deposit_doc.exists
+        self.available_funds = float(deposit_doc.to_dict().get('availableFunds', 0)) if deposit_doc.exists else 0
+        self.assets_exists = assets_doc.exists
+        self.map_layout = assets_doc.exists and is_map_layout(assets_doc.to_dict())
+        self.holdings = holdings_map(holdings_from_snapshot(assets_doc))
+        self.changed_isins = set()
+        self.funds = FundResolver(db)
+        self.logs = []
+        self.transactions = []
+
+    @classmethod
+    def load(cls, db, transaction, user_id):
+        deposit_ref = db.collection('deposits').document(user_id)
+        assets_ref = db.collection('assets').document(user_id)
+        snapshots = {doc.reference.path: doc for doc in transaction.get_all([deposit_ref, assets_ref])}
+        return cls(db, user_id, snapshots[deposit_ref.path], snapshots[assets_ref.path])
+
+    @property
+    def assets(self):
+        return list(self.holdings.values())
+
+    def buy(self, asset_data):
+        isin = asset_data.get('isin')
+        amount_invested = float(asset_data.get('amount_invested', 0))
+        nav_price = float(asset_data.get('nav_price', 0))
+        name = asset_data.get('name')
+        purchase_date = datetime.now(timezone.utc)
+        if not isin or nav_price <= 0 or amount_invested <= 0:
+            raise OrderError('Invalid asset data')
+        if not self.deposit_exists:
+            raise OrderError('Deposit record not found', 404)
+        if amount_invested > self.available_funds:
+            raise OrderError('Insufficient available funds')
+        self.available_funds -= amount_invested
+        num_shares = amount_invested / nav_price
+
+        self.logs.append({
+            'userId': self.user_id,
+            'action': 'Buy',
+            'date': datetime.now(timezone.utc),
+            'type': 'SIP',
+            'description': name,
+            'amount': amount_invested,
+            # Replayed by Deposit.History
+            'isin': isin,
+            'shares': num_shares,
+            'nav': nav_price
+        })
+
+        self.changed_isins.add(isin)
+        # The assets document is written with this order, later sells in the batch see it
+        self.assets_exists = True
+        existing_asset = self.holdings.get(isin)
+        if existing_asset is not None:
+            total_shares = float(existing_asset.get('shares', 0)) + num_shares
+            self.holdings[isin] = {
+                'isin': isin,
+                'name': name,
+                'nav': nav_price,
+                'shares': total_shares,
+                'purchaseDate': purchase_date
+            }
+            return {'message': 'Asset merged successfully', 'asset': self.holdings[isin], 'availableFunds': self.available_funds}
+        asset_doc = {
+            'isin': isin,
+            'name': name,
+            'nav': nav_price,
+            'shares': num_shares,
+            'purchaseDate': purchase_date
+        }
+        self.holdings[isin] = asset_doc
+        return {'message': 'Asset saved successfully', 'asset': asset_doc, 'availableFunds': self.available_funds}
+
+    def sell(self, sell_data):
+        mfid = sell_data.get('isin')
+        amount_to_redeem = float(sell_data.get('shares', 0))
+        if not mfid or amount_to_redeem <= 0:
+            raise OrderError('Invalid sell data')
+        if not self.assets_exists:
+            raise OrderError('No assets found for user', 404)
+        asset = self.holdings.get(mfid)
+        if asset is None:
+            raise OrderError('Asset not found', 404)
+        current_shares = float(asset.get('shares', 0))
+        name = asset.get('name')
+        # Get latest NAV
+        self.funds.resolve([mfid])
+        nav = self.funds.get(mfid).nav_or(asset.get('nav', 0))
+        if nav <= 0:
+            raise OrderError('Invalid NAV value')
+        shares_to_sell = amount_to_redeem / nav
+        if shares_to_sell > current_shares:
+            raise OrderError('Not enough shares to sell')
+        if not self.deposit_exists:
+            raise OrderError('Deposit record not found', 404)
+        value = shares_to_sell * nav  # This should be close to amount_to_redeem
+        remaining_shares = current_shares - shares_to_sell
+        if remaining_shares <= MIN_REMAINING_SHARES:
+            del self.holdings[mfid]
+        else:
+            self.holdings[mfid] = dict(asset, shares=remaining_shares)
+        self.available_funds += value
+        self.changed_isins.add(mfid)
+
+        now = datetime.now(timezone.utc)
+        self.transactions.append({
+            'user_id': self.user_id,
+            'mfid': mfid,
+            'shares_sold': shares_to_sell,
+            'nav': nav,
+            'value': value,
+            'timestamp': now,
+            'type': 'sell'
+        })
+        self.logs.append({
+            'userId': self.user_id,
+            'action': 'Sell',
+            'date': now,
+            'type': 'Redeam',
+            'description': name,
+            'amount': amount_to_redeem,
+            'isin': mfid,
+            'shares': shares_to_sell,
+            'nav': nav
+        })
+        return {
+            'message': 'Asset sold successfully',
+            'value': value,
+            'shares_sold': shares_to_sell,
+            'shares_remaining': remaining_shares,
+            'availableFunds': self.available_funds
+        }
+
+    def stage(self, transaction):
+        # Deposit, holdings, log rows, transaction rows and the portfolio
+        # snapshot all go out in the transaction's single commit
+        now = datetime.now(timezone.utc)
+        db = self.db
+        transaction.update(db.collection('deposits').document(self.user_id), {
+            'availableFunds': self.available_funds,
+            'editedAt': now
+        })
+        stage_holdings(transaction, db.collection('assets').document(self.user_id),
+                       self.map_layout, self.assets, self.changed_isins)
+        for log_data in self.logs:
+            transaction.set(db.collection('logs').document(), log_data)
+        for transaction_data in self.transactions:
+            transaction.set(db.collection('transactions').document(), transaction_data)
+        self.funds.resolve(asset.get('isin') for asset in self.assets)
+        transaction.set(db.collection('portfolio_snapshots').document(self.user_id),
+                        build_snapshot(self.assets, self.funds, self.available_funds, now=now))
+
+
+def execute_order(db, user_id, side, order_data):
+    # Runs one buy or sell as a transaction, returns the order result or raises OrderError
+    def apply(transaction):
+        state = PortfolioState.load(db, transaction, user_id)
+        result = state.buy(order_data) if side == 'buy' else state.sell(order_data)
+        state.stage(transaction)
+        return result
+
+    return run_transaction(db, apply)
+
+
+def execute_orders(db, user_id, orders, all_or_nothing=False):
+    # Applies many buys/sells against one read of the portfolio and commits the
+    # successful ones in a single transaction. With all_or_nothing, any failed
+    # order cancels the whole batch.
+    def apply(transaction):
+        state = PortfolioState.load(db, transaction, user_id)
+        loaded_funds = state.available_funds
+        state.funds.resolve(order.get('isin') for order in orders if isinstance(order, dict))
+        results = []
+        for index, order in enumerate(orders):
+            side = str(order.get('side', '')).lower() if isinstance(order, dict) else ''
+            try:
+                if side not in ORDER_SIDES:
+                    raise OrderError('Invalid order side')
+                try:
+                    result = state.buy(order) if side == 'buy' else state.sell(order)
+                except (TypeError, ValueError):
+                    raise OrderError('Invalid order data')
+                results.append({'index': index, 'side': side, 'status': 200, 'data': result})
+            except OrderError as e:
+                results.append({'index': index, 'side': side, 'status': e.status, 'error': e.message})
+
+        succeeded = sum(1 for result in results if result['status'] == 200)
+        committed = succeeded > 0 and not (all_or_nothing and succeeded < len(results))
+        if committed:
+            state.stage(transaction)
+            return {'committed': True, 'availableFunds': state.available_funds, 'results': results}
+        # Nothing is written: the balance is the one loaded and orders that
+        # succeeded in memory are reported as rolled back
+        for result in results:
+            if result['status'] == 200:
+                result.update(status='rolledBack', error='Rolled back, the batch was not committed')
+                del result['data']
+        return {'committed': False, 'availableFunds': loaded_funds, 'results': results}
+
+    return run_transaction(db, apply)
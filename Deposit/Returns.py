@@ -0,0 +1,71 @@
+from firebase_admin import firestore
+from datetime import datetime, timezone
+from Helpers.NavHistory import history_rows, history_series, nav_returns, nav_history_snapshots, NAV_COLLECTION, NAV_HISTORY_FIELD
+import sys
+
+
+def refresh_fund_returns(db=None, field=NAV_HISTORY_FIELD):
+    # Daily job: stores lastnav, navDate, prevnav and 1D/1W/1M/1Y returns on
+    # every funds document, read back through Helpers.FundLookup.FundInfo, so
+    # views show real deltas without reading the NAV history. Only the history
+    # field is read, from fund_nav or, for funds without a fund_nav document,
+    # from funds, and every write is a bulk update.
+    db = db or firestore.client()
+    started = datetime.now(timezone.utc)
+    report = {'funds': 0, 'updated': 0, 'noHistory': 0, 'failed': 0}
+
+    def on_error(failure, writer):
+        report['failed'] += 1
+        return False
+
+    writer = db.bulk_writer()
+    writer.on_write_error(on_error)
+    for doc in nav_history_snapshots(db, field=field):
+        report['funds'] += 1
+        series = history_series(history_rows((doc.to_dict() or {}).get(field)))
+        if series.empty:
+            report['noHistory'] += 1
+            continue
+        writer.update(db.collection('funds').document(doc.id), dict(nav_returns(series), returnsAt=started))
+        report['updated'] += 1
+    writer.close()
+
+    report['updated'] -= report['failed']
+    report['seconds'] = round((datetime.now(timezone.utc) - started).total_seconds(), 2)
+    return report
+
+
+def migrate_nav_history(db=None, field=NAV_HISTORY_FIELD):
+    # Copies NAV histories stored on funds documents to fund_nav/{isin}. The
+    # funds field is left in place: the NAV ingest still writes it, so re-run
+    # after each ingest until it writes fund_nav itself. Safe to re-run.
+    db = db or firestore.client()
+    started = datetime.now(timezone.utc)
+    report = {'funds': 0, 'copied': 0, 'failed': 0}
+    for doc in db.collection('funds').select([field]).stream():
+        report['funds'] += 1
+        history = (doc.to_dict() or {}).get(field)
+        if history is None:
+            continue
+        try:
+            db.collection(NAV_COLLECTION).document(doc.id).set({field: history}, merge=True)
+            report['copied'] += 1
+        except Exception as e:
+            print(f"Error copying NAV history of {doc.id}: {e}")
+            report['failed'] += 1
+    report['seconds'] = round((datetime.now(timezone.utc) - started).total_seconds(), 2)
+    return report
+
+
+if __name__ == '__main__':
+    # Scheduled daily after NAVs are published, before the snapshot repricing:
+    # python -m Deposit.Returns refresh
+    # After each NAV ingest, until it writes fund_nav itself:
+    # python -m Deposit.Returns migrate
+    from Firebase import setupfirebase
+    commands = {'refresh': refresh_fund_returns, 'migrate': migrate_nav_history}
+    if len(sys.argv) < 2 or sys.argv[1] not in commands:
+        print("Usage: python -m Deposit.Returns refresh|migrate")
+        sys.exit(1)
+    setupfirebase()
+    print(commands[sys.argv[1]]())
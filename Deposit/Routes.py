@@ -1,5 +1,5 @@
 from flask import Blueprint, request, jsonify
-from Deposit.Functions import SaveDeposit,get_available_funds,add_funds,buy_asset,get_assets,get_portfolio_metrics,get_assets_with_fund_info,sell_asset,get_single_asset_info,get_quick_stats,get_managed_users_assets,get_manager_stats
+from Deposit.Functions import SaveDeposit,get_available_funds,add_funds,buy_asset,place_orders,get_assets,get_portfolio_metrics,get_assets_with_fund_info,sell_asset,get_single_asset_info,get_quick_stats,get_managed_users_assets,get_manager_stats,get_fund_cache_stats,reprice_snapshots,refresh_returns,get_portfolio_history
 
 DepositRoutes = Blueprint('DepositRoutes', __name__)
 
@@ -26,6 +26,12 @@ def BuyAsset(user_id):
     response, status = buy_asset(user_id, asset_data)
     return jsonify(response), status
 
+@DepositRoutes.route(baseurl+"/orders/<user_id>", methods=['POST'])
+def orders_route(user_id):
+    orders_data = request.get_json(force=True, silent=True)
+    response, status = place_orders(user_id, orders_data)
+    return jsonify(response), status
+
 @DepositRoutes.route(baseurl+"/getAssets/<user_id>", methods=['GET'])
 def get_user_assets(user_id):
     response, status = get_assets(user_id)
@@ -67,3 +73,26 @@ def managed_users_assets_route(manager_id):
 def manager_stats_route(manager_id):
     response, status = get_manager_stats(manager_id)
     return jsonify(response), status
+
+@DepositRoutes.route(baseurl+"/fundCacheStats", methods=['GET'])
+def fund_cache_stats_route():
+    response, status = get_fund_cache_stats()
+    return jsonify(response), status
+
+@DepositRoutes.route(baseurl+"/snapshots/reprice", methods=['POST'])
+def reprice_snapshots_route():
+    response, status = reprice_snapshots()
+    return jsonify(response), status
+
+@DepositRoutes.route(baseurl+"/funds/returns", methods=['POST'])
+def refresh_returns_route():
+    response, status = refresh_returns()
+    return jsonify(response), status
+
+@DepositRoutes.route(baseurl+"/portfolioHistory/<user_id>", methods=['GET'])
+def portfolio_history_route(user_id):
+    # ?refresh=full replays every logged order instead of the cached checkpoint
+    refresh = request.args.get('refresh') == 'full'
+    response, status = get_portfolio_history(user_id, refresh, request.args.get('from'), request.args.get('to'))
+    return jsonify(response), status
+
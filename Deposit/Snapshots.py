@@ -0,0 +1,182 @@
+from firebase_admin import firestore
+from google.api_core.exceptions import NotFound
+from datetime import datetime, timezone
+from Helpers.FundLookup import FundResolver
+from Deposit.Holdings import holdings_from_snapshot
+from Deposit.Analytics import PortfolioArrays, portfolio_summary, parse_purchase_date
+import sys
+
+# Bump when the snapshot layout changes, older documents are rebuilt on read
+SNAPSHOT_VERSION = 3
+
+# Fields the nightly repricing job rewrites, everything else only changes on orders
+VALUE_FIELDS = ['holdings', 'value', 'bestPerformer', 'monthInvested', 'dayChange', 'returns', 'month',
+                'pricedAt']
+
+
+def snapshot_document(summary, assets, holdings, available_funds, now):
+    return dict(summary, **{
+        'version': SNAPSHOT_VERSION,
+        'positions': [dict(asset) for asset in assets],
+        'holdings': holdings,
+        'availableFunds': float(available_funds or 0),
+        'month': now.strftime('%Y-%m'),
+        'pricedAt': now,
+        'updatedAt': now
+    })
+
+
+def build_snapshots(users_assets, funds, available_funds, now=None):
+    # Denormalized views of many portfolios valued at the latest known NAVs,
+    # computed in one array pass. available_funds maps user id to cash.
+    now = now or datetime.now(timezone.utc)
+    portfolio = PortfolioArrays(users_assets, funds)
+    holdings = portfolio.holdings_by_user()
+    return {
+        user_id: snapshot_document(summary, users_assets[user_id], user_holdings, available_funds.get(user_id), now)
+        for user_id, summary, user_holdings in zip(portfolio.user_ids, portfolio.summaries(now), holdings)
+    }
+
+
+def build_snapshot(assets, funds, available_funds, now=None):
+    # One portfolio, on the order path: a plain loop, see portfolio_summary
+    now = now or datetime.now(timezone.utc)
+    summary, holdings = portfolio_summary(assets, funds, now)
+    return snapshot_document(summary, assets, holdings, available_funds, now)
+
+
+def refresh_portfolio_snapshot(db, user_id, assets=None, available_funds=None):
+    # Rebuilds the snapshot, callers on the write path pass the state they just wrote
+    if assets is None:
+        assets = holdings_from_snapshot(db.collection('assets').document(user_id).get())
+    if available_funds is None:
+        deposit_doc = db.collection('deposits').document(user_id).get()
+        available_funds = deposit_doc.to_dict().get('availableFunds', 0) if deposit_doc.exists else 0
+    funds = FundResolver(db)
+    funds.resolve(asset.get('isin') for asset in assets)
+    snapshot = build_snapshot(assets, funds, available_funds)
+    db.collection('portfolio_snapshots').document(user_id).set(snapshot)
+    return snapshot
+
+
+def stage_available_funds(transaction, db, user_id, available_funds, now=None):
+    # Cash-only change staged on the caller's transaction, so it commits with
+    # the deposit. A missing snapshot gets a stub without a version, which the
+    # next read rebuilds in full.
+    now = now or datetime.now(timezone.utc)
+    transaction.set(db.collection('portfolio_snapshots').document(user_id),
+                    {'availableFunds': float(available_funds), 'updatedAt': now}, merge=True)
+
+
+def sync_portfolio_snapshot(db, user_id, assets=None, available_funds=None):
+    # Write-path hook, a failed refresh must never fail the order itself
+    try:
+        snapshot_ref = db.collection('portfolio_snapshots').document(user_id)
+        if assets is None and available_funds is not None:
+            snapshot_ref.update({'availableFunds': float(available_funds), 'updatedAt': datetime.now(timezone.utc)})
+        else:
+            refresh_portfolio_snapshot(db, user_id, assets, available_funds)
+    except NotFound:
+        # No snapshot yet, the next read builds it
+        pass
+    except Exception as e:
+        print(f"Error syncing portfolio snapshot for {user_id}: {e}")
+
+
+def load_portfolio_snapshot(db, user_id):
+    snapshot_doc = db.collection('portfolio_snapshots').document(user_id).get()
+    if snapshot_doc.exists:
+        snapshot = snapshot_doc.to_dict()
+        if snapshot.get('version') == SNAPSHOT_VERSION:
+            return snapshot
+    return refresh_portfolio_snapshot(db, user_id)
+
+
+def portfolio_metrics_from_snapshot(snapshot, now=None):
+    now = now or datetime.now(timezone.utc)
+    total_value = snapshot.get('value', 0)
+    total_invested = snapshot.get('invested', 0)
+    # A purchase this month would have rewritten the snapshot during this month
+    this_month = snapshot.get('monthInvested', 0) if snapshot.get('month') == now.strftime('%Y-%m') else 0
+    return {
+        'total_portfolio_value': total_value,
+        'total_gains': total_value - total_invested,
+        'total_gains_percent': ((total_value - total_invested) / total_invested * 100) if total_invested > 0 else 0,
+        'available_funds': snapshot.get('availableFunds', 0),
+        'this_month': this_month
+    }
+
+
+def quick_stats_from_snapshot(snapshot, now=None):
+    now = now or datetime.now(timezone.utc)
+    num_funds = snapshot.get('numFunds', 0)
+    oldest_date = parse_purchase_date(snapshot.get('oldestPurchaseDate')) or now
+    oldest_date = min(oldest_date, now)
+    # Portfolio age calculation
+    age_years = now.year - oldest_date.year
+    age_months = now.month - oldest_date.month
+    if age_months < 0:
+        age_years -= 1
+        age_months += 12
+    portfolio_age = f"{age_years} years {age_months} months" if num_funds > 0 else "0 months"
+    # Value change since the previous published NAVs
+    day_change = snapshot.get('dayChange', 0)
+    previous_value = snapshot.get('value', 0) - day_change
+    return {
+        'total_invested': round(snapshot.get('invested', 0), 2),
+        'num_funds': num_funds,
+        'best_performer': snapshot.get('bestPerformer', ''),
+        'portfolio_age': portfolio_age,
+        'today_change': round(day_change, 2),
+        'today_change_percent': round(day_change / previous_value * 100, 2) if previous_value > 0 else 0,
+        # Trailing 1W/1M/1Y returns of the current holdings
+        'returns': {period: round(value, 2) if value is not None else None
+                    for period, value in (snapshot.get('returns') or {}).items()}
+    }
+
+
+def reprice_portfolio_snapshots(db=None):
+    # Nightly job: revalue every snapshot at the latest NAVs with bulk writes.
+    # Writes are conditioned on the snapshot being unchanged since it was read,
+    # so a snapshot rewritten by a concurrent order is left alone.
+    db = db or firestore.client()
+    started = datetime.now(timezone.utc)
+    snapshots = [doc for doc in db.collection('portfolio_snapshots').stream()
+                 if (doc.to_dict() or {}).get('version') == SNAPSHOT_VERSION]
+
+    # Bypass the process cache, the job should price from the source of truth
+    funds = FundResolver(db, cache=None)
+    funds.resolve(asset.get('isin') for doc in snapshots for asset in doc.to_dict().get('positions', []))
+
+    report = {'repriced': 0, 'skipped': 0}
+
+    def on_error(failure, writer):
+        report['skipped'] += 1
+        return False
+
+    data = {doc.id: doc.to_dict() for doc in snapshots}
+    rebuilt = build_snapshots({user_id: snapshot.get('positions', []) for user_id, snapshot in data.items()}, funds,
+                              {user_id: snapshot.get('availableFunds', 0) for user_id, snapshot in data.items()},
+                              now=started)
+
+    writer = db.bulk_writer()
+    writer.on_write_error(on_error)
+    for doc in snapshots:
+        snapshot = rebuilt[doc.id]
+        writer.update(doc.reference, {field: snapshot[field] for field in VALUE_FIELDS},
+                      option=db.write_option(last_update_time=doc.update_time))
+    writer.close()
+
+    report['repriced'] = len(snapshots) - report['skipped']
+    report['seconds'] = round((datetime.now(timezone.utc) - started).total_seconds(), 2)
+    return report
+
+
+if __name__ == '__main__':
+    # Scheduled nightly with: python -m Deposit.Snapshots reprice
+    from Firebase import setupfirebase
+    if len(sys.argv) < 2 or sys.argv[1] != 'reprice':
+        print("Usage: python -m Deposit.Snapshots reprice")
+        sys.exit(1)
+    setupfirebase()
+    print(reprice_portfolio_snapshots())
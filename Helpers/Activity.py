@@ -0,0 +1,55 @@
+from firebase_admin import firestore
+from datetime import datetime, timezone
+from Helpers.Pagination import valid_document_id
+import os
+
+# activity/{event}: append-only, one document per user-visible event
+#   {'userId', 'type', 'name', 'time', 'courseId', ...event specific ids}
+# Feed reads are one query on (userId ==, time desc), which needs the
+# composite index on activity (userId, time desc).
+ACTIVITY_PAGE_SIZE = int(os.getenv("ACTIVITY_PAGE_SIZE", 20))
+ACTIVITY_MAX_PAGE_SIZE = int(os.getenv("ACTIVITY_MAX_PAGE_SIZE", 100))
+
+
+def record_activity(db, user_id, event_type, name, time=None, **fields):
+    # Appends an event, a failure must never fail the action being recorded
+    if not user_id:
+        return
+    try:
+        event = {key: value for key, value in fields.items() if value is not None}
+        event.update({
+            "userId": user_id,
+            "type": event_type,
+            "name": name,
+            "time": time or datetime.now(timezone.utc)
+        })
+        db.collection("activity").add(event)
+    except Exception as e:
+        print(f"Error recording activity for {user_id}: {e}")
+
+
+def event_view(doc):
+    event = doc.to_dict()
+    event.pop("userId", None)
+    event["id"] = doc.id
+    event["time"] = event["time"].isoformat() if isinstance(event.get("time"), datetime) else event.get("time")
+    return event
+
+
+def activity_feed(db, user_id, limit=ACTIVITY_PAGE_SIZE, cursor=None):
+    # Newest first. Returns (events, next_cursor), the cursor is the id of the
+    # last event of the page and None on the last page. Raises ValueError for
+    # a cursor that is not one of this user's events.
+    limit = max(1, min(limit or ACTIVITY_PAGE_SIZE, ACTIVITY_MAX_PAGE_SIZE))
+    query = db.collection("activity").where("userId", "==", user_id) \
+        .order_by("time", direction=firestore.Query.DESCENDING)
+    if cursor:
+        if not valid_document_id(cursor):
+            raise ValueError("Invalid cursor")
+        cursor_doc = db.collection("activity").document(cursor).get()
+        if not cursor_doc.exists or cursor_doc.to_dict().get("userId") != user_id:
+            raise ValueError("Invalid cursor")
+        query = query.start_after(cursor_doc)
+    docs = list(query.limit(limit + 1).stream())
+    events = [event_view(doc) for doc in docs[:limit]]
+    return events, (events[-1]["id"] if len(docs) > limit else None)
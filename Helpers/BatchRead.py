@@ -0,0 +1,22 @@
+# Firestore accepts large batch gets, but smaller chunks keep each RPC fast
+GET_ALL_CHUNK_SIZE = 100
+
+
+def chunked(items, size):
+    items = list(items)
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+def get_snapshots(db, collection, ids, pool=None, chunk_size=GET_ALL_CHUNK_SIZE, field_paths=None):
+    # Reads documents by id with one get_all per chunk. Chunks are fetched
+    # concurrently when an executor is given. Missing documents are returned
+    # as snapshots with exists == False. field_paths limits the fields read.
+    collection_ref = db.collection(collection)
+    ids = list(dict.fromkeys(doc_id for doc_id in ids if doc_id))
+
+    def fetch(chunk):
+        return list(db.get_all([collection_ref.document(doc_id) for doc_id in chunk], field_paths=field_paths))
+
+    chunks = chunked(ids, chunk_size)
+    batches = pool.map(fetch, chunks) if pool is not None else map(fetch, chunks)
+    return {snapshot.id: snapshot for batch in batches for snapshot in batch}
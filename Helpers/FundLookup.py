@@ -0,0 +1,166 @@
+from firebase_admin import firestore
+from pydantic import BaseModel
+from typing import Optional, Dict, Any, Iterable
+from Helpers.TTLCache import TTLCache
+from Helpers.BatchRead import get_snapshots
+import os
+import threading
+
+# Fund documents change at most once a day, the listener pushes changes in between
+FUND_CACHE_TTL = int(os.getenv("FUND_CACHE_TTL", 6 * 3600))
+FUND_CACHE_SIZE = int(os.getenv("FUND_CACHE_SIZE", 5000))
+FUND_CACHE_POLL_INTERVAL = int(os.getenv("FUND_CACHE_POLL_INTERVAL", 900))
+# funds/{isin} fields read into FundInfo, lookups fetch nothing else
+FUND_FIELDS = ['name', 'category', 'type', 'risk', 'latestnav', 'lastnav', 'navDate', 'prevnav', 'returns']
+
+
+class FundInfo(BaseModel):
+    isin: str
+    exists: bool = False
+    name: Optional[str] = None
+    category: Any = ''
+    type: Any = ''
+    risk: Any = ''
+    latestnav: Optional[float] = None
+    # Precomputed daily by Deposit.Returns, None until the job has run.
+    # lastnav is the NAV the job computed them from, latestnav may be newer.
+    lastnav: Optional[float] = None
+    navDate: Optional[str] = None
+    prevnav: Optional[float] = None
+    returns: Dict[str, Optional[float]] = {}
+
+    @classmethod
+    def from_snapshot(cls, snapshot) -> "FundInfo":
+        if not snapshot.exists:
+            return cls(isin=snapshot.id)
+        data = snapshot.to_dict() or {}
+        latest_nav = data.get('latestnav')
+        last_nav = data.get('lastnav')
+        prev_nav = data.get('prevnav')
+        return cls(
+            isin=snapshot.id,
+            exists=True,
+            name=data.get('name'),
+            category=data.get('category', ''),
+            type=data.get('type', ''),
+            risk=data.get('risk', ''),
+            latestnav=float(latest_nav) if latest_nav is not None else None,
+            lastnav=float(last_nav) if last_nav is not None else None,
+            navDate=data.get('navDate'),
+            prevnav=float(prev_nav) if prev_nav is not None else None,
+            returns=data.get('returns') or {}
+        )
+
+    def nav_or(self, fallback: float) -> float:
+        # Latest NAV from the funds table if available, else the caller's fallback
+        return self.latestnav if self.latestnav is not None else float(fallback)
+
+
+def fetch_funds(db, isins, pool=None) -> Dict[str, FundInfo]:
+    snapshots = get_snapshots(db, 'funds', isins, pool=pool, field_paths=FUND_FIELDS)
+    return {isin: FundInfo.from_snapshot(snapshot) for isin, snapshot in snapshots.items()}
+
+
+class FundCache(TTLCache):
+    # Process-wide cache of `funds` documents. A Firestore listener on the
+    # collection keeps entries fresh; while the listener is down, cached
+    # entries are re-read every FUND_CACHE_POLL_INTERVAL seconds instead.
+    # Listeners cannot project fields, pushes stay small once the NAV ingest
+    # writes histories to their own collection only (see Helpers.NavHistory).
+    def __init__(self, maxsize=FUND_CACHE_SIZE, ttl=FUND_CACHE_TTL, poll_interval=FUND_CACHE_POLL_INTERVAL):
+        super().__init__(maxsize=maxsize, ttl=ttl)
+        self.poll_interval = poll_interval
+        self.polls = 0
+        self._watch = None
+        self._poller = None
+        self._stop = threading.Event()
+        self._start_lock = threading.Lock()
+
+    def start(self, db=None):
+        with self._start_lock:
+            if self._poller is not None:
+                return
+            db = db or firestore.client()
+            self._listen(db)
+            self._poller = threading.Thread(target=self._poll, args=(db,), daemon=True)
+            self._poller.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+
+    def listening(self):
+        return self._watch is not None and self._watch.is_active
+
+    def _listen(self, db):
+        try:
+            if self._watch is not None:
+                self._watch.unsubscribe()
+            self._watch = db.collection('funds').on_snapshot(self._on_snapshot)
+        except Exception as e:
+            self._watch = None
+            print(f"Fund cache listener unavailable, falling back to polling: {e}")
+
+    def _on_snapshot(self, docs, changes, read_time):
+        for change in changes:
+            if change.type.name == 'REMOVED':
+                self.invalidate(change.document.id)
+            else:
+                self.set(change.document.id, FundInfo.from_snapshot(change.document))
+
+    def _poll(self, db):
+        while not self._stop.wait(self.poll_interval):
+            if self.listening():
+                continue
+            try:
+                self._listen(db)
+                if not self.listening():
+                    for isin, fund in fetch_funds(db, self.keys()).items():
+                        self.set(isin, fund)
+                    self.polls += 1
+            except Exception as e:
+                print(f"Fund cache refresh failed: {e}")
+
+    def stats(self):
+        stats = super().stats()
+        stats['listening'] = self.listening()
+        stats['polls'] = self.polls
+        return stats
+
+
+fund_cache = FundCache()
+
+
+class FundResolver:
+    # Resolves `funds` documents for one request. Lookups go to the process-wide
+    # fund cache first and every miss is fetched in a single batched read.
+    # ISINs already resolved by this instance are never looked up twice.
+    def __init__(self, db=None, cache=fund_cache):
+        self.db = db or firestore.client()
+        self.cache = cache
+        self._resolved: Dict[str, FundInfo] = {}
+        if self.cache is not None:
+            self.cache.start(self.db)
+
+    def resolve(self, isins: Iterable[str], pool=None) -> Dict[str, FundInfo]:
+        wanted = list(dict.fromkeys(isin for isin in isins if isin))
+        missing = []
+        for isin in wanted:
+            if isin in self._resolved:
+                continue
+            cached = self.cache.get(isin) if self.cache is not None else None
+            if cached is not None:
+                self._resolved[isin] = cached
+            else:
+                missing.append(isin)
+        if missing:
+            for isin, fund in fetch_funds(self.db, missing, pool=pool).items():
+                self._resolved[isin] = fund
+                if self.cache is not None:
+                    self.cache.set(isin, fund)
+        return {isin: self.get(isin) for isin in wanted}
+
+    def get(self, isin: str) -> FundInfo:
+        return self._resolved.get(isin) or FundInfo(isin=isin or '')
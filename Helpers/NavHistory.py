@@ -0,0 +1,88 @@
+from Helpers.BatchRead import get_snapshots, chunked, GET_ALL_CHUNK_SIZE
+import pandas as pd
+import os
+
+# NAV histories live in fund_nav/{isin}, off the funds documents, so the fund
+# cache listener and fund lookups never download them. python -m
+# Deposit.Returns migrate copies the histories still written to funds there;
+# readers fall back to the funds document for a fund without a fund_nav one
+# until the NAV ingest writes fund_nav itself.
+NAV_COLLECTION = os.getenv("NAV_COLLECTION", "fund_nav")
+# Field holding the NAV history, a list of [date, value] pairs or of
+# {'date': ..., 'nav': ...} maps
+NAV_HISTORY_FIELD = os.getenv("NAV_HISTORY_FIELD", "navHistory")
+
+
+def history_rows(history):
+    rows = []
+    for point in history or []:
+        if isinstance(point, dict):
+            value = point.get('nav', point.get('value'))
+            rows.append([point.get('date'), value])
+        elif isinstance(point, (list, tuple)) and len(point) >= 2:
+            rows.append([point[0], point[1]])
+    return [row for row in rows if row[0] is not None and row[1] is not None]
+
+
+def history_series(rows):
+    # NAV per day (naive UTC midnight), sorted, the last value of a day wins
+    if not rows:
+        return pd.Series(dtype=float, index=pd.DatetimeIndex([]))
+    df = pd.DataFrame(rows, columns=['date', 'value'])
+    dates = pd.to_datetime(df['date'], utc=True, errors='coerce', format='ISO8601').dt.tz_localize(None).dt.normalize()
+    series = pd.Series(pd.to_numeric(df['value'], errors='coerce').to_numpy(), index=dates)
+    series = series[series.index.notna() & series.notna()].sort_index()
+    return series[~series.index.duplicated(keep='last')]
+
+
+def nav_history_snapshots(db, isins=None, pool=None, field=NAV_HISTORY_FIELD):
+    # Existing snapshots holding the NAV history of the given funds, every
+    # fund when no ISINs are given: fund_nav/{isin}, else funds/{isin}. Only
+    # the history field is read.
+    if isins:
+        docs = get_snapshots(db, NAV_COLLECTION, isins, pool=pool, field_paths=[field])
+        missing = [isin for isin, doc in docs.items() if not doc.exists]
+    else:
+        docs, seen = {}, set()
+        for doc in db.collection(NAV_COLLECTION).select([field]).stream():
+            seen.add(doc.id)
+            yield doc
+        missing = [ref.id for ref in db.collection('funds').list_documents() if ref.id not in seen]
+    yield from (doc for doc in docs.values() if doc.exists)
+    # Chunk by chunk so a full scan never holds every fallback history at once
+    for chunk in chunked(missing, GET_ALL_CHUNK_SIZE):
+        yield from (doc for doc in get_snapshots(db, 'funds', chunk, pool=pool, field_paths=[field]).values() if doc.exists)
+
+
+def load_nav_history(db, isins, pool=None, field=NAV_HISTORY_FIELD):
+    # {isin: daily NAV series} for the given funds, empty for unknown ones
+    histories = {doc.id: (doc.to_dict() or {}).get(field) for doc in nav_history_snapshots(db, isins, pool, field)}
+    return {
+        isin: history_series(history_rows(histories.get(isin)))
+        for isin in dict.fromkeys(isin for isin in isins if isin)
+    }
+
+
+# Trailing return windows stored on funds documents, see Deposit.Returns.
+# 1D compares with the previous published NAV, whatever its date.
+RETURN_PERIODS = {'1W': pd.DateOffset(weeks=1), '1M': pd.DateOffset(months=1), '1Y': pd.DateOffset(years=1)}
+
+
+def nav_returns(series):
+    # Last NAV (lastnav, on navDate), the one before it (prevnav) and percent
+    # returns of the last NAV of a daily series. A window reaching before the
+    # first NAV has no return.
+    if series.empty:
+        return {'navDate': None, 'lastnav': None, 'prevnav': None,
+                'returns': {period: None for period in ['1D', *RETURN_PERIODS]}}
+    last_day, last = series.index[-1], float(series.iloc[-1])
+    prevnav = float(series.iloc[-2]) if len(series) > 1 else None
+
+    def change(base):
+        return round((last - base) / base * 100, 4) if base else None
+
+    returns = {'1D': change(prevnav)}
+    for period, offset in RETURN_PERIODS.items():
+        day = last_day - offset
+        returns[period] = change(float(series.asof(day))) if day >= series.index[0] else None
+    return {'navDate': last_day.strftime('%Y-%m-%d'), 'lastnav': last, 'prevnav': prevnav, 'returns': returns}
@@ -0,0 +1,91 @@
+from flask import Response, current_app, jsonify, stream_with_context
+import os
+import re
+
+# Largest page a listing endpoint serves, listings without a limit stay unpaged
+PAGE_MAX_LIMIT = int(os.getenv("PAGE_MAX_LIMIT", 500))
+# Query parameters of a paged listing, see page_params
+PAGE_PARAMS = ('limit', 'cursor', 'fields', 'stream')
+# Field paths that select() accepts without quoting, e.g. name or preferences.theme
+FIELD_PATTERN = re.compile(r'[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)*')
+
+
+def valid_document_id(value):
+    # Firestore rejects these ids, a cursor is always the id of a listed document
+    return ('/' not in value and value not in ('.', '..') and len(value.encode()) <= 1500
+            and not (value.startswith('__') and value.endswith('__')))
+
+
+def paged(args):
+    # Whether a listing request uses any paging parameter
+    return any(key in args for key in PAGE_PARAMS)
+
+
+def page_params(args):
+    # (limit, cursor, fields, stream) from ?limit=&cursor=&fields=a,b&stream=1
+    limit = args.get('limit')
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise ValueError("limit must be a positive integer")
+        if limit <= 0:
+            raise ValueError("limit must be a positive integer")
+        limit = min(limit, PAGE_MAX_LIMIT)
+    fields = [field.strip() for field in args.get('fields', '').split(',') if field.strip()] or None
+    if fields and not all(FIELD_PATTERN.fullmatch(field) for field in fields):
+        raise ValueError("fields must be comma separated field names")
+    cursor = args.get('cursor') or None
+    if cursor and not valid_document_id(cursor):
+        raise ValueError("Invalid cursor")
+    stream = args.get('stream', '').lower() in ('1', 'true')
+    return limit, cursor, fields, stream
+
+
+class Page:
+    # One page of a collection ordered by document id. The cursor is the id of
+    # the last document of the previous page. Nothing is read until the rows
+    # are iterated, so a streamed response never holds the page in memory.
+    def __init__(self, collection, limit=None, cursor=None, fields=None):
+        query = collection.order_by("__name__")
+        if fields:
+            query = query.select([field for field in fields if field != 'id'])
+        if cursor:
+            query = query.start_after({"__name__": cursor})
+        if limit:
+            # One extra document tells whether another page follows
+            query = query.limit(limit + 1)
+        self.query = query
+        self.limit = limit
+        self.next_cursor = None
+
+    def rows(self):
+        last_id = None
+        for count, doc in enumerate(self.query.stream()):
+            if self.limit and count == self.limit:
+                self.next_cursor = last_id
+                break
+            data = doc.to_dict() or {}
+            data["id"] = doc.id
+            last_id = doc.id
+            yield data
+
+    def payload(self):
+        rows = list(self.rows())
+        return {"data": rows, "nextCursor": self.next_cursor}
+
+
+def stream_page(page):
+    # Same body as jsonify(page.payload()), written one document at a time
+    def generate():
+        yield '{"data": ['
+        for index, row in enumerate(page.rows()):
+            yield (',' if index else '') + current_app.json.dumps(row)
+        yield '], "nextCursor": ' + current_app.json.dumps(page.next_cursor) + '}'
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+
+def page_response(response, status):
+    if isinstance(response, Page):
+        return stream_page(response)
+    return jsonify(response), status
@@ -0,0 +1,69 @@
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    # Thread-safe LRU cache whose entries also expire `ttl` seconds after being stored
+    def __init__(self, maxsize=1024, ttl=600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def keys(self):
+        with self._lock:
+            return list(self._data.keys())
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0
+            }
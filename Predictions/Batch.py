@@ -0,0 +1,204 @@
+from firebase_admin import firestore
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timezone
+from Helpers.BatchRead import get_snapshots, chunked, GET_ALL_CHUNK_SIZE
+from Helpers.NavHistory import history_rows, nav_history_snapshots, NAV_HISTORY_FIELD
+from Predictions.Functions import forecast_from_data
+from Predictions.Pool import WorkerContext, FORECAST_WORKERS
+from Predictions.Cache import series_frame, plan_forecast, forecast_meta
+from Predictions.Encoding import predictions_document, decode_document
+import pandas as pd
+import argparse
+import threading
+import time
+import os
+
+# NAV history field the batch reads series from, see Helpers.NavHistory
+FORECAST_HISTORY_FIELD = os.getenv("FORECAST_HISTORY_FIELD", NAV_HISTORY_FIELD)
+# Seconds of grid search allowed per fund, configurations still running are dropped
+FORECAST_BATCH_TIME_BUDGET = float(os.getenv("FORECAST_BATCH_TIME_BUDGET", 120))
+# Predictions documents are large (years of daily rows), keep each commit small
+FORECAST_BATCH_WRITE_SIZE = int(os.getenv("FORECAST_BATCH_WRITE_SIZE", 20))
+# Shorter series are skipped, cross-validation needs some history
+FORECAST_MIN_ROWS = int(os.getenv("FORECAST_MIN_ROWS", 30))
+# Funds planned per read of their stored predictions, bounds the decoded documents held at once
+FORECAST_BATCH_PLAN_SIZE = int(os.getenv("FORECAST_BATCH_PLAN_SIZE", GET_ALL_CHUNK_SIZE))
+
+
+def load_funds_series(db, isins=None, field=FORECAST_HISTORY_FIELD):
+    # {isin: rows} from the NAV histories, every fund when no ISINs are given
+    docs = nav_history_snapshots(db, isins, field=field)
+    return {doc.id: history_rows((doc.to_dict() or {}).get(field)) for doc in docs}
+
+
+def load_dump_series(path, isins=None):
+    # {isin: rows} from a CSV or Parquet dump with isin, date and value (or nav) columns
+    df = pd.read_parquet(path) if path.endswith('.parquet') else pd.read_csv(path)
+    if 'value' not in df.columns and 'nav' in df.columns:
+        df = df.rename(columns={'nav': 'value'})
+    if isins:
+        df = df[df['isin'].isin(isins)]
+    return {isin: group[['date', 'value']].values.tolist() for isin, group in df.groupby('isin', sort=False)}
+
+
+# Runs in a worker process, the grid search stays serial there
+def forecast_series(rows, param_grid, params, init, time_budget):
+    started = time.perf_counter()
+    prediction = forecast_from_data(rows, param_grid=param_grid, workers=1, params=params,
+                                    init=init, time_budget=time_budget)
+    return {
+        'predictions': prediction.to_dict(orient='records'),
+        'search': prediction.attrs.get('search', {}),
+        'fit_params': prediction.attrs.get('fit_params'),
+        'seconds': time.perf_counter() - started
+    }
+
+
+def percentile(values, q):
+    return round(float(pd.Series(values).quantile(q)), 3) if values else None
+
+
+def run_batch(series, db=None, param_grid=None, workers=None, time_budget=FORECAST_BATCH_TIME_BUDGET,
+              full_search=False):
+    # Forecasts every {isin: rows} series across a process pool and writes the
+    # results to predictions/{isin} in batched commits. Series unchanged since
+    # their stored forecast are skipped, extended ones reuse the stored
+    # hyperparameters (see Predictions.Cache.plan_forecast).
+    db = db or firestore.client()
+    started = time.perf_counter()
+    workers = max(1, workers or FORECAST_WORKERS)
+    report = {'funds': len(series), 'forecast': 0, 'unchanged': 0, 'reused': 0, 'searched': 0,
+              'tooShort': 0, 'failed': 0, 'overBudget': 0, 'writeFailed': 0, 'errors': {}}
+
+    latencies = []
+    pending_writes = []
+    write_seconds = 0
+
+    def flush():
+        nonlocal write_seconds
+        write_started = time.perf_counter()
+        batch = db.batch()
+        for isin, document in pending_writes:
+            batch.set(db.collection('predictions').document(isin), document)
+        try:
+            batch.commit()
+            report['forecast'] += len(pending_writes)
+        except Exception as e:
+            print(f"Batch write failed: {e}")
+            report['writeFailed'] += len(pending_writes)
+            for isin, _ in pending_writes:
+                report['errors'][isin] = str(e)
+        pending_writes.clear()
+        write_seconds += time.perf_counter() - write_started
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=WorkerContext()) as pool:
+        futures = {}
+        # Stored predictions are read and decoded one chunk at a time, workers
+        # start on the first chunk while the next ones are planned
+        for chunk in chunked(series.keys(), FORECAST_BATCH_PLAN_SIZE):
+            stored_docs = get_snapshots(db, 'predictions', chunk)
+            for isin in chunk:
+                rows = series[isin]
+                if len(rows) < FORECAST_MIN_ROWS:
+                    report['tooShort'] += 1
+                    continue
+                df = series_frame(rows)
+                stored_doc = stored_docs.get(isin)
+                stored = decode_document(stored_doc.to_dict()) if stored_doc is not None and stored_doc.exists else {}
+                plan = plan_forecast(df, stored, param_grid=param_grid, full_search=full_search)
+                if plan['cache'] == 'stored':
+                    report['unchanged'] += 1
+                    continue
+                future = pool.submit(forecast_series, df.values.tolist(), param_grid, plan['params'],
+                                     plan['init'], time_budget)
+                futures[future] = (isin, plan)
+        for future in as_completed(futures):
+            # Dropped as soon as it is handled, so finished predictions are
+            # only held until their write is flushed
+            isin, plan = futures.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"Forecast failed for {isin}: {e}")
+                report['failed'] += 1
+                report['errors'][isin] = str(e)
+                continue
+            latencies.append(result['seconds'])
+            report['reused' if plan['cache'] == 'reused' else 'searched'] += 1
+            if time_budget is not None and result['seconds'] > time_budget:
+                report['overBudget'] += 1
+            meta = forecast_meta(plan, result['search'], result['fit_params'])
+            pending_writes.append((isin, predictions_document(result['predictions'], meta)))
+            if len(pending_writes) >= FORECAST_BATCH_WRITE_SIZE:
+                flush()
+    if pending_writes:
+        flush()
+
+    seconds = time.perf_counter() - started
+    report.update({
+        'workers': workers,
+        'seconds': round(seconds, 3),
+        'writeSeconds': round(write_seconds, 3),
+        'fundsPerMinute': round(len(latencies) / seconds * 60, 2) if seconds > 0 else 0,
+        'latency': {
+            'p50': percentile(latencies, 0.5),
+            'p95': percentile(latencies, 0.95),
+            'max': round(max(latencies), 3) if latencies else None
+        }
+    })
+    return report
+
+
+class BatchRunner:
+    # One batch at a time for the admin endpoint, the last report stays readable.
+    # Series always come from the NAV histories, dumps are CLI-only.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self.state = {'status': 'idle'}
+
+    def start(self, isins=None, **options):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return False
+            self.state = {'status': 'running', 'startedAt': datetime.now(timezone.utc).isoformat(),
+                          'finishedAt': None, 'report': None, 'error': None}
+            self._thread = threading.Thread(target=self._run, args=(isins, options), daemon=True)
+            self._thread.start()
+            return True
+
+    def status(self):
+        with self._lock:
+            return dict(self.state)
+
+    def _run(self, isins, options):
+        try:
+            db = firestore.client()
+            series = load_funds_series(db, isins)
+            report, status, error = run_batch(series, db=db, **options), 'done', None
+        except Exception as e:
+            print(f"Forecast batch failed: {e}")
+            report, status, error = None, 'failed', str(e)
+        with self._lock:
+            self.state.update({'status': status, 'report': report, 'error': error,
+                               'finishedAt': datetime.now(timezone.utc).isoformat()})
+
+
+batch_runner = BatchRunner()
+
+
+if __name__ == '__main__':
+    # python -m Predictions.Batch [--file dump.parquet] [--isins A,B] [--workers N] [--time-budget S] [--full-search]
+    from Firebase import setupfirebase
+    parser = argparse.ArgumentParser(description="Forecast many funds and store the predictions")
+    parser.add_argument('--file', help="CSV or Parquet dump with isin, date, value columns, defaults to the NAV histories")
+    parser.add_argument('--isins', help="Comma separated ISINs, defaults to every fund")
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--time-budget', type=float, default=FORECAST_BATCH_TIME_BUDGET)
+    parser.add_argument('--full-search', action='store_true')
+    args = parser.parse_args()
+    setupfirebase()
+    db = firestore.client()
+    isins = [isin for isin in args.isins.split(',') if isin] if args.isins else None
+    series = load_dump_series(args.file, isins) if args.file else load_funds_series(db, isins)
+    print(run_batch(series, db=db, workers=args.workers, time_budget=args.time_budget, full_search=args.full_search))
@@ -0,0 +1,214 @@
+from Predictions.Functions import prepare_series, forecast_from_data, FORECAST_TEST_SIZE
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+import pandas as pd
+import numpy as np
+import multiprocessing
+import tracemalloc
+import argparse
+import resource
+import json
+import math
+import time
+import io
+
+# Pipeline variants compared by the forecast benchmark, passed to forecast_from_data
+BENCHMARK_CONFIGS = {
+    'default': {},
+    'single-config': {'param_grid': {'seasonality_mode': ['additive'], 'seasonality_prior_scale': [1.0],
+                                     'changepoint_prior_scale': [0.1]}},
+    'period-30d': {'period': '30 days'},
+    'period-90d': {'period': '90 days'},
+    'initial-50': {'initial_ratio': 0.5},
+    'no-trim': {'trim_outliers': False}
+}
+# Fixed end date so synthetic series are identical between runs
+SYNTHETIC_END = '2025-12-31'
+
+
+def synthetic_series(years=10, seed=0, drift=0.0003, volatility=0.01, seasonality=0.0):
+    # Daily NAV random walk with an optional yearly cycle, the shape of a long fund history
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(end=SYNTHETIC_END, periods=years * 365, freq='D')
+    values = 100 * np.exp(np.cumsum(rng.normal(drift, volatility, len(dates))))
+    values *= 1 + seasonality * np.sin(2 * np.pi * dates.dayofyear / 365.25)
+    return [[date.strftime('%Y-%m-%d'), float(value)] for date, value in zip(dates, values)]
+
+
+def synthetic_suite(count=4, years=10):
+    # Calm, volatile, trending and seasonal funds, cycled with different seeds
+    regimes = [
+        {'drift': 0.0002, 'volatility': 0.005},
+        {'drift': 0.0003, 'volatility': 0.02},
+        {'drift': 0.0008, 'volatility': 0.01},
+        {'drift': 0.0003, 'volatility': 0.008, 'seasonality': 0.05}
+    ]
+    return {f"synthetic-{seed}": synthetic_series(years, seed, **regimes[seed % len(regimes)]) for seed in range(count)}
+
+
+def legacy_prepare(data):
+    # Preprocessing forecast_from_data did before the lean pipeline, kept for comparison
+    df = pd.DataFrame(data, columns=['date', 'value'])
+    df['date'] = pd.to_datetime(df['date'])
+    print(df.info())
+    print(df.isnull().sum() / len(df) * 100)
+    print(f"Earliest date: {df['date'].min()}")
+    print(f"Latest date: {df['date'].max()}")
+    print(f"Total Time Span: {(df['date'].max() - df['date'].min()).days} days")
+    df.drop(columns=['date']).corr()
+    df.sort_values(by='date', inplace=True)
+    df['DayOfWeek'] = df['date'].dt.dayofweek
+    for lag in [1, 7, 30]:
+        df[f'value_Lag_{lag}'] = df['value'].shift(lag).ffill()
+    for window in [7, 30]:
+        df[f'value_Rolling_Mean_{window}'] = df['value'].rolling(window=window).mean().ffill()
+        df[f'value_Rolling_Std_{window}'] = df['value'].rolling(window=window).std().ffill()
+    df['Month'] = df['date'].dt.month
+    df['Year'] = df['date'].dt.year
+    X = df.drop(columns=['date', 'value'])
+    y = df['value']
+    # Same split as train_test_split(test_size=0.2, shuffle=False)
+    n_train = len(df) - math.ceil(len(df) * FORECAST_TEST_SIZE)
+    X_train, X_test, y_train, y_test = X.iloc[:n_train], X.iloc[n_train:], y.iloc[:n_train], y.iloc[n_train:]
+    print("X_train shape:", X_train.shape)
+    print("X_test shape:", X_test.shape)
+    return pd.DataFrame({'ds': df['date'][:len(X_train)], 'y': y_train})
+
+
+def lean_prepare(data):
+    df = prepare_series(data)
+    return df.iloc[:len(df) - math.ceil(len(df) * FORECAST_TEST_SIZE)]
+
+
+def measure(prepare, data, repeats):
+    timings = []
+    peaks = []
+    for _ in range(repeats):
+        tracemalloc.start()
+        started = time.perf_counter()
+        with redirect_stdout(io.StringIO()):
+            train_df = prepare(data)
+        timings.append(time.perf_counter() - started)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return {
+        'ms': round(min(timings) * 1000, 2),
+        'peak_mib': round(max(peaks) / 2 ** 20, 2),
+        'train_rows': len(train_df)
+    }
+
+
+def benchmark_prepare(years=10, repeats=5):
+    # Preprocessing cost per forecast request, legacy vs lean, on one daily series
+    data = synthetic_series(years)
+    legacy = measure(legacy_prepare, data, repeats)
+    lean = measure(lean_prepare, data, repeats)
+    return {
+        'rows': len(data),
+        'legacy': legacy,
+        'lean': lean,
+        'speedup': round(legacy['ms'] / lean['ms'], 2) if lean['ms'] else None,
+        'memory_saved_mib': round(legacy['peak_mib'] - lean['peak_mib'], 2)
+    }
+
+
+def holdout_errors(data, pred):
+    # Accuracy of the forecast on the rows forecast_from_data held out of training
+    df = prepare_series(data)
+    test = df.iloc[len(df) - math.ceil(len(df) * FORECAST_TEST_SIZE):]
+    forecast = pred[['date', 'value']].rename(columns={'date': 'ds', 'value': 'yhat'})
+    merged = test.merge(forecast, on='ds')
+    if merged.empty:
+        return {'rmse': None, 'mape': None, 'coverage': 0}
+    errors = merged['y'] - merged['yhat']
+    return {
+        'rmse': round(float(np.sqrt((errors ** 2).mean())), 4),
+        'mape': round(float((errors.abs() / merged['y'].abs()).mean() * 100), 4),
+        # Share of the held-out days still present after the negative/IQR trimming
+        'coverage': round(len(merged) / len(test), 4)
+    }
+
+
+def run_forecast(config, options, series_name, data):
+    # One forecast in a fresh process, so ru_maxrss is the peak of this run alone.
+    # Stan runs as a child process, its peak is reported separately.
+    started = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        pred = forecast_from_data(data, workers=1, debug=False, **options)
+    seconds = time.perf_counter() - started
+    search = pred.attrs.get('search', {})
+    return dict({
+        'config': config,
+        'series': series_name,
+        'rows': len(data),
+        'seconds': round(seconds, 3),
+        'search_seconds': search.get('seconds'),
+        'configs_evaluated': len(search.get('configs', [])),
+        'peak_rss_mib': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'stan_peak_rss_mib': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1)
+    }, **holdout_errors(data, pred))
+
+
+def summarize(results):
+    df = pd.DataFrame(results)
+    if df.empty:
+        return []
+    summary = df.groupby('config', sort=False).agg(
+        series=('series', 'count'),
+        mean_seconds=('seconds', 'mean'),
+        p95_seconds=('seconds', lambda values: values.quantile(0.95)),
+        total_seconds=('seconds', 'sum'),
+        peak_rss_mib=('peak_rss_mib', 'max'),
+        stan_peak_rss_mib=('stan_peak_rss_mib', 'max'),
+        mean_rmse=('rmse', 'mean'),
+        mean_mape=('mape', 'mean'),
+        mean_coverage=('coverage', 'mean')
+    )
+    summary['series_per_minute'] = summary['series'] / summary['total_seconds'] * 60
+    return summary.round(4).reset_index().to_dict(orient='records')
+
+
+def benchmark_forecast(series, configs=None):
+    # Runs every config on every {name: rows} series, one fresh process per run
+    configs = configs or list(BENCHMARK_CONFIGS)
+    unknown = [config for config in configs if config not in BENCHMARK_CONFIGS]
+    if unknown:
+        raise ValueError(f"Unknown benchmark configs: {', '.join(unknown)}")
+    results = []
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context, max_tasks_per_child=1) as pool:
+        for config in configs:
+            for series_name, data in series.items():
+                try:
+                    result = pool.submit(run_forecast, config, BENCHMARK_CONFIGS[config], series_name, data).result()
+                except Exception as e:
+                    result = {'config': config, 'series': series_name, 'error': str(e)}
+                print(result)
+                results.append(result)
+    return {'results': results, 'summary': summarize([r for r in results if 'error' not in r])}
+
+
+if __name__ == '__main__':
+    # python -m Predictions.Benchmark prepare [--years 10]
+    # python -m Predictions.Benchmark forecast [--file dump.csv] [--series 4] [--years 10] [--configs default,no-trim] [--out results.json]
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the forecast pipeline")
+    parser.add_argument('benchmark', choices=['prepare', 'forecast'])
+    parser.add_argument('--years', type=int, default=10)
+    parser.add_argument('--series', type=int, default=4, help="Synthetic series to generate")
+    parser.add_argument('--file', help="Recorded NAV series, CSV or Parquet with isin, date, value columns")
+    parser.add_argument('--configs', help=f"Comma separated subset of {', '.join(BENCHMARK_CONFIGS)}")
+    parser.add_argument('--out', help="Write the full results as JSON")
+    args = parser.parse_args()
+    if args.benchmark == 'prepare':
+        report = benchmark_prepare(years=args.years)
+    else:
+        if args.file:
+            from Predictions.Batch import load_dump_series
+            series = load_dump_series(args.file)
+        else:
+            series = synthetic_suite(args.series, args.years)
+        report = benchmark_forecast(series, configs=args.configs.split(',') if args.configs else None)
+    print(json.dumps(report, indent=2, default=str))
+    if args.out:
+        with open(args.out, 'w') as out:
+            json.dump(report, out, indent=2, default=str)
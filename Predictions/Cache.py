@@ -0,0 +1,160 @@
+from firebase_admin import firestore
+from datetime import datetime, timezone, timedelta
+from Helpers.TTLCache import TTLCache
+from Predictions.Functions import forecast_from_data, SavePredictions, DEFAULT_PARAM_GRID
+from Predictions.Encoding import decode_document
+import pandas as pd
+import hashlib
+import json
+import os
+
+# Forecasts computed by this process, keyed by (isin, series hash, grid hash)
+FORECAST_CACHE_SIZE = int(os.getenv("FORECAST_CACHE_SIZE", 256))
+FORECAST_CACHE_TTL = int(os.getenv("FORECAST_CACHE_TTL", 24 * 3600))
+
+# Incremental refresh: reused hyperparameters are searched again after this
+# many days, or earlier when the new NAVs drift from the stored forecast by
+# more than this mean absolute percentage error
+FORECAST_RESEARCH_DAYS = int(os.getenv("FORECAST_RESEARCH_DAYS", 30))
+FORECAST_DRIFT_THRESHOLD = float(os.getenv("FORECAST_DRIFT_THRESHOLD", 0.05))
+
+forecast_cache = TTLCache(maxsize=FORECAST_CACHE_SIZE, ttl=FORECAST_CACHE_TTL)
+
+
+def series_frame(data):
+    # Same parsing and ordering forecast_from_data applies to the input rows
+    df = pd.DataFrame(data, columns=['date', 'value'])
+    df['date'] = pd.to_datetime(df['date'])
+    return df.sort_values(by='date', kind='stable').reset_index(drop=True)
+
+
+def series_fingerprint(df, rows=None):
+    # Hash of the first `rows` (date, value) pairs, the whole series by default
+    df = df if rows is None else df.iloc[:rows]
+    digest = hashlib.sha256()
+    digest.update(df['date'].astype('datetime64[ns]').to_numpy().astype('int64').tobytes())
+    digest.update(df['value'].astype('float64').to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def grid_fingerprint(param_grid):
+    grid = param_grid or DEFAULT_PARAM_GRID
+    return hashlib.sha256(json.dumps(grid, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def stored_forecast(db, isin):
+    doc = db.collection('predictions').document(isin).get()
+    return decode_document(doc.to_dict()) if doc.exists else {}
+
+
+def forecast_drift(df, stored_rows, predictions):
+    # MAPE of the stored forecast on the days appended since it was made
+    new_rows = df.iloc[stored_rows:]
+    if new_rows.empty or not predictions:
+        return None
+    forecast = pd.Series([row.get('value') for row in predictions],
+                         index=pd.to_datetime([row.get('date') for row in predictions], utc=True).tz_localize(None))
+    forecast = forecast[~forecast.index.duplicated()]
+    expected = forecast.reindex(new_rows['date']).to_numpy(dtype='float64')
+    actual = new_rows['value'].to_numpy(dtype='float64')
+    mask = ~pd.isna(expected) & (actual != 0)
+    if not mask.any():
+        return None
+    return float(abs((actual[mask] - expected[mask]) / actual[mask]).mean())
+
+
+def search_is_stale(meta, now):
+    searched_at = meta.get('searchedAt')
+    if searched_at is None:
+        return True
+    if searched_at.tzinfo is None:
+        searched_at = searched_at.replace(tzinfo=timezone.utc)
+    return now - searched_at > timedelta(days=FORECAST_RESEARCH_DAYS)
+
+
+def plan_forecast(df, stored, param_grid=None, full_search=False, now=None):
+    # Decides how a series is served given the stored predictions document.
+    # plan['cache'] is:
+    #   stored  same series and grid, the stored predictions are current
+    #   reused  stored series is a prefix of this one: best_params are reused
+    #           without a grid search and the fit is warm-started from the
+    #           stored model, unless the search is stale or the series drifted
+    #   miss    full grid search
+    now = now or datetime.now(timezone.utc)
+    meta = stored.get('meta') or {}
+    plan = {
+        'seriesHash': series_fingerprint(df),
+        'seriesRows': len(df),
+        'gridHash': grid_fingerprint(param_grid),
+        'params': None,
+        'init': None,
+        'drift': None,
+        'meta': meta,
+        'now': now
+    }
+    same_grid = meta.get('gridHash') == plan['gridHash']
+    if same_grid and meta.get('seriesHash') == plan['seriesHash'] and stored.get('predictions') is not None:
+        plan['cache'] = 'stored'
+        return plan
+
+    # Days appended to the previous series: keep its hyperparameters, refit only
+    stored_rows = meta.get('seriesRows') or 0
+    extends = (same_grid and meta.get('bestParams') and 0 < stored_rows < len(df)
+               and series_fingerprint(df, stored_rows) == meta.get('seriesHash'))
+    if extends:
+        plan['drift'] = forecast_drift(df, stored_rows, stored.get('predictions'))
+    reuse = (extends and not full_search and not search_is_stale(meta, now)
+             and (plan['drift'] is None or plan['drift'] <= FORECAST_DRIFT_THRESHOLD))
+    if reuse:
+        plan['params'] = meta['bestParams']
+        plan['init'] = meta.get('fitParams')
+    plan['cache'] = 'reused' if reuse else 'miss'
+    return plan
+
+
+def forecast_meta(plan, search, fit_params):
+    # Metadata stored next to the predictions for the next plan_forecast
+    reused = plan['cache'] == 'reused'
+    return {
+        'seriesHash': plan['seriesHash'],
+        'seriesRows': plan['seriesRows'],
+        'gridHash': plan['gridHash'],
+        'bestParams': search.get('best_params'),
+        'bestRmse': plan['meta'].get('bestRmse') if reused else search.get('best_rmse'),
+        'fitParams': fit_params,
+        'searchedAt': plan['meta'].get('searchedAt') if reused else plan['now'],
+        'updatedAt': plan['now']
+    }
+
+
+def forecast_report(plan, meta):
+    return {'cache': plan['cache'], 'bestParams': meta.get('bestParams'),
+            'bestRmse': meta.get('bestRmse'), 'drift': plan['drift']}
+
+
+def cached_forecast(isin, data, param_grid=None, workers=None, cv_parallel=None, full_search=False):
+    # Forecasts and saves `data` for `isin` unless the same inputs were already
+    # forecast. Returns (predictions, report), report['cache'] is 'hit' when
+    # served from this process, else the plan_forecast outcome.
+    df = series_frame(data)
+    key = (isin, series_fingerprint(df), grid_fingerprint(param_grid))
+    cached = forecast_cache.get(key)
+    if cached is not None:
+        return cached['predictions'], dict(cached['report'], cache='hit')
+
+    stored = stored_forecast(firestore.client(), isin)
+    plan = plan_forecast(df, stored, param_grid=param_grid, full_search=full_search)
+    if plan['cache'] == 'stored':
+        report = forecast_report(plan, plan['meta'])
+        forecast_cache.set(key, {'predictions': stored['predictions'], 'report': report})
+        return stored['predictions'], report
+
+    prediction = forecast_from_data(df.values.tolist(), param_grid=param_grid, workers=workers,
+                                    cv_parallel=cv_parallel, params=plan['params'], init=plan['init'])
+    meta = forecast_meta(plan, prediction.attrs.get('search', {}), prediction.attrs.get('fit_params'))
+    saved = SavePredictions(isin, prediction, meta=meta)
+    if saved is None:
+        raise RuntimeError("Failed to save predictions")
+    report = forecast_report(plan, meta)
+    forecast_cache.set(key, {'predictions': saved, 'report': report})
+    return saved, report
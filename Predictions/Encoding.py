@@ -0,0 +1,126 @@
+from datetime import datetime, timedelta, timezone
+import pandas as pd
+import numpy as np
+import os
+
+# 'columnar' stores predictions as packed arrays, 'rows' keeps the legacy list of dicts
+PREDICTIONS_ENCODING = os.getenv("PREDICTIONS_ENCODING", "columnar")
+COLUMNAR_ENCODING = 'columnar-f32'
+
+# Chart resolutions stored next to the daily series, mapped to pandas resample rules
+RESOLUTIONS = {'weekly': 'W', 'monthly': 'MS'}
+VALUE_COLUMNS = ['value', 'min', 'max']
+# Downsampled points average the forecast and keep the widest interval
+AGGREGATIONS = {'value': 'mean', 'min': 'min', 'max': 'max'}
+# float32 keeps ~7 significant digits, decoded values are rounded to hide the noise
+DECODED_DECIMALS = 4
+
+# Layout of a columnar predictions field:
+#   {'encoding': 'columnar-f32', 'daily': block, 'weekly': block, 'monthly': block}
+# where a block is
+#   {'start': 'YYYY-MM-DD', 'count': n,
+#    'offsets': int32 days from start, 'index': int32 row index,
+#    'value'/'min'/'max': float32}
+# with every array stored as little-endian Firestore bytes.
+
+
+def predictions_frame(predictions):
+    # DataFrame with index, date, value, min, max from records or a DataFrame
+    df = predictions.copy() if isinstance(predictions, pd.DataFrame) else pd.DataFrame(list(predictions))
+    if df.empty:
+        return pd.DataFrame(columns=['index', 'date'] + VALUE_COLUMNS)
+    df['date'] = pd.to_datetime(df['date'], utc=True).dt.tz_localize(None).dt.normalize()
+    if 'index' not in df.columns:
+        df['index'] = range(len(df))
+    return df.sort_values(by='date', kind='stable').reset_index(drop=True)
+
+
+def encode_block(df):
+    if df.empty:
+        return {'start': None, 'count': 0}
+    start = df['date'].iloc[0]
+    offsets = ((df['date'] - start) // pd.Timedelta(days=1)).to_numpy()
+    block = {
+        'start': start.strftime('%Y-%m-%d'),
+        'count': len(df),
+        'offsets': offsets.astype('<i4').tobytes(),
+        'index': df['index'].to_numpy().astype('<i4').tobytes()
+    }
+    for column in VALUE_COLUMNS:
+        block[column] = df[column].to_numpy().astype('<f4').tobytes()
+    return block
+
+
+def decode_block(block, start=None, end=None):
+    # Records of the block, only those dated within [start, end] when given.
+    # Offsets are sorted, so the window is sliced before anything is decoded.
+    count = block.get('count') or 0
+    if count == 0:
+        return []
+    block_start = datetime.strptime(block['start'], '%Y-%m-%d').date()
+    offsets = np.frombuffer(block['offsets'], dtype='<i4')
+    lo = 0 if start is None else int(np.searchsorted(offsets, (start - block_start).days, side='left'))
+    hi = count if end is None else int(np.searchsorted(offsets, (end - block_start).days, side='right'))
+    if lo >= hi:
+        return []
+    origin = datetime.combine(block_start, datetime.min.time(), tzinfo=timezone.utc)
+    days = offsets[lo:hi].tolist()
+    index = np.frombuffer(block['index'], dtype='<i4')[lo:hi].tolist()
+    columns = [np.frombuffer(block[column], dtype='<f4')[lo:hi].astype(float).round(DECODED_DECIMALS).tolist()
+               for column in VALUE_COLUMNS]
+    return [
+        {'index': index[i], 'date': origin + timedelta(days=days[i]),
+         'value': columns[0][i], 'min': columns[1][i], 'max': columns[2][i]}
+        for i in range(hi - lo)
+    ]
+
+
+def downsample(df, rule):
+    if df.empty:
+        return df
+    resampled = df.set_index('date')[VALUE_COLUMNS].resample(rule).agg(AGGREGATIONS).dropna().reset_index()
+    resampled['index'] = range(len(resampled))
+    return resampled
+
+
+def encode_predictions(predictions):
+    df = predictions_frame(predictions)
+    encoded = {'encoding': COLUMNAR_ENCODING, 'daily': encode_block(df)}
+    for resolution, rule in RESOLUTIONS.items():
+        encoded[resolution] = encode_block(downsample(df, rule))
+    return encoded
+
+
+def decode_predictions(stored, resolution='daily', start=None, end=None):
+    # Records from either layout, optionally limited to dates within [start, end].
+    # Legacy row lists are downsampled on read.
+    if isinstance(stored, dict) and stored.get('encoding') == COLUMNAR_ENCODING:
+        return decode_block(stored.get(resolution) or {}, start, end)
+    rows = list(stored or [])
+    if not rows:
+        return rows
+    if resolution != 'daily':
+        return decode_block(encode_block(downsample(predictions_frame(rows), RESOLUTIONS[resolution])), start, end)
+    if start is None and end is None:
+        return rows
+    return decode_block(encode_block(predictions_frame(rows)), start, end)
+
+
+def predictions_document(predictions, meta=None):
+    # Document written to predictions/{isin}
+    if PREDICTIONS_ENCODING == 'columnar':
+        document = {'predictions': encode_predictions(predictions)}
+    else:
+        records = predictions.to_dict(orient='records') if isinstance(predictions, pd.DataFrame) else predictions
+        document = {'predictions': records}
+    if meta is not None:
+        # Inputs fingerprint and selected hyperparameters, see Predictions.Cache
+        document['meta'] = meta
+    return document
+
+
+def decode_document(data, resolution='daily', start=None, end=None):
+    data = dict(data or {})
+    if 'predictions' in data:
+        data['predictions'] = decode_predictions(data['predictions'], resolution, start, end)
+    return data
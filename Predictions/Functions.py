@@ -1,151 +1,268 @@
 from firebase_admin import firestore
 import pandas as pd
 import itertools
-from sklearn.model_selection import train_test_split
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from prophet import Prophet
 from prophet.diagnostics import cross_validation, performance_metrics
+from concurrent.futures import wait, FIRST_COMPLETED
+from Predictions.Encoding import predictions_document, decode_document
+from Predictions.Pool import forecast_pools, FORECAST_WORKERS
+import math
+import os
+import time
+
+# Default hyperparameter grid searched by forecast_from_data
+DEFAULT_PARAM_GRID = {
+    'seasonality_mode': ['additive', 'multiplicative'],
+    'seasonality_prior_scale': [0.1, 1.0],
+    'changepoint_prior_scale': [0.01, 0.1]
+}
+# Prints the input diagnostics, grid search and forecast frame on every forecast
+FORECAST_DEBUG = os.getenv("FORECAST_DEBUG", "false").lower() in ("1", "true")
+# Share of the most recent history held out of training
+FORECAST_TEST_SIZE = 0.2
+# Cross-validation defaults: spacing/horizon of the folds, share of the history in the first fold
+FORECAST_PERIOD = '50 days'
+FORECAST_INITIAL_RATIO = 0.7
 
 # Function to save predictions from Firestore
-def SavePredictions(isin, predictions):
+def SavePredictions(isin, predictions, meta=None):
     try:
         # If predictions is a DataFrame, convert it to a list of dictionaries.
         if hasattr(predictions, "to_dict"):
             predictions = predictions.to_dict(orient="records")
             
         db = firestore.client()
-        db.collection("predictions").document(isin).set({"predictions": predictions})
+        db.collection("predictions").document(isin).set(predictions_document(predictions, meta))
         print(f"Document added with ID: {isin}")
         return predictions
     except Exception as e:
         print(f"An error occurred: {e}")
         
-# Function to get predictions from Firestore
-def GetPredictions(isin):
+# Horizon such as '90d', '12w', '3m' or '2y' to a number of days
+HORIZON_UNITS = {'d': 1, 'w': 7, 'm': 30, 'y': 365}
+
+
+def parse_horizon(horizon):
+    unit = horizon[-1:].lower()
+    if unit not in HORIZON_UNITS or not horizon[:-1].isdigit():
+        raise ValueError("horizon must look like 90d, 12w, 3m or 2y")
+    return int(horizon[:-1]) * HORIZON_UNITS[unit]
+
+
+def prediction_window(start=None, end=None, horizon=None, today=None):
+    # Inclusive [start, end] dates from the from/to/horizon query parameters,
+    # a horizon counts from `start` (today by default)
+    start = datetime.strptime(start, '%Y-%m-%d').date() if start else None
+    end = datetime.strptime(end, '%Y-%m-%d').date() if end else None
+    if horizon:
+        start = start or today or datetime.now(timezone.utc).date()
+        horizon_end = start + timedelta(days=parse_horizon(horizon))
+        end = min(end, horizon_end) if end else horizon_end
+    if start and end and start > end:
+        raise ValueError("from must not be after to")
+    return start, end
+
+
+# Function to get the predictions document snapshot from Firestore
+def GetPredictionsDoc(isin):
     try:
         db = firestore.client()
-        doc_ref = db.collection("predictions").document(isin)
-        doc = doc_ref.get()
+        doc = db.collection("predictions").document(isin).get()
         if doc.exists:
-            return doc.to_dict()
-        else:
-            print(f"No document found for ID: {isin}")
-            return None
+            return doc
+        print(f"No document found for ID: {isin}")
+        return None
     except Exception as e:
         print(f"An error occurred: {e}")
-        return None        
+        return None
+
+
+def predictions_payload(doc, resolution='daily', start=None, end=None):
+    data = decode_document(doc.to_dict(), resolution, start, end)
+    # meta is internal to the forecast cache
+    data.pop('meta', None)
+    return data
+
+
+# Function to get predictions from Firestore
+# resolution is 'daily', 'weekly' or 'monthly', start/end limit the dates returned
+def GetPredictions(isin, resolution='daily', start=None, end=None):
+    doc = GetPredictionsDoc(isin)
+    if doc is None:
+        return None
+    try:
+        return predictions_payload(doc, resolution, start, end)
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        return None
     
-# Function to process input data and return forecast
-def forecast_from_data(data):
-    # Convert input list to DataFrame
+# Fit and cross-validate one Prophet configuration, runs inside the process pool
+def evaluate_params(params, train_df, initial, period, cv_parallel=None):
+    started = time.perf_counter()
+    m = Prophet(**params)
+    m.fit(train_df)
+    df_cv = cross_validation(m, initial=initial, period=period, horizon=period, parallel=cv_parallel)
+    df_p = performance_metrics(df_cv, rolling_window=1)
+    return {
+        'params': params,
+        'rmse': float(df_p['rmse'].values[0]),
+        'seconds': round(time.perf_counter() - started, 3)
+    }
+
+
+# Grid search over Prophet configurations, at most `workers` at a time on one of
+# the shared forecast pools (see Predictions.Pool) when workers > 1. With a
+# time_budget (seconds) configurations not finished by then are dropped and the
+# pool's workers stopped, the first one is always evaluated.
+def search_params(all_params, train_df, initial, period, workers=None, cv_parallel=None, time_budget=None,
+                  debug=FORECAST_DEBUG):
+    started = time.perf_counter()
+    if workers is None:
+        # cross_validation(parallel=...) already spreads folds over the cores
+        workers = 1 if cv_parallel else FORECAST_WORKERS
+    workers = max(1, min(workers, forecast_pools.size, len(all_params)))
+
+    results = []
+    truncated = False
+    if workers > 1:
+        deadline = None if time_budget is None else started + time_budget
+        queued = iter(enumerate(all_params))
+        finished = {}
+        with forecast_pools.checkout() as pool:
+            def submit(count):
+                return {pool.submit(evaluate_params, params, train_df, initial, period, cv_parallel): index
+                        for index, params in itertools.islice(queued, count)}
+
+            running = submit(workers)
+            while running:
+                timeout = None if deadline is None or not finished else max(0, deadline - time.perf_counter())
+                done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    break
+                for future in done:
+                    finished[running.pop(future)] = future.result()
+                if deadline is not None and time.perf_counter() >= deadline:
+                    break
+                running.update(submit(len(done)))
+            truncated = bool(running) or next(queued, None) is not None
+            if running:
+                # Fits still running are stopped so the budget is a hard limit
+                pool.terminate()
+        results = [finished[index] for index in sorted(finished)]
+    else:
+        best_rmse = float('inf')
+        early_stop_counter = 0  # Initialize early stopping counter
+        for params in all_params:
+            if results and time_budget is not None and time.perf_counter() - started >= time_budget:
+                truncated = True
+                break
+            result = evaluate_params(params, train_df, initial, period, cv_parallel)
+            results.append(result)
+            if result['rmse'] < best_rmse:
+                best_rmse = result['rmse']
+                early_stop_counter = 0  # Reset counter
+            else:
+                early_stop_counter += 1
+            if early_stop_counter >= 5:  # Early stopping after 5 non-improving iterations
+                break
+
+    if debug:
+        for result in results:
+            print(f"Params {result['params']}: RMSE {result['rmse']:.4f} in {result['seconds']}s")
+    best = min(results, key=lambda result: result['rmse'])
+    return {
+        'best_params': best['params'],
+        'best_rmse': best['rmse'],
+        'configs': results,
+        'workers': workers,
+        'cv_parallel': cv_parallel,
+        'truncated': truncated,
+        'seconds': round(time.perf_counter() - started, 3)
+    }
+
+
+# Posterior means of a fitted model, Prophet.fit(init=...) warm-starts from them
+def stan_init(model):
+    res = {}
+    for pname in ['k', 'm', 'sigma_obs']:
+        res[pname] = float(model.params[pname][0][0])
+    for pname in ['delta', 'beta']:
+        res[pname] = [float(v) for v in model.params[pname][0]]
+    return res
+
+
+# ds/y frame Prophet trains on, in chronological order
+def prepare_series(data):
     df = pd.DataFrame(data, columns=['date', 'value'])
-    df['date'] = pd.to_datetime(df['date'])
+    series = pd.DataFrame({'ds': pd.to_datetime(df['date']), 'y': pd.to_numeric(df['value'])})
+    return series.sort_values(by='ds', kind='stable').reset_index(drop=True)
+
 
+def print_diagnostics(series, n_train):
     # Examine data types and missing values
-    print(df.info())
+    print(series.info())
     print("\nPercentage of missing values per column:")
-    print(df.isnull().sum() / len(df) * 100)
-
-    # Summarize numerical features
-    print("\nDescriptive statistics for numerical features:")
+    print(series.isnull().sum() / len(series) * 100)
 
     # Identify the time range
     print("\nTime Range:")
-    print(f"Earliest date: {df['date'].min()}")
-    print(f"Latest date: {df['date'].max()}")
-
-    # Calculate total time span
-    earliest_date = df['date'].min()
-    latest_date = df['date'].max()
-    time_span = latest_date - earliest_date
-    print(f"Total Time Span: {time_span.days} days")
-
-    # Calculate the correlation matrix (excluding the 'date' column)
-    correlation_matrix = df.drop(columns=['date']).corr()
-
-    # Sort the DataFrame chronologically by the 'date' column
-    df.sort_values(by='date', inplace=True)
-
-    # Create a new column representing the day of the week
-    df['DayOfWeek'] = df['date'].dt.dayofweek
-
-    # Create lagged features
-    for lag in [1, 7, 30]:
-        df[f'value_Lag_{lag}'] = df['value'].shift(lag).fillna(method='ffill')
-
-    # Create rolling statistics features
-    for window in [7, 30]:
-        df[f'value_Rolling_Mean_{window}'] = (
-            df['value'].rolling(window=window).mean().fillna(method='ffill')
-        )
-        df[f'value_Rolling_Std_{window}'] = (
-            df['value'].rolling(window=window).std().fillna(method='ffill')
-        )
-
-    # Extract month and year
-    df['Month'] = df['date'].dt.month
-    df['Year'] = df['date'].dt.year
-
-    # Define features (X) and target variable (y)
-    X = df.drop(columns=['date', 'value'])
-    y = df['value']
-
-    # Split data into training and testing sets using a time-based split
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, shuffle=False)
-
-    # Print the shapes of the training and testing sets
-    print("X_train shape:", X_train.shape)
-    print("y_train shape:", y_train.shape)
-    print("X_test shape:", X_test.shape)
-    print("y_test shape:", y_test.shape)
-
-    # Reduced parameter grid
-    param_grid = {
-        'seasonality_mode': ['additive', 'multiplicative'],
-        'seasonality_prior_scale': [0.1, 1.0],  
-        'changepoint_prior_scale': [0.01, 0.1]  
-    }
+    print(f"Earliest date: {series['ds'].min()}")
+    print(f"Latest date: {series['ds'].max()}")
+    print(f"Total Time Span: {(series['ds'].max() - series['ds'].min()).days} days")
 
-    # Generate all combinations of parameters
-    all_params = [dict(zip(param_grid.keys(), v))
-                  for v in itertools.product(*param_grid.values())]
+    print("Train rows:", n_train)
+    print("Test rows:", len(series) - n_train)
 
-    # Perform cross-validation and evaluate performance
-    best_params = None
-    best_rmse = float('inf')
-    early_stop_counter = 0  # Initialize early stopping counter
 
-    for params in all_params:
-        m = Prophet(**params)
-        m.fit(pd.DataFrame({'ds': df['date'][:len(X_train)], 'y': y_train}))
+# Function to process input data and return forecast
+# With `params` the grid search is skipped and the model is fit with them directly,
+# `init` (from stan_init) warm-starts that fit from a previous model
+# `period`, `initial_ratio` and `trim_outliers` tune the cross-validation and the IQR trimming
+def forecast_from_data(data, param_grid=None, workers=None, cv_parallel=None, params=None, init=None,
+                       time_budget=None, debug=None, period=FORECAST_PERIOD,
+                       initial_ratio=FORECAST_INITIAL_RATIO, trim_outliers=True):
+    debug = FORECAST_DEBUG if debug is None else debug
+    df = prepare_series(data)
 
-        # Dynamically calculate initial based on data size (≥70% of total history)
-        total_days = (df['date'].max() - df['date'].min()).days
-        initial_days = int(total_days * 0.7)
-        initial = f'{initial_days} days'
-  
-        period = '50 days'
+    # Time-based split, the most recent FORECAST_TEST_SIZE of the rows is held out
+    n_train = len(df) - math.ceil(len(df) * FORECAST_TEST_SIZE)
+    train_df = df.iloc[:n_train]
+    if debug:
+        print_diagnostics(df, n_train)
 
-    
-        # Perform cross-validation with dynamic parameters
-        df_cv = cross_validation(m, initial=initial, period=period, horizon=period)
-        df_p = performance_metrics(df_cv, rolling_window=1)
-        rmse = df_p['rmse'].values[0]
+    # Dynamically calculate initial based on data size (≥70% of total history by default)
+    total_days = (df['ds'].max() - df['ds'].min()).days
+    initial_days = int(total_days * initial_ratio)
+    initial = f'{initial_days} days'
 
-        if rmse < best_rmse:
-            best_rmse = rmse
-            best_params = params
-            early_stop_counter = 0  # Reset counter
-        else:
-            early_stop_counter += 1
+    if params is not None:
+        search = {'best_params': params, 'best_rmse': None, 'configs': [], 'reused': True}
+    else:
+        # Generate all combinations of parameters
+        param_grid = param_grid or DEFAULT_PARAM_GRID
+        all_params = [dict(zip(param_grid.keys(), v))
+                      for v in itertools.product(*param_grid.values())]
 
-        if early_stop_counter >= 5:  # Early stopping after 5 non-improving iterations
-            break
+        # Cross-validate every configuration and keep the lowest RMSE
+        search = search_params(all_params, train_df, initial, period, workers=workers,
+                               cv_parallel=cv_parallel, time_budget=time_budget, debug=debug)
+    best_params = search['best_params']
+    best_rmse = search['best_rmse']
 
     # Retrain the model with the best hyperparameters
-    print(f"Best parameters: {best_params}")
-    print(f"Best RMSE: {best_rmse}")
-    optimized_model = Prophet(**best_params).fit(pd.DataFrame({'ds': df['date'][:len(X_train)], 'y': y_train}))
+    if debug:
+        print(f"Best parameters: {best_params}")
+        print(f"Best RMSE: {best_rmse}")
+    optimized_model = None
+    if init is not None:
+        try:
+            optimized_model = Prophet(**best_params).fit(train_df, init=init)
+        except Exception as e:
+            # Shapes no longer match (e.g. a seasonality switched on), fit from scratch
+            print(f"Warm start failed, refitting from scratch: {e}")
+    if optimized_model is None:
+        optimized_model = Prophet(**best_params).fit(train_df)
 
     # Create future dataframe for predictions
     predictfor = 365 * 2
@@ -160,7 +277,8 @@ def forecast_from_data(data):
     forecast = optimized_model.predict(future)
 
     # Display the forecast
-    print(forecast[['ds', 'yhat', 'yhat_lower', 'yhat_upper']])
+    if debug:
+        print(forecast[['ds', 'yhat', 'yhat_lower', 'yhat_upper']])
 
     # Prepare the result DataFrame
     pred = forecast[['ds', 'yhat','yhat_lower','yhat_upper']].copy()
@@ -174,11 +292,15 @@ def forecast_from_data(data):
     pred = pred[(pred['value'] >= 0) & (pred['min'] >= 0) & (pred['max'] >= 0)]
 
     # Remove extreme values using IQR for the 'value' column
-    Q1 = pred['value'].quantile(0.25)
-    Q3 = pred['value'].quantile(0.75)
-    IQR = Q3 - Q1
-    lower_bound = Q1 - 1.5 * IQR
-    upper_bound = Q3 + 1.5 * IQR
-    pred = pred[(pred['value'] >= lower_bound) & (pred['value'] <= upper_bound)]
+    if trim_outliers:
+        Q1 = pred['value'].quantile(0.25)
+        Q3 = pred['value'].quantile(0.75)
+        IQR = Q3 - Q1
+        lower_bound = Q1 - 1.5 * IQR
+        upper_bound = Q3 + 1.5 * IQR
+        pred = pred[(pred['value'] >= lower_bound) & (pred['value'] <= upper_bound)]
 
+    # Keep the search report with the forecast for callers that log or store it
+    pred.attrs['search'] = search
+    pred.attrs['fit_params'] = stan_init(optimized_model)
     return pred
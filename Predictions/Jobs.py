@@ -0,0 +1,134 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from Predictions.Cache import cached_forecast, series_frame, series_fingerprint, grid_fingerprint
+from Predictions.Pool import FORECAST_JOB_WORKERS
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+# Seconds a finished job stays available for polling
+FORECAST_JOB_RETENTION = int(os.getenv("FORECAST_JOB_RETENTION", 3600))
+
+
+def payload_fingerprint(data, options):
+    # Submissions with the same fingerprint produce the same forecast
+    options = options or {}
+    try:
+        series = series_fingerprint(series_frame(data))
+    except Exception:
+        # Unparseable rows fail in the job, only identical ones coalesce
+        series = hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+    return (series, grid_fingerprint(options.get('param_grid')), bool(options.get('full_search')))
+
+
+class ForecastJobQueue:
+    # Runs cached_forecast (forecast + save) off the request thread on a
+    # bounded pool, one job per ISIN at a time. A submission for an ISIN with
+    # a queued job replaces its payload, so it runs the newest series. While
+    # a job is running, identical submissions are coalesced into it and a
+    # different one becomes a single follow-up job, started when the running
+    # one finishes and fed the newest payload submitted meanwhile.
+    def __init__(self, workers=FORECAST_JOB_WORKERS, retention=FORECAST_JOB_RETENTION):
+        self.retention = retention
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='forecast')
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._payloads = {}
+        self._active = {}
+        self._next = {}
+
+    def submit(self, isin, data, options=None):
+        fingerprint = payload_fingerprint(data, options)
+        with self._lock:
+            self._prune()
+            active_id = self._active.get(isin)
+            if active_id is not None:
+                job = self._jobs[active_id]
+                waiting_id = active_id if job['status'] == 'queued' else self._next.get(isin)
+                if waiting_id is None and job['_fingerprint'] == fingerprint:
+                    job['coalesced'] += 1
+                    return self.view(job), True
+                if waiting_id is not None:
+                    waiting = self._jobs[waiting_id]
+                    waiting['coalesced'] += 1
+                    waiting['_fingerprint'] = fingerprint
+                    self._payloads[waiting_id] = (data, options or {})
+                    return self.view(waiting), True
+                job = self._new_job(isin, data, options, fingerprint)
+                self._next[isin] = job['id']
+                return self.view(job), False
+
+            job = self._new_job(isin, data, options, fingerprint)
+            self._active[isin] = job['id']
+            self._executor.submit(self._run, job['id'])
+            return self.view(job), False
+
+    def _new_job(self, isin, data, options, fingerprint):
+        job_id = uuid.uuid4().hex
+        job = {
+            'id': job_id,
+            'isin': isin,
+            'status': 'queued',
+            'submittedAt': datetime.now(timezone.utc).isoformat(),
+            'startedAt': None,
+            'finishedAt': None,
+            'queueSeconds': None,
+            'runSeconds': None,
+            'coalesced': 0,
+            'result': None,
+            'error': None,
+            '_submitted': time.monotonic(),
+            '_fingerprint': fingerprint
+        }
+        self._jobs[job_id] = job
+        self._payloads[job_id] = (data, options or {})
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return self.view(job) if job else None
+
+    def view(self, job):
+        return {key: value for key, value in job.items() if not key.startswith('_')}
+
+    def _run(self, job_id):
+        with self._lock:
+            job = self._jobs[job_id]
+            data, options = self._payloads.pop(job_id)
+            started = time.monotonic()
+            job['status'] = 'running'
+            job['startedAt'] = datetime.now(timezone.utc).isoformat()
+            job['queueSeconds'] = round(started - job['_submitted'], 3)
+        try:
+            saved, report = cached_forecast(job['isin'], data, **options)
+            result = dict(report, rows=len(saved))
+            status, error = 'done', None
+        except Exception as e:
+            print(f"Forecast job {job_id} failed: {e}")
+            result, status, error = None, 'failed', str(e)
+        with self._lock:
+            finished = time.monotonic()
+            job['status'] = status
+            job['result'] = result
+            job['error'] = error
+            job['finishedAt'] = datetime.now(timezone.utc).isoformat()
+            job['runSeconds'] = round(finished - started, 3)
+            job['_finished'] = finished
+            if self._active.get(job['isin']) == job_id:
+                del self._active[job['isin']]
+                next_id = self._next.pop(job['isin'], None)
+                if next_id is not None:
+                    self._active[job['isin']] = next_id
+                    self._executor.submit(self._run, next_id)
+
+    def _prune(self):
+        cutoff = time.monotonic() - self.retention
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.get('_finished', cutoff + 1) < cutoff]:
+            del self._jobs[job_id]
+
+
+forecast_jobs = ForecastJobQueue()
@@ -0,0 +1,99 @@
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from multiprocessing.context import SpawnContext, SpawnProcess
+import os
+import queue
+import sys
+import threading
+import types
+
+# Grid search processes, defaults to every available core
+FORECAST_WORKERS = int(os.getenv("FORECAST_WORKERS", os.cpu_count() or 1))
+# Forecasts running at the same time, they split FORECAST_WORKERS between them
+FORECAST_JOB_WORKERS = int(os.getenv("FORECAST_JOB_WORKERS", 2))
+
+# Stands in for __main__ while a worker is started, see WorkerContext
+_WORKER_MAIN = types.ModuleType('__main__')
+_main_lock = threading.Lock()
+
+
+class WorkerProcess(SpawnProcess):
+    def start(self):
+        with _main_lock:
+            main = sys.modules['__main__']
+            sys.modules['__main__'] = _WORKER_MAIN
+            try:
+                super().start()
+            finally:
+                sys.modules['__main__'] = main
+
+
+class WorkerContext(SpawnContext):
+    # spawn context for process pools: forked children would inherit the
+    # parent's open gRPC channels. A spawned child normally re-runs the
+    # parent's __main__ first, under python app.py that is setupfirebase and
+    # the imports of every route. Workers are started with __main__ hidden,
+    # so they only import the modules of the calls they run. Created
+    # processes are kept so the owner of the pool can stop them.
+    def __init__(self):
+        super().__init__()
+        self.processes = []
+
+    def Process(self, *args, **kwargs):
+        process = WorkerProcess(*args, **kwargs)
+        self.processes.append(process)
+        return process
+
+    def terminate(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join()
+        self.processes = []
+
+
+class WorkerPool:
+    # Long-lived process pool, its workers start on the first submit
+    def __init__(self, workers):
+        self.workers = workers
+        self._context = None
+        self._executor = None
+
+    def submit(self, fn, *args):
+        if self._executor is None:
+            self._context = WorkerContext()
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=self._context)
+        return self._executor.submit(fn, *args)
+
+    def terminate(self):
+        # Drops queued calls and kills the running ones, the next submit
+        # starts fresh workers
+        if self._executor is None:
+            return
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._context.terminate()
+        self._context = self._executor = None
+
+
+class ForecastPools:
+    # One WorkerPool per forecast that can run at the same time, sized once
+    # so together they use FORECAST_WORKERS processes. A grid search checks a
+    # pool out for its whole run, so stopping its remaining fits never
+    # touches another search.
+    def __init__(self, pools=FORECAST_JOB_WORKERS, workers=FORECAST_WORKERS):
+        pools = max(1, pools)
+        self.size = max(1, workers // pools)
+        self._free = queue.Queue()
+        for _ in range(pools):
+            self._free.put(WorkerPool(self.size))
+
+    @contextmanager
+    def checkout(self):
+        pool = self._free.get()
+        try:
+            yield pool
+        finally:
+            self._free.put(pool)
+
+
+forecast_pools = ForecastPools()
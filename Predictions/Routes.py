@@ -1,5 +1,10 @@
-from flask import Blueprint, request, jsonify
-from Predictions.Functions import forecast_from_data,SavePredictions,GetPredictions
+from flask import Blueprint, request, jsonify, make_response
+from werkzeug.http import is_resource_modified
+from Predictions.Functions import GetPredictionsDoc, predictions_payload, prediction_window
+from Predictions.Cache import cached_forecast
+from Predictions.Jobs import forecast_jobs
+from Predictions.Batch import batch_runner
+import hashlib
 
 
 MutualFundsRoutes = Blueprint('MutualFundsRoutes', __name__)
@@ -8,19 +13,82 @@ MutualFundsRoutes = Blueprint('MutualFundsRoutes', __name__)
 def predict(id):
     if request.method == 'POST':
         try:
-            data = request.get_json() 
-            prediction = forecast_from_data(data)
-            response = SavePredictions(id, prediction)  
-            if(response):
-                return jsonify({"data": response}), 200
+            body = request.get_json()
+            # Body is either the [date, value] rows or {"data": rows, "param_grid": {...}}
+            data = body.get('data') if isinstance(body, dict) else body
+            param_grid = body.get('param_grid') if isinstance(body, dict) else None
+            workers = request.args.get('workers', type=int)
+            cv_parallel = request.args.get('cv_parallel')
+            if cv_parallel not in (None, 'processes', 'threads'):
+                return jsonify({"error": "cv_parallel must be 'processes' or 'threads'"}), 400
+            # ?full_search=1 reruns the grid search even when stored hyperparameters could be reused
+            full_search = request.args.get('full_search', '').lower() in ('1', 'true')
+            options = {'param_grid': param_grid, 'workers': workers, 'cv_parallel': cv_parallel, 'full_search': full_search}
+            # ?sync=1 keeps the old behaviour of training inside the request
+            if request.args.get('sync', '').lower() in ('1', 'true'):
+                response, report = cached_forecast(id, data, **options)
+                return jsonify({"data": response, "cache": report['cache']}), 200
+            job, coalesced = forecast_jobs.submit(id, data, options)
+            return jsonify({"data": job, "coalesced": coalesced}), 202
         except Exception as e:
             return jsonify({"error": str(e)}), 500
     if request.method == 'GET':
         try:
-            response = GetPredictions(id)
-            if response is None:
+            resolution = request.args.get('resolution', 'daily')
+            if resolution not in ('daily', 'weekly', 'monthly'):
+                return jsonify({"error": "resolution must be 'daily', 'weekly' or 'monthly'"}), 400
+            # ?from=YYYY-MM-DD&to=YYYY-MM-DD and/or ?horizon=3m (from today unless from is given)
+            try:
+                start, end = prediction_window(request.args.get('from'), request.args.get('to'),
+                                               request.args.get('horizon'))
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            doc = GetPredictionsDoc(id)
+            if doc is None:
                 return jsonify({"message": "No predictions found"}), 404
-            
-            return jsonify({"data": response}), 200
+
+            # Validators change whenever the document is rewritten or the window moves,
+            # a revalidation that matches is answered before anything is decoded
+            last_modified = doc.update_time
+            etag = hashlib.sha1(f"{id}|{last_modified.isoformat()}|{resolution}|{start}|{end}".encode()).hexdigest()
+            if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+                response = make_response(jsonify({"data": predictions_payload(doc, resolution, start, end)}), 200)
+            else:
+                response = make_response('', 304)
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            response.cache_control.public = True
+            response.cache_control.no_cache = True
+            return response
         except Exception as e:
             return jsonify({"error": str(e)}), 500
+
+
+@MutualFundsRoutes.route("/predict/jobs/<job>", methods=['GET'])
+def predict_job(job):
+    response = forecast_jobs.get(job)
+    if response is None:
+        return jsonify({"message": "No job found"}), 404
+    return jsonify({"data": response}), 200
+
+
+# Admin: forecast many funds in the background, GET returns the running or last report
+@MutualFundsRoutes.route("/predict/batch", methods=['GET','POST'])
+def predict_batch():
+    if request.method == 'GET':
+        return jsonify({"data": batch_runner.status()}), 200
+    try:
+        body = request.get_json(silent=True) or {}
+        options = {'full_search': bool(body.get('full_search', False))}
+        if body.get('workers') is not None:
+            options['workers'] = int(body['workers'])
+        if body.get('time_budget') is not None:
+            options['time_budget'] = float(body['time_budget'])
+        if body.get('param_grid') is not None:
+            options['param_grid'] = body['param_grid']
+        started = batch_runner.start(isins=body.get('isins'), **options)
+        if not started:
+            return jsonify({"error": "A forecast batch is already running"}), 409
+        return jsonify({"data": batch_runner.status()}), 202
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
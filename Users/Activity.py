@@ -0,0 +1,117 @@
+from firebase_admin import firestore
+from Chapters.Index import get_course_indexes
+from Courses.Stats import parse_time
+from Helpers.BatchRead import get_snapshots
+import sys
+
+
+def reconstruct_activity(db, enrolled_courses):
+    # One event per enrolled course rebuilt from the enrollment state, the
+    # feed for users whose actions predate the activity stream
+    recent_activity = []
+    indexes = get_course_indexes(db, enrolled_courses.keys())
+    course_docs = get_snapshots(db, "courses", enrolled_courses.keys())
+
+    for course_id, course_info in enrolled_courses.items():
+        course_doc = course_docs.get(course_id)
+        course_name = course_doc.to_dict().get(
+            "title") if course_doc is not None and course_doc.exists else "Unknown Course"
+
+        completed_chapters = course_info.get("completedChapters", [])
+        progress = course_info.get("progress", 0)
+        enrolled_at = course_info.get("enrolledAt")
+        last_active = course_info.get("lastActive")
+
+        activity = None
+        index = indexes[course_id]
+
+        # If user has 0 completed lessons, return "Enrolled in Course"
+        if not completed_chapters:
+            if enrolled_at:
+                activity = {
+                    "type": "Enrolled in Course",
+                    "name": course_name,
+                    "time": enrolled_at
+                }
+        else:
+            # Completed lessons activity
+            chapter_id = completed_chapters[-1]
+            chapter_name = index.titles.get(chapter_id) or "Unknown Chapter"
+            activity = {
+                "type": "Completed Lesson",
+                "name": chapter_name,
+                "time": last_active
+            }
+
+            # Ongoing course activity (if not completed)
+            if 0 < progress < 100:
+                activity = {
+                    "type": "Ongoing Course",
+                    "name": course_name,
+                    "time": last_active
+                }
+
+            # Started lessons activity (if there are chapters not completed)
+            next_chapter = index.next_chapter(completed_chapters)
+            if next_chapter is not None:
+                activity = {
+                    "type": "Started Lesson",
+                    "name": index.titles.get(next_chapter) or "Unknown Chapter",
+                    "time": last_active
+                }
+
+        if activity:
+            activity["courseId"] = course_id
+            recent_activity.append(activity)
+
+    # Sort activities by time in descending order
+    recent_activity.sort(key=lambda x: x["time"], reverse=True)
+    return recent_activity
+
+
+def backfill_activity(db=None):
+    # One-off job: writes the reconstructed events of every user to the
+    # activity stream. Courses that already have recorded events (actions
+    # since the stream was deployed) are left out, they are newer than the
+    # reconstruction. Each user is one batch with the activityBackfilled
+    # marker on the user, so an interrupted run can be restarted.
+    db = db or firestore.client()
+    report = {'users': 0, 'skipped': 0, 'events': 0, 'failed': 0}
+
+    for user_doc in db.collection("users").select(["enrolledCourses", "activityBackfilled"]).stream():
+        report['users'] += 1
+        user_data = user_doc.to_dict() or {}
+        if user_data.get("activityBackfilled"):
+            report['skipped'] += 1
+            continue
+        recorded = {(doc.to_dict() or {}).get("courseId") for doc in
+                    db.collection("activity").where("userId", "==", user_doc.id).select(["courseId"]).stream()}
+        enrolled_courses = {course_id: course_info for course_id, course_info
+                            in (user_data.get("enrolledCourses") or {}).items() if course_id not in recorded}
+        batch = db.batch()
+        events = 0
+        for activity in reconstruct_activity(db, enrolled_courses):
+            time = parse_time(activity["time"])
+            if time is None:
+                continue
+            event_ref = db.collection("activity").document(f"backfill-{user_doc.id}-{activity['courseId']}")
+            batch.set(event_ref, dict(activity, userId=user_doc.id, time=time, backfilled=True))
+            events += 1
+        batch.update(user_doc.reference, {"activityBackfilled": True})
+        try:
+            batch.commit()
+            report['events'] += events
+        except Exception as e:
+            print(f"Error backfilling activity for {user_doc.id}: {e}")
+            report['failed'] += 1
+    return report
+
+
+if __name__ == '__main__':
+    # Run once after the activity stream is deployed: python -m Users.Activity backfill
+    from Firebase import setupfirebase
+    if len(sys.argv) < 2 or sys.argv[1] != 'backfill':
+        print("Usage: python -m Users.Activity backfill")
+        sys.exit(1)
+    setupfirebase()
+    print(backfill_activity())
@@ -1,6 +1,12 @@
 from firebase_admin import firestore
-from datetime import datetime, timezone, timedelta
+from datetime import datetime, timezone
 from collections import defaultdict
+from Chapters.Index import get_course_index, get_course_indexes
+from Courses.Stats import record_enrollment_change
+from Users.LearningStats import get_learning_stats, invalidate_learning_stats
+from Users.Activity import reconstruct_activity
+from Helpers.Activity import record_activity, activity_feed
+from Helpers.Pagination import Page
 
 
 def Enroll(id, request):
@@ -26,10 +32,14 @@ def Enroll(id, request):
             "lastActive": datetime.now(timezone.utc).isoformat()
         }
 
+        # A repeated enrollment replaces the previous one
+        previous_enrollment = user_doc.to_dict().get("enrolledCourses", {}).get(course_id)
+
         # Update the user's enrolledCourses map
         user_ref.update({
             f"enrolledCourses.{course_id}": course_enrollment
         })
+        invalidate_learning_stats(id)
 
         # Add user to course's enrolledStudents array
         course_ref = db.collection("courses").document(course_id)
@@ -39,6 +49,9 @@ def Enroll(id, request):
         course_ref.update({
             "enrolledStudents": firestore.ArrayUnion([str(id)])
         })
+        record_enrollment_change(db, course_id, previous_enrollment, course_enrollment)
+        record_activity(db, id, "Enrolled in Course", course_doc.to_dict().get("title") or "Unknown Course",
+                        courseId=course_id)
 
         return {"message": "Enrollment successful"}, 200
     except Exception as e:
@@ -93,41 +106,14 @@ def GetProgress(id):
         user_data = user_doc.to_dict()
         enrolled_courses = user_data.get("enrolledCourses", {})
         progress_list = []
+        indexes = get_course_indexes(db, enrolled_courses.keys())
         for course_id, course_info in enrolled_courses.items():
             completed_chapters = course_info.get("completedChapters", [])
-            current_chapter = None
-
-            # Fetch chapters by course_id from the chapters collection
-            chapters_query = db.collection("chapters").where(
-                "courseId", "==", course_id).order_by("order")
-            chapters_docs = chapters_query.stream()
-            chapters = [doc.id for doc in chapters_docs]
-            total_chapters = len(chapters)
-
-            # Calculate progress as percentage of completed chapters
-            completed_count = sum(
-                1 for ch in chapters if ch in completed_chapters)
-            progress = (completed_count / total_chapters) * \
-                100 if total_chapters > 0 else 0
-
-            # Find the next chapter if the last completed is not the last chapter
-            if chapters:
-                if completed_chapters:
-                    last_completed = completed_chapters[-1]
-                    if last_completed in chapters:
-                        idx = chapters.index(last_completed)
-                        if idx < len(chapters) - 1:
-                            current_chapter = chapters[idx + 1]
-                        else:
-                            current_chapter = last_completed
-                    else:
-                        current_chapter = chapters[0]
-                else:
-                    current_chapter = chapters[0]
+            index = indexes[course_id]
             progress_list.append({
                 "courseId": course_id,
-                "progress": progress,
-                "currentChapter": current_chapter
+                "progress": index.progress(completed_chapters),
+                "currentChapter": index.current_chapter(completed_chapters)
             })
         return progress_list
     except Exception as e:
@@ -149,36 +135,11 @@ def GetSingleProgress(id, course_id):
             return None
 
         completed_chapters = course_info.get("completedChapters", [])
-        current_chapter = None
-
-        chapters_query = db.collection("chapters").where(
-            "courseId", "==", course_id).order_by("order")
-        chapters_docs = chapters_query.stream()
-        chapters = [doc.id for doc in chapters_docs]
-        total_chapters = len(chapters)
-
-        completed_count = sum(1 for ch in chapters if ch in completed_chapters)
-        progress = (completed_count / total_chapters) * \
-            100 if total_chapters > 0 else 0
-
-        if chapters:
-            if completed_chapters:
-                last_completed = completed_chapters[-1]
-                if last_completed in chapters:
-                    idx = chapters.index(last_completed)
-                    if idx < len(chapters) - 1:
-                        current_chapter = chapters[idx + 1]
-                    else:
-                        current_chapter = last_completed
-                else:
-                    current_chapter = chapters[0]
-            else:
-                current_chapter = chapters[0]
-
+        index = get_course_index(db, course_id)
         return {
             "courseId": course_id,
-            "progress": progress,
-            "currentChapter": current_chapter
+            "progress": index.progress(completed_chapters),
+            "currentChapter": index.current_chapter(completed_chapters)
         }
     except Exception as e:
         print(f"An error occurred: {e}")
@@ -206,26 +167,26 @@ def UpdateProgress(id, request):
         if not course_info:
             return {"error": "User not enrolled in this course"}, 400
 
-        completed_chapters = course_info.get("completedChapters", [])
-        if chapter_id not in completed_chapters:
+        completed_chapters = list(course_info.get("completedChapters", []))
+        newly_completed = chapter_id not in completed_chapters
+        if newly_completed:
             completed_chapters.append(chapter_id)
 
-        # Fetch all chapters for the course to calculate progress
-        chapters_query = db.collection("chapters").where(
-            "courseId", "==", course_id).order_by("order")
-        chapters_docs = chapters_query.stream()
-        chapters = [doc.id for doc in chapters_docs]
-        total_chapters = len(chapters)
-        completed_count = sum(1 for ch in chapters if ch in completed_chapters)
-        progress = (completed_count / total_chapters) * \
-            100 if total_chapters > 0 else 0
+        index = get_course_index(db, course_id)
+        progress = index.progress(completed_chapters)
 
         # Update the enrolledCourses.<course_id> map
-        user_ref.update({
-            f"enrolledCourses.{course_id}.completedChapters": completed_chapters,
-            f"enrolledCourses.{course_id}.progress": progress,
-            f"enrolledCourses.{course_id}.lastActive": datetime.now(timezone.utc).isoformat()
-        })
+        updated = {
+            "completedChapters": completed_chapters,
+            "progress": progress,
+            "lastActive": datetime.now(timezone.utc).isoformat()
+        }
+        user_ref.update({f"enrolledCourses.{course_id}.{field}": value for field, value in updated.items()})
+        invalidate_learning_stats(id)
+        record_enrollment_change(db, course_id, course_info, dict(course_info, **updated))
+        if newly_completed:
+            record_activity(db, id, "Completed Lesson", index.titles.get(chapter_id) or "Unknown Chapter",
+                            courseId=course_id, chapterId=chapter_id)
 
         return {"message": "Progress updated successfully", "data": progress}, 200
     except Exception as e:
@@ -236,181 +197,42 @@ def UpdateProgress(id, request):
 def GetUserLearningStats(id):
     try:
         db = firestore.client()
-        user_ref = db.collection("users").document(id)
-        user_doc = user_ref.get()
-        if not user_doc.exists:
+        stats = get_learning_stats(db, id)
+        if stats is None:
             return {"error": "User not found"}, 404
-
-        user_data = user_doc.to_dict()
-        enrolled_courses = user_data.get("enrolledCourses", {})
-        total_completed_chapters = 0
-        total_remaining_chapters = 0
-        total_duration = 0
-        duration_this_week = 0
-        total_certificates = 0
-        pending_certificates = 0
-        average_completion_rate = 0
-
-        for course_id, course_info in enrolled_courses.items():
-            completed_chapters = course_info.get("completedChapters", [])
-            last_active_str = course_info.get("lastActive")
-            last_active = datetime.fromisoformat(
-                last_active_str) if last_active_str else datetime.min
-            total_completed_chapters += len(completed_chapters)
-
-            # Fetch all chapters for the course
-            chapters_query = db.collection("chapters").where(
-                "courseId", "==", course_id).order_by("order")
-            chapters_docs = chapters_query.stream()
-            chapters = [doc.id for doc in chapters_docs]
-            total_chapters = len(chapters)
-            total_remaining_chapters += total_chapters - \
-                len(completed_chapters)
-
-            # Calculate total duration and duration this week
-            for chapter_id in completed_chapters:
-                chapter_ref = db.collection("chapters").document(chapter_id)
-                chapter_doc = chapter_ref.get()
-                if chapter_doc.exists:
-                    chapter_data = chapter_doc.to_dict()
-                    chapter_duration = chapter_data.get(
-                        "duration", 0)  # Assume duration is in minutes
-                    try:
-                        chapter_duration = float(chapter_duration)
-                    except (ValueError, TypeError):
-                        chapter_duration = 0
-                    total_duration += chapter_duration
-                    if last_active >= datetime.now(timezone.utc) - timedelta(days=7):
-                        duration_this_week += chapter_duration
-
-            # Calculate certificates
-            if len(completed_chapters) == total_chapters:
-                total_certificates += 1
-            elif total_chapters - len(completed_chapters) <= 2:
-                pending_certificates += 1
-
-            # Calculate average completion rate
-            if total_chapters > 0:
-                average_completion_rate += float(
-                    len(completed_chapters) / total_chapters) * 100
-
-        # Finalize average completion rate
-        if enrolled_courses:
-            average_completion_rate /= len(enrolled_courses)
-
-        return {
-            "totalCompletedChapters": total_completed_chapters,
-            "totalRemainingChapters": total_remaining_chapters,
-            "totalDuration": total_duration,
-            "durationThisWeek": duration_this_week,
-            "averageCompletionRate": average_completion_rate,
-            "totalCertificates": total_certificates,
-            "pendingCertificates": pending_certificates
-        }, 200
+        return stats, 200
     except Exception as e:
         print(f"An error occurred: {e}")
         return {"error": str(e)}, 500
 
 
-def GetRecentActivity(id):
+def GetRecentActivity(id, limit=None, cursor=None):
     try:
         db = firestore.client()
-        user_ref = db.collection("users").document(id)
-        user_doc = user_ref.get()
-        if not user_doc.exists:
-            return {"error": "User not found"}, 404
-
-        user_data = user_doc.to_dict()
-        enrolled_courses = user_data.get("enrolledCourses", {})
-        recent_activity = []
-
-        for course_id, course_info in enrolled_courses.items():
-            # Fetch course details
-            course_ref = db.collection("courses").document(course_id)
-            course_doc = course_ref.get()
-            course_name = course_doc.to_dict().get(
-                "title") if course_doc.exists else "Unknown Course"
-
-            completed_chapters = course_info.get("completedChapters", [])
-            progress = course_info.get("progress", 0)
-            enrolled_at = course_info.get("enrolledAt")
-            last_active = course_info.get("lastActive")
-
-            activity = None
-
-            # If user has 0 completed lessons, return "Enrolled in Course"
-            if not completed_chapters:
-                if enrolled_at:
-                    activity = {
-                        "type": "Enrolled in Course",
-                        "name": course_name,
-                        "time": enrolled_at
-                    }
-            else:
-                # Completed lessons activity
-                chapter_id = completed_chapters[-1]
-                chapter_ref = db.collection("chapters").document(chapter_id)
-                chapter_doc = chapter_ref.get()
-                chapter_name = chapter_doc.to_dict().get(
-                    "title") if chapter_doc.exists else "Unknown Chapter"
-                activity = {
-                    "type": "Completed Lesson",
-                    "name": chapter_name,
-                    "time": last_active
-                }
-
-                # Ongoing course activity (if not completed)
-                if 0 < progress < 100:
-                    activity = {
-                        "type": "Ongoing Course",
-                        "name": course_name,
-                        "time": last_active
-                    }
-
-                # Started lessons activity (if there are chapters not completed)
-                chapters_query = db.collection("chapters").where(
-                    "courseId", "==", course_id).order_by("order")
-                chapters_docs = chapters_query.stream()
-                chapters = [doc.id for doc in chapters_docs]
-                for chapter_id in chapters:
-                    if chapter_id not in completed_chapters:
-                        chapter_ref = db.collection(
-                            "chapters").document(chapter_id)
-                        chapter_doc = chapter_ref.get()
-                        chapter_name = chapter_doc.to_dict().get(
-                            "title") if chapter_doc.exists else "Unknown Chapter"
-                        activity = {
-                            "type": "Started Lesson",
-                            "name": chapter_name,
-                            "time": last_active
-                        }
-                        break
-
-            if activity:
-                recent_activity.append(activity)
-
-        # Sort activities by time in descending order
-        recent_activity.sort(key=lambda x: x["time"], reverse=True)
-
-        return recent_activity, 200
+        try:
+            events, next_cursor = activity_feed(db, id, limit, cursor)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+
+        if not events and not cursor:
+            # Nothing recorded yet, rebuild the feed from the enrollments
+            user_doc = db.collection("users").document(id).get()
+            if not user_doc.exists:
+                return {"error": "User not found"}, 404
+            events = reconstruct_activity(db, user_doc.to_dict().get("enrolledCourses", {}))
+
+        return {"data": events, "nextCursor": next_cursor}, 200
     except Exception as e:
         print(f"An error occurred: {e}")
         return {"error": str(e)}, 500
 
 
-def GetAll():
+def GetAll(limit=None, cursor=None, fields=None, stream=False):
     try:
         db = firestore.client()
-        users_ref = db.collection("users")
-        users_docs = users_ref.stream()
-
-        users = []
-        for doc in users_docs:
-            user_data = doc.to_dict()
-            user_data["id"] = doc.id
-            users.append(user_data)
-
-        return users, 200
+        # Paged by document id and projected to `fields`, see Helpers.Pagination
+        page = Page(db.collection("users"), limit, cursor, fields)
+        return (page if stream else page.payload()), 200
     except Exception as e:
         print(f"An error occurred: {e}")
         return {"error": str(e)}, 500
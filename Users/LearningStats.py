@@ -0,0 +1,90 @@
+from datetime import datetime, timezone, timedelta
+from Helpers.TTLCache import TTLCache
+from Chapters.Index import chapter_index, get_course_indexes
+import os
+
+# Stats change on UpdateProgress and Enroll, which invalidate the user. The
+# TTL bounds other instances' writes and the moving "this week" window.
+LEARNING_STATS_TTL = int(os.getenv("LEARNING_STATS_TTL", 300))
+LEARNING_STATS_SIZE = int(os.getenv("LEARNING_STATS_SIZE", 5000))
+
+# user id -> (stats, {course_id: CourseIndex the stats were computed with})
+learning_stats_cache = TTLCache(maxsize=LEARNING_STATS_SIZE, ttl=LEARNING_STATS_TTL)
+
+
+def learning_stats(enrolled_courses, indexes, now=None):
+    now = now or datetime.now(timezone.utc)
+    total_completed_chapters = 0
+    total_remaining_chapters = 0
+    total_duration = 0
+    duration_this_week = 0
+    total_certificates = 0
+    pending_certificates = 0
+    average_completion_rate = 0
+
+    for course_id, course_info in enrolled_courses.items():
+        completed_chapters = course_info.get("completedChapters", [])
+        last_active_str = course_info.get("lastActive")
+        last_active = datetime.fromisoformat(
+            last_active_str) if last_active_str else datetime.min.replace(tzinfo=timezone.utc)
+        total_completed_chapters += len(completed_chapters)
+
+        index = indexes[course_id]
+        total_chapters = len(index)
+        total_remaining_chapters += total_chapters - \
+            len(completed_chapters)
+
+        # Calculate total duration and duration this week
+        chapter_duration = index.completed_duration(completed_chapters)
+        total_duration += chapter_duration
+        if last_active >= now - timedelta(days=7):
+            duration_this_week += chapter_duration
+
+        # Calculate certificates
+        if len(completed_chapters) == total_chapters:
+            total_certificates += 1
+        elif total_chapters - len(completed_chapters) <= 2:
+            pending_certificates += 1
+
+        # Calculate average completion rate
+        if total_chapters > 0:
+            average_completion_rate += float(
+                len(completed_chapters) / total_chapters) * 100
+
+    # Finalize average completion rate
+    if enrolled_courses:
+        average_completion_rate /= len(enrolled_courses)
+
+    return {
+        "totalCompletedChapters": total_completed_chapters,
+        "totalRemainingChapters": total_remaining_chapters,
+        "totalDuration": total_duration,
+        "durationThisWeek": duration_this_week,
+        "averageCompletionRate": average_completion_rate,
+        "totalCertificates": total_certificates,
+        "pendingCertificates": pending_certificates
+    }
+
+
+def get_learning_stats(db, user_id):
+    # Memoized stats of a user, None when the user does not exist. An entry is
+    # only served while every course index it used is still the cached one,
+    # so chapter edits invalidate it through Chapters.Index.
+    cached = learning_stats_cache.get(user_id)
+    if cached is not None:
+        stats, indexes = cached
+        if all(chapter_index.get(course_id) is index for course_id, index in indexes.items() if course_id):
+            return stats
+
+    user_doc = db.collection("users").document(user_id).get()
+    if not user_doc.exists:
+        return None
+    enrolled_courses = user_doc.to_dict().get("enrolledCourses", {})
+    indexes = get_course_indexes(db, enrolled_courses.keys())
+    stats = learning_stats(enrolled_courses, indexes)
+    learning_stats_cache.set(user_id, (stats, indexes))
+    return stats
+
+
+def invalidate_learning_stats(user_id):
+    learning_stats_cache.invalidate(user_id)
@@ -1,4 +1,5 @@
 from flask import Blueprint, request, jsonify
+from Helpers.Pagination import page_params, page_response, paged
 from Users.Functions import Enroll, GetCourses, GetStateCourses, GetProgress, GetSingleProgress, UpdateProgress, \
     GetUserLearningStats, GetRecentActivity, GetAll, SavePreferences, GetInformation, SaveSystemPreferences, UpdateSystemPreferencesRefused, \
     GetManagerId, GetManagedUsers
@@ -83,11 +84,16 @@ def OverAllProgress(id):
 def Activity(id):
     if request.method == 'GET':
         try:
-            response = GetRecentActivity(id)
-            if response is None:
-                return jsonify({"message": "No courses found"}), 404
-
-            return jsonify({"data": response}), 200
+            # ?limit=N&cursor=<last event id> pages back through the feed
+            limit = request.args.get('limit', type=int)
+            if limit is not None and limit <= 0:
+                return jsonify({"error": "limit must be a positive integer"}), 400
+            cursor = request.args.get('cursor')
+            response, status = GetRecentActivity(id, limit, cursor)
+            if limit is None and cursor is None:
+                # Unpaged requests keep the original body, {"data": [activities, status]}
+                return jsonify({"data": [response["data"] if status == 200 else response, status]}), 200
+            return jsonify(response), status
         except Exception as e:
             return jsonify({"error": str(e)}), 500
 
@@ -95,14 +101,16 @@ def Activity(id):
 @UsersRoutes.route(baseurl + "/all", methods=['GET'])
 def Users():
     if request.method == 'GET':
+        # ?limit=N&cursor=<last id>&fields=a,b&stream=1, see Helpers.Pagination
         try:
-            response = GetAll()
-            if response is None:
-                return jsonify({"message": "No courses found"}), 404
-
-            return jsonify(response), 200
-        except Exception as e:
-            return jsonify({"error": str(e)}), 500
+            params = page_params(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        response, status = GetAll(*params)
+        if status == 200 and not paged(request.args):
+            # Unpaged requests keep the original body, a JSON array [users, 200]
+            return jsonify([response["data"], 200]), 200
+        return page_response(response, status)
 
 
 @UsersRoutes.route(baseurl + "/preferences/<id>", methods=['GET', 'POST'])